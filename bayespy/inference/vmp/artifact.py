@@ -0,0 +1,281 @@
+######################################################################
+# Copyright (C) 2013 Jaakko Luttinen
+#
+# This file is licensed under Version 3.0 of the GNU General Public
+# License. See LICENSE for a text of the license.
+######################################################################
+
+######################################################################
+# This file is part of BayesPy.
+#
+# BayesPy is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# BayesPy is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with BayesPy.  If not, see <http://www.gnu.org/licenses/>.
+######################################################################
+
+"""
+Self-describing model artifacts with memory-mapped state.
+
+`VB.save` stores only the arrays of the nodes, thus the same model must be
+constructed in Python before `VB.load`.  A model artifact also records how
+the nodes were constructed: the node classes (or the factories of the
+classes), the constructor arguments, the parent edges, the plates and the
+dimensions.  Thus, the model can be loaded without the code that constructed
+it::
+
+    save_artifact('model', Y, X, Lambda, z, alpha)
+    ...
+    (Y, X, Lambda, z, alpha) = load_artifact('model')
+
+The artifact is a directory containing the description in ``graph.json`` and
+each array in a separate uncompressed ``.npy`` file.  Arrays that are
+broadcast views are stored in the compact form.  The state arrays are loaded
+with `numpy.load` using memory mapping, thus loading is fast and the pages of
+the arrays are shared by all the processes that load the same artifact.  The
+memory-mapped arrays are read-only, which is safe because the updates replace
+the arrays of the moments and the parameters instead of modifying them.
+
+The nodes are constructed again by calling the recorded constructors, thus
+the classes must be importable (or created by a recorded factory, such as
+`Mixture`) and the constructor arguments must be nodes, arrays, sparse
+matrices, classes, functions or plain Python values.
+"""
+
+import os
+import json
+import importlib
+
+import numpy as np
+import scipy.sparse as sparse
+
+from bayespy.utils import utils
+from bayespy.inference.vmp.nodes.node import Node
+
+
+def _reference(obj, encode):
+    """
+    Encode an importable class or function.
+
+    Classes constructed by a class factory are encoded as the factory call.
+    """
+    factory = getattr(obj, '_factory', None)
+    if isinstance(obj, type) and factory is not None:
+        return dict(factory=_reference(factory[0], encode),
+                    args=encode(list(factory[1])),
+                    kwargs=encode(dict(factory[2]))['dict'])
+    name = '%s:%s' % (obj.__module__, obj.__qualname__)
+    if '<locals>' in name:
+        raise ValueError("Can not record %s because it is not importable"
+                         % name)
+    return dict(ref=name)
+
+
+def _dereference(spec, decode):
+    """
+    Import a class or a function, or construct a class by its factory.
+    """
+    if 'factory' in spec:
+        factory = _dereference(spec['factory'], decode)
+        kwargs = {key: decode(x) for (key, x) in spec['kwargs'].items()}
+        return factory(*decode(spec['args']), **kwargs)
+    (module, qualname) = spec['ref'].split(':')
+    obj = importlib.import_module(module)
+    for name in qualname.split('.'):
+        obj = getattr(obj, name)
+    return obj
+
+
+class _Writer():
+    """
+    Encode the constructor calls and write the arrays of an artifact.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.ids = {}
+        self.records = []
+        os.makedirs(os.path.join(path, 'arrays'), exist_ok=True)
+
+    def array(self, x, name):
+        """
+        Write an array in the compact uncompressed form.
+        """
+        x = np.asarray(x)
+        filename = '%s.npy' % name
+        np.save(os.path.join(self.path, 'arrays', filename),
+                utils.compact_broadcast(x))
+        return dict(array=filename, shape=list(np.shape(x)))
+
+    def value(self, x, name):
+        """
+        Encode a constructor argument.
+        """
+        if isinstance(x, Node):
+            return dict(node=self.node(x))
+        elif isinstance(x, tuple):
+            return dict(tuple=[self.value(xi, '%s_%d' % (name, i))
+                               for (i, xi) in enumerate(x)])
+        elif isinstance(x, list):
+            return [self.value(xi, '%s_%d' % (name, i))
+                    for (i, xi) in enumerate(x)]
+        elif isinstance(x, dict):
+            return dict(dict={key: self.value(xi, '%s_%s' % (name, key))
+                              for (key, xi) in x.items()})
+        elif x is None or isinstance(x, (bool, int, float, str)):
+            return x
+        elif isinstance(x, np.generic):
+            return x.item()
+        elif sparse.issparse(x):
+            x = sparse.csc_matrix(x)
+            return dict(sparse=dict(data=self.array(x.data, name + '_data'),
+                                    indices=self.array(x.indices,
+                                                       name + '_indices'),
+                                    indptr=self.array(x.indptr,
+                                                      name + '_indptr'),
+                                    shape=list(x.shape)))
+        elif isinstance(x, np.ndarray):
+            return self.array(x, name)
+        elif callable(x):
+            return _reference(x, lambda y: self.value(y, name))
+        else:
+            raise ValueError("Can not record a constructor argument of type %s"
+                             % type(x))
+
+    def node(self, node):
+        """
+        Record a node and the nodes in its constructor arguments.
+        """
+        if node in self.ids:
+            return self.ids[node]
+        (cls, args, kwargs) = node._recipe
+        index = len(self.ids)
+        self.ids[node] = index
+        record = dict(name=node.name,
+                      type=type(node).__name__,
+                      constructor=_reference(cls,
+                                             lambda y: self.value(y, '')),
+                      args=self.value(list(args), '%d_arg' % index),
+                      kwargs=self.value(dict(kwargs),
+                                        '%d_kwarg' % index)['dict'],
+                      plates=list(node.plates),
+                      dims=[list(dim) for dim in node.dims],
+                      parents=[self.ids.get(parent)
+                               for parent in node.parents])
+        if hasattr(node, 'snapshot') and callable(node.snapshot):
+            state = {}
+            for (key, value) in node.snapshot().items():
+                if isinstance(value, list):
+                    for (i, v) in enumerate(value):
+                        state['%s%d' % (key, i)] = self.array(
+                            v, '%d_%s%d' % (index, key, i))
+                else:
+                    state[key] = self.array(value, '%d_%s' % (index, key))
+            record['state'] = state
+        # The nodes are recorded in the order of construction
+        self.records.append((index, record))
+        return index
+
+
+def save_artifact(path, *nodes):
+    """
+    Save the nodes and their ancestors as a model artifact.
+
+    Parameters
+    ----------
+    path : str
+       The directory of the artifact.  It is created if necessary.
+    nodes : nodes
+       The nodes to save.  The nodes given as constructor arguments to the
+       nodes are saved too.
+    """
+    writer = _Writer(path)
+    roots = [writer.node(node) for node in nodes]
+    graph = dict(version=1,
+                 nodes=[record for (index, record) in writer.records],
+                 ids=[index for (index, record) in writer.records],
+                 roots=roots)
+    filename = os.path.join(path, 'graph.json')
+    with open(filename + '.tmp', 'w') as f:
+        json.dump(graph, f, indent=1)
+    os.replace(filename + '.tmp', filename)
+
+
+def load_artifact(path, mmap=True):
+    """
+    Load the nodes of a model artifact.
+
+    Parameters
+    ----------
+    path : str
+       The directory of the artifact.
+    mmap : bool
+       If True, the state arrays are memory-mapped read-only.  Otherwise,
+       they are read into memory.
+
+    Returns
+    -------
+    nodes : list
+       The nodes that were given to `save_artifact`.
+    """
+
+    with open(os.path.join(path, 'graph.json')) as f:
+        graph = json.load(f)
+    mmap_mode = 'r' if mmap else None
+
+    def array(spec):
+        # Scalars can not be memory-mapped
+        x = np.load(os.path.join(path, 'arrays', spec['array']),
+                    mmap_mode=mmap_mode if len(spec['shape']) > 0 else None)
+        return utils.broadcast_to_shape(x, tuple(spec['shape']))
+
+    nodes = {}
+
+    def value(x):
+        if isinstance(x, list):
+            return [value(xi) for xi in x]
+        elif not isinstance(x, dict):
+            return x
+        elif 'node' in x:
+            return nodes[x['node']]
+        elif 'tuple' in x:
+            return tuple(value(xi) for xi in x['tuple'])
+        elif 'dict' in x:
+            return {key: value(xi) for (key, xi) in x['dict'].items()}
+        elif 'sparse' in x:
+            spec = x['sparse']
+            return sparse.csc_matrix((np.array(array(spec['data'])),
+                                      np.array(array(spec['indices'])),
+                                      np.array(array(spec['indptr']))),
+                                     shape=tuple(spec['shape']))
+        elif 'array' in x:
+            # Constructor arguments are small, thus copy them
+            return np.array(array(x))
+        else:
+            return _dereference(x, value)
+
+    for (index, record) in zip(graph['ids'], graph['nodes']):
+        constructor = _dereference(record['constructor'], value)
+        node = constructor(*value(record['args']),
+                           **{key: value(x)
+                              for (key, x) in record['kwargs'].items()})
+        if (node.plates != tuple(record['plates'])
+            or [list(dim) for dim in node.dims] != record['dims']):
+            raise ValueError("The node %s was constructed with plates %s and "
+                             "dimensions %s but the artifact has plates %s "
+                             "and dimensions %s"
+                             % (node.name, node.plates, node.dims,
+                                tuple(record['plates']), record['dims']))
+        if 'state' in record:
+            node.load({key: array(spec)
+                       for (key, spec) in record['state'].items()})
+        nodes[index] = node
+
+    return [nodes[index] for index in graph['roots']]
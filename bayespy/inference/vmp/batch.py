@@ -0,0 +1,201 @@
+######################################################################
+# Copyright (C) 2013 Jaakko Luttinen
+#
+# This file is licensed under Version 3.0 of the GNU General Public
+# License. See LICENSE for a text of the license.
+######################################################################
+
+######################################################################
+# This file is part of BayesPy.
+#
+# BayesPy is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# BayesPy is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with BayesPy.  If not, see <http://www.gnu.org/licenses/>.
+######################################################################
+
+"""
+Batched models: fitting many identically structured models as one.
+
+Fitting a small model separately to a huge number of data sets is dominated
+by the Python overhead.  Instead, the models can be stacked into one model by
+adding a leading plate axis for the batch to every node, so that the
+iterations are vectorized over the members of the batch.  For instance::
+
+    (Y, X, Lambda, z, alpha) = batch(gaussianmix_model, 1000, N, K, D)
+    Y.observe(y)  # y has shape (1000, N, D)
+    Q = BatchVB(Y, X, Lambda, z, alpha)
+    Q.update(repeat=100)
+    Q.L_members   # bound traces of the members
+    Q.converged   # convergence flags of the members
+
+Because the plates are aligned to the right, the nodes must also get unit
+plate axes between the batch axis and their own plates, so that the batch
+axes of all nodes are aligned.  The number of these axes depends on the
+children of the node (e.g., a mixture adds a cluster plate axis for its
+parents), which are constructed after the node.  Thus, the model is first
+built once without batching in order to find the plate structure of the
+graph.  The model is then rebuilt so that each stochastic node gets the
+plates (size, 1, ..., 1, plates).  The construction hooks are local to the
+calling thread (see `bayespy.inference.vmp.nodes.node.plates_hook`), thus
+models can be built concurrently in other threads.
+"""
+
+import numpy as np
+
+from bayespy.inference.vmp.nodes.node import plates_hook
+from bayespy.inference.vmp.vmp import VB
+from bayespy.inference.vmp.plan import graph
+
+
+def batch(build, size, *args, **kwargs):
+    """
+    Build a batched model.
+
+    Parameters
+    ----------
+    build : function
+       A function which constructs the model, for instance,
+       `gaussianmix_model`.  The function must construct the nodes in the same
+       order each time it is called with the same arguments.
+    size : int
+       The number of members in the batch.
+    args, kwargs :
+       The arguments given to the function.
+
+    Returns
+    -------
+    The return value of the model-building function for the batched model.
+    """
+
+    # Build the model once and record the nodes
+    prototype = []
+    def record(node, plates):
+        prototype.append(node)
+        return plates
+    with plates_hook(record):
+        build(*args, **kwargs)
+
+    # Find the number of unit plate axes needed between the batch axis and
+    # the plates of each node.  The children are constructed after their
+    # parents, thus one pass in reversed order is enough.
+    index_of = {id(node): k for (k, node) in enumerate(prototype)}
+    pads = [0] * len(prototype)
+    for k in reversed(range(len(prototype))):
+        node = prototype[k]
+        for (child, index) in node.children:
+            if id(child) in index_of:
+                pad = (pads[index_of[id(child)]]
+                       + len(child._plates_to_parent(index))
+                       - len(node.plates))
+                pads[k] = max(pads[k], pad)
+
+    # Build the batched model
+    count = [0]
+    def add_batch_plate(node, plates):
+        k = count[0]
+        count[0] += 1
+        if k >= len(prototype):
+            raise RuntimeError("The model-building function constructed more "
+                               "nodes than on the first call")
+        if not node._batchable:
+            return plates
+        return (size,) + (1,)*pads[k] + prototype[k].plates
+    with plates_hook(add_batch_plate):
+        model = build(*args, **kwargs)
+    if count[0] != len(prototype):
+        raise RuntimeError("The model-building function constructed fewer "
+                           "nodes than on the first call")
+
+    return model
+
+
+class BatchVB(VB):
+    """
+    Variational Bayesian inference for batched models.
+
+    The lower bound and the convergence are tracked separately for each member
+    of the batch.  When a member has converged, the stochastic nodes are
+    frozen for that member while the others continue.
+
+    Parameters
+    ----------
+    nodes : nodes
+       The nodes of a model constructed by `batch`.
+    tol : float
+       Relative tolerance for the convergence of the members.
+
+    Attributes
+    ----------
+    size : int
+       The number of members in the batch.
+    L_members : ndarray
+       The lower bounds of the members, shape (size, iterations).
+    converged : ndarray
+       Boolean array telling which members have converged.
+    """
+
+    def __init__(self, *nodes, tol=1e-6, **kwargs):
+        super().__init__(*nodes, tol=tol, **kwargs)
+        self.tol = tol
+        self.size = max(node.plates[0] 
+                        for node in self.model 
+                        if len(node.plates) > 0)
+        self.L_members = np.zeros((self.size, 0))
+        self.converged = np.zeros(self.size, dtype=bool)
+
+    def update(self, *nodes, repeat=1, plot=False):
+
+        for i in range(repeat):
+
+            if np.all(self.converged):
+                break
+
+            super().update(*nodes, repeat=1, plot=plot)
+
+            # Check the convergence of each member
+            if self.iter > 1:
+                L = self.L_members[:,-1]
+                dL = L - self.L_members[:,-2]
+                converged = np.abs(dL) <= self.tol * np.abs(L)
+                self.freeze(np.logical_and(converged, 
+                                           np.logical_not(self.converged)))
+
+        if np.all(self.converged):
+            print("All members converged.")
+
+    def freeze(self, members):
+        """
+        Freeze the stochastic nodes for the given members of the batch.
+
+        Parameters
+        ----------
+        members : ndarray
+           Boolean array (or indices) of the members to freeze.
+        """
+        mask = np.zeros(self.size, dtype=bool)
+        mask[members] = True
+        self.converged = np.logical_or(self.converged, mask)
+        for node in graph(*self.model):
+            if (hasattr(node, 'freeze') 
+                and len(node.plates) > 0 
+                and node.plates[0] == self.size):
+                node.freeze(np.reshape(mask, 
+                                       (self.size,) 
+                                       + (1,)*(len(node.plates)-1)))
+
+    def loglikelihood_lowerbound(self):
+        L = np.zeros(self.size)
+        for node in self.model:
+            lp = node.lower_bound_contribution(batch_axes=1)
+            L = L + lp
+            self.l[node][self.iter] = np.sum(lp)
+        self.L_members = np.append(self.L_members, L[:,np.newaxis], axis=1)
+        return np.sum(L)
@@ -35,6 +35,8 @@ from .gamma import Gamma
 from .dirichlet import Dirichlet
 from .categorical import Categorical
 from .dot import Dot, SumMultiply
+from .linear_gaussian import LinearGaussian, SparseLinearGaussian
+from .gaussian_mrf import GaussianMRF
 from .mixture import Mixture
 from .gaussian_markov_chain import GaussianMarkovChain
 from .gaussian_markov_chain import DriftingGaussianMarkovChain
@@ -23,11 +23,194 @@
 
 import numpy as np
 
+from bayespy.utils import utils
+
 from .expfamily import ExponentialFamily
 from .constant import Constant
 from .dirichlet import Dirichlet
 
-def Categorical(p, **kwargs):
+
+class Responsibilities(np.ndarray):
+    """
+    Truncated categorical probabilities.
+
+    The array contains the dense probabilities with at most k non-zero
+    elements along the last axis.  The indices and the probabilities of
+    those elements are given in the attributes `indices` and `weights`
+    with shape (..., k) so that mixtures can compute their messages using
+    only the non-zero components.  Arrays derived from the probabilities
+    are ordinary arrays.
+    """
+
+    def __new__(cls, p, indices, weights):
+        obj = np.asarray(p).view(cls)
+        obj.indices = indices
+        obj.weights = weights
+        return obj
+
+    def __array_finalize__(self, obj):
+        self.indices = None
+        self.weights = None
+
+    def __array_wrap__(self, out_arr, context=None):
+        out_arr = np.asarray(out_arr)
+        if np.ndim(out_arr) == 0:
+            return out_arr[()]
+        return out_arr
+
+
+class OneHot():
+    """
+    One-hot array represented by the indices of the ones.
+
+    Observed categorical variables are stored as the indices of the observed
+    categories instead of a dense array of shape (..., K).  Thus, the
+    observations need memory only for the indices and the messages to the
+    parents can be computed with `bincount`.  The indices and the weights are
+    also available in the same format as for `Responsibilities` (with k=1),
+    thus mixtures use the indices directly.  The array can be converted to
+    a dense array with `toarray` or `numpy.asarray`.
+
+    Parameters
+    ----------
+    x : int array
+       The indices of the categories
+    n_categories : int
+       The number of categories K
+    """
+
+    def __init__(self, x, n_categories):
+        x = np.asarray(x, dtype=int)
+        if np.any(x < 0) or np.any(x >= n_categories):
+            raise ValueError("Category indices must be in the range [0, %d)"
+                             % n_categories)
+        self.shape = np.shape(x) + (n_categories,)
+        self.ndim = len(self.shape)
+        self.indices = x[...,np.newaxis]
+        self.weights = np.broadcast_to(np.ones(()), np.shape(self.indices))
+
+    def toarray(self):
+        u = np.zeros(self.shape)
+        put_last(u, self.indices, self.weights)
+        return u
+
+    def __array__(self, dtype=None):
+        u = self.toarray()
+        if dtype is not None:
+            u = u.astype(dtype)
+        return u
+
+    def __getitem__(self, index):
+        # Indexing the plates does not need the full dense array
+        if isinstance(index, tuple) and len(index) == self.ndim - 1:
+            return OneHot(self.indices[...,0][index], self.shape[-1]).toarray()
+        return self.toarray()[index]
+
+    def copy(self):
+        return self.toarray()
+
+    def count(self, plates, weights=1):
+        """
+        Sum the one-hot vectors over the plates that are not in plates.
+
+        Parameters
+        ----------
+        plates : tuple
+            The plates to which the vectors are summed (broadcasting rules
+            apply).  The result has the same number of axes as the array.
+        weights : array
+            The weights of the vectors (broadcastable to the plates of the
+            array)
+        """
+        shape = self.shape[:-1]
+        K = self.shape[-1]
+        plates = (1,)*(len(shape)-len(plates)) + tuple(plates)
+        shape_to = tuple(d if d_to != 1 else 1
+                         for (d_to, d) in zip(plates, shape))
+        groups = np.reshape(np.arange(int(np.prod(shape_to))), shape_to)
+        index = K*utils.broadcast_to_shape(groups, shape) + self.indices[...,0]
+        weights = utils.broadcast_to_shape(np.asarray(weights,
+                                                      dtype=np.float64),
+                                           shape)
+        c = np.bincount(np.ravel(index),
+                        weights=np.ravel(weights),
+                        minlength=np.size(groups)*K)
+        return np.reshape(c, shape_to + (K,))
+
+
+def take_last(x, ind):
+    """
+    Take elements along the last axis for each element of the leading axes.
+
+    Parameters
+    ----------
+    x : array, shape (..., K)
+    ind : int array, shape (..., k)
+        The leading axes of x must broadcast to the leading axes of ind
+    """
+    shape = np.shape(ind)
+    x = utils.broadcast_to_shape(x, shape[:-1] + np.shape(x)[-1:])
+    x = np.reshape(x, (-1, np.shape(x)[-1]))
+    rows = np.arange(np.shape(x)[0])[:,np.newaxis]
+    return np.reshape(x[rows, np.reshape(ind, (len(rows), -1))], shape)
+
+
+def put_last(x, ind, values):
+    """
+    Set elements along the last axis, the inverse of `take_last`.
+    """
+    y = np.reshape(x, (-1, np.shape(x)[-1]))
+    rows = np.arange(np.shape(y)[0])[:,np.newaxis]
+    y[rows, np.reshape(ind, (len(rows), -1))] = np.reshape(values,
+                                                           (len(rows), -1))
+
+
+def top_k(p, k):
+    """
+    Find the indices of the k largest elements along the last axis.
+
+    The indices are in arbitrary order.
+    """
+    return np.argpartition(-p, k-1, axis=-1)[...,:k]
+
+
+def truncated_moments_and_cgf(phi, k):
+    """
+    Compute the moments and g of a categorical distribution truncated to the
+    k most probable categories.
+
+    The probabilities of the other categories are set to zero, thus only k
+    exponentials per distribution are computed.  The moments are returned as
+    `Responsibilities` so that the indices of the k categories are not
+    searched again.
+    """
+    ind = top_k(phi, k)
+    phi_k = take_last(phi, ind)
+    max_phi = np.max(phi_k, axis=-1, keepdims=True)
+    p = np.exp(phi_k - max_phi)
+    sum_p = np.sum(p, axis=-1, keepdims=True)
+    u0 = np.zeros(np.shape(ind)[:-1] + np.shape(phi)[-1:])
+    p = p / sum_p
+    put_last(u0, ind, p)
+    g = np.squeeze(-np.log(sum_p) - max_phi, axis=-1)
+    return ([Responsibilities(u0, ind, p)], g)
+
+
+def Categorical(p, truncate=None, **kwargs):
+    """
+    Construct a categorical distribution node.
+
+    Parameters
+    ----------
+    p : Dirichlet-like node or array
+        The probabilities of the categories
+    truncate : int, optional
+        If given, the posterior probabilities are truncated to the
+        `truncate` most probable categories of each variable.  The moments
+        are then `Responsibilities` arrays which mixtures can use to
+        compute their messages and bound terms in O(N*truncate) time
+        instead of O(N*K).
+    """
 
     # Get the number of categories (static methods may need this)
     if np.isscalar(p) or isinstance(p, np.ndarray):
@@ -35,6 +218,9 @@ def Categorical(p, **kwargs):
     else:
         n_categories = p.dims[0][0]
 
+    if truncate is not None and truncate >= n_categories:
+        truncate = None
+
     # The actual categorical distribution node
     class _Categorical(ExponentialFamily):
 
@@ -50,6 +236,8 @@ def Categorical(p, **kwargs):
 
         @staticmethod
         def _compute_moments_and_cgf(phi, mask=True):
+            if truncate is not None:
+                return truncated_moments_and_cgf(phi[0], truncate)
             # For numerical reasons, scale contributions closer to
             # one, i.e., subtract the maximum of the log-contributions.
             max_phi = np.max(phi[0], axis=-1, keepdims=True)
@@ -68,11 +256,8 @@ def Categorical(p, **kwargs):
         def _compute_fixed_moments_and_f(x, mask=True):
             """ Compute u(x) and f(x) for given x. """
 
-            # TODO: You could check that x has proper dimensions
-            x = np.array(x, dtype=np.int)
-
-            u0 = np.zeros((np.size(x), n_categories))
-            u0[[np.arange(np.size(x)), x]] = 1
+            # Store only the indices of the observed categories
+            u0 = OneHot(x, n_categories)
             f = 0
             return ([u0], f)
 
@@ -95,10 +280,80 @@ def Categorical(p, **kwargs):
             if np.isscalar(p) or isinstance(p, np.ndarray):
                 p = ConstantDirichlet(p)
 
+            # Truncated responsibilities for the current moments
+            self._responsibilities = None
+
             # Construct
             super().__init__(p,
                              **kwargs)
 
+        def _set_moments(self, u, mask=True):
+            # Keep observations as indices if they replace all the moments
+            if (isinstance(u[0], OneHot) and np.all(mask) and
+                np.shape(u[0]) == self.get_shape(0)):
+                self.u = [u[0]]
+                return
+            if isinstance(self.u[0], OneHot):
+                self.u = [self.u[0].toarray()]
+            if isinstance(u[0], OneHot):
+                u = [u[0].toarray()]
+            # Keep the indices of truncated responsibilities
+            if (isinstance(u[0], Responsibilities) and np.all(mask) and
+                np.shape(u[0]) == self.get_shape(0)):
+                self.u = [u[0]]
+                return
+            super()._set_moments(u, mask=mask)
+
+        def _set_observed_moments(self, u, index):
+            # Keep the observations as indices
+            if isinstance(self.u[0], OneHot) and isinstance(u[0], OneHot):
+                x = np.array(self.u[0].indices[...,0])
+                x[index] = u[0].indices[...,0]
+                self.u = [OneHot(x, self.u[0].shape[-1])]
+                return
+            super()._set_observed_moments(u, index)
+
+        def _observed_sum(self, key, plates):
+            if key != 0 or not isinstance(self.u[0], OneHot):
+                return super()._observed_sum(key, plates)
+            plates = (1,)*(len(self.plates)-len(plates)) + tuple(plates)
+            if self._statistics is not None:
+                try:
+                    return self._statistics[(key, plates)]
+                except KeyError:
+                    pass
+            x = self.u[0].count(plates, weights=self.observed)
+            if self._statistics is not None:
+                self._statistics[(key, plates)] = x
+            return x
+
+        def _message_to_parent(self, index, out=None):
+            # Count the observed categories
+            parent = self.parents[index]
+            if (index == 0 and isinstance(self.u[0], OneHot) and
+                len(parent.plates) <= len(self.plates)):
+                mask = self._compute_mask_to_parent(index, self.mask)
+                m = self.u[0].count(parent.plates, weights=mask)
+                return [utils.squeeze_to_dim(m, len(parent.plates) + 1)]
+            return super()._message_to_parent(index, out=out)
+
+        def get_moments(self):
+            u = super().get_moments()
+            if (truncate is None or
+                isinstance(u[0], (OneHot, Responsibilities))):
+                return u
+            # The updated moments are mixed with observations by a mask, thus
+            # the truncation is found from the dense moments.  The moments
+            # are replaced (not modified) in updates, thus the truncated
+            # responsibilities are valid as long as the moment array is the
+            # same
+            if (self._responsibilities is None or
+                self._responsibilities[0] is not u[0]):
+                ind = top_k(u[0], truncate)
+                R = Responsibilities(u[0], ind, take_last(u[0], ind))
+                self._responsibilities = (u[0], R)
+            return [self._responsibilities[1]]
+
 
         def random(self):
             raise NotImplementedError()
@@ -110,4 +365,6 @@ def Categorical(p, **kwargs):
             print("  p = ")
             print(p)
 
-    return _Categorical(p, **kwargs)
+    node = _Categorical(p, **kwargs)
+    node._set_recipe(Categorical, (p,), dict(kwargs, truncate=truncate))
+    return node
@@ -28,6 +28,8 @@ from .node import Node
 
 class ConstantNumeric(Node):
 
+    _batchable = False
+
     def __init__(self, x, ndim, **kwargs):
         # Compute moments
         self.u = [np.asarray(x)]
@@ -45,6 +47,8 @@ def Constant(distribution):
 
     class _Constant(Node):
 
+        _batchable = False
+
         def __init__(self, x, **kwargs):
             x = np.asanyarray(x)
             # Compute moments
@@ -70,7 +74,8 @@ def Constant(distribution):
 
         def get_moments(self):
             return self.u
-        
+
+    _Constant._factory = (Constant, (distribution,), {})
     return _Constant
     
 
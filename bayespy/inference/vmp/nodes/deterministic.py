@@ -52,6 +52,9 @@ class Deterministic(Node):
     
     """
 
+    # The plates are always determined by the parents
+    _batchable = False
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, plates=None, **kwargs)
 
@@ -77,7 +80,7 @@ class Deterministic(Node):
         # Sub-classes should implement this
         raise NotImplementedError()
 
-    def lower_bound_contribution(self, gradient=False):
+    def lower_bound_contribution(self, gradient=False, batch_axes=0):
         # Deterministic functions are delta distributions so the lower bound
         # contribuion is zero.
         return 0
@@ -232,10 +235,22 @@ def tile(X, tiles):
                     # moment has non-unit axis length.
                     tiles_ind = [tile if sh > 1 else 1
                                  for (tile, sh) in zip(tiles_ind, shape_u)]
-                        
-                    # Tile
-                    ui = np.tile(ui, tiles_ind)
+                    shape_tiled = tuple(tile*sh for (tile, sh)
+                                        in zip(tiles_ind, shape_u))
+
+                    # Tile only the axes that contain actual data. The axes
+                    # that are broadcast views (zero stride) in the parent's
+                    # moment are kept as broadcast views.
+                    ui = utils.compact_broadcast(ui)
+                    tiles_ind = [tile if sh > 1 else 1
+                                 for (tile, sh) in zip(tiles_ind,
+                                                       np.shape(ui))]
+                    if any(tile > 1 for tile in tiles_ind):
+                        ui = np.tile(ui, tiles_ind)
+                    ui = utils.broadcast_to_shape(ui, shape_tiled)
                 u.append(ui)
             return u
             
-    return _Tile(X, name="tile(%s, %s)" % (X.name, tiles))
+    node = _Tile(X, name="tile(%s, %s)" % (X.name, tiles))
+    node._set_recipe(tile, (X, tiles), {})
+    return node
@@ -69,6 +69,13 @@ class Dirichlet(ExponentialFamily):
     def _compute_cgf_from_parents(*u_parents):
         return u_parents[0][1]
 
+    @staticmethod
+    def _check_parameters(phi):
+        """
+        Check that the concentration parameters are positive.
+        """
+        return np.all(phi[0] > 0)
+
     @staticmethod
     def _compute_moments_and_cgf(phi, mask=True):
         sum_gammaln = np.sum(special.gammaln(phi[0]), axis=-1)
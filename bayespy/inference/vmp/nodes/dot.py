@@ -290,9 +290,12 @@ class SumMultiply(Deterministic):
         return u
         
 
-    def _message_to_parent(self, index):
+    def _message_to_parent(self, index, out=None):
         """
         Compute the message and mask to a parent node.
+
+        If out is given, the messages are written into the arrays in out
+        which have the correct shape (see `Node._message_to_parent`).
         """
 
         # Check index
@@ -309,149 +312,193 @@ class SumMultiply(Deterministic):
         # arrays so we sum some axes already here. Thus, we need to apply the
         # mask.
 
-        parent = self.parents[index]
-
-        #
-        # Compute the first message
-        #
-
         msg = [None, None]
         
         # Compute the two messages
         for ind in range(2):
 
-            # The total number of keys for the non-plate dimensions
-            N = (ind+1) * self.N_keys
-
-            # Add an array of ones to ensure proper shape and number of
-            # plates. Note that this adds an axis for each plate. At the end, we
-            # want to remove axes that were created only because of this
-            parent_num_dims = len(parent.dims[ind])
-            parent_num_plates = len(parent.plates)
-            parent_plate_keys = list(range(N + parent_num_plates,
-                                           N,
-                                           -1))
-            parent_dim_keys = self.in_keys[index]
-            if ind == 1:
-                parent_dim_keys = ([key + self.N_keys
-                                    for key in self.in_keys[index]]
-                                   + parent_dim_keys)
-            args = []
-            args.append(np.ones((1,)*parent_num_plates + parent.dims[ind]))
-            args.append(parent_plate_keys + parent_dim_keys)
-
-            # This variable counts the maximum number of plates of the
-            # arguments, thus it will tell the number of plates in the result
-            # (if the artificially added plates above were ignored).
-            result_num_plates = 0
-            result_plates = ()
-
-            # Mask and its keysr
-            mask_num_plates = np.ndim(mask)
-            mask_plates = np.shape(mask)
-            mask_plate_keys = list(range(N + mask_num_plates, 
-                                         N,
-                                         -1))
-            result_num_plates = max(result_num_plates,
-                                    mask_num_plates)
-            result_plates = utils.broadcasted_shape(result_plates,
-                                                    mask_plates)
-            args.append(mask)
-            args.append(mask_plate_keys)
-
-            # Moments and keys of other parents
-            for (k, u) in enumerate(u_parents):
-                if k != index:
-                    num_dims = (ind+1) * len(self.in_keys[k])
-                    num_plates = np.ndim(u[ind]) - num_dims
-                    plates = np.shape(u[ind])[:num_plates]
-                    plate_keys = list(range(N + num_plates, 
-                                            N,
-                                            -1))
-                    dim_keys = self.in_keys[k]
-                    if ind == 1:
-                        dim_keys = ([key + self.N_keys 
-                                     for key in self.in_keys[k]]
-                                    + dim_keys)
-                    args.append(u[ind])
-                    args.append(plate_keys + dim_keys)
-
-                    result_num_plates = max(result_num_plates, num_plates)
-                    result_plates = utils.broadcasted_shape(result_plates,
-                                                            plates)
-
-            # Message and keys from children
-            child_num_dims = (ind+1) * len(self.out_keys)
-            child_num_plates = np.ndim(m[ind]) - child_num_dims
-            child_plates = np.shape(m[ind])[:child_num_plates]
-            child_plate_keys = list(range(N + child_num_plates,
-                                          N,
-                                          -1))
-            child_dim_keys = self.out_keys
-            if ind == 1:
-                child_dim_keys = ([key + self.N_keys
-                                   for key in self.out_keys]
-                                  + child_dim_keys)
+            # The keys and the shapes depend only on the shapes of the arrays
+            shapes_u = tuple(np.shape(u[ind]) if k != index else None
+                             for (k, u) in enumerate(u_parents))
+            (ones, keys_ones, keys_mask, keys_u, keys_m, parent_keys,
+             shape_sum, message_shape, r) = self._message_plan(
+                 index,
+                 ind,
+                 np.shape(mask),
+                 shapes_u,
+                 np.shape(m[ind]))
+
+            args = [ones, keys_ones, mask, keys_mask]
+            for (k, keys) in keys_u:
+                args.append(u_parents[k][ind])
+                args.append(keys)
             args.append(m[ind])
-            args.append(child_plate_keys + child_dim_keys)
-
-            result_num_plates = max(result_num_plates, child_num_plates)
-            result_plates = utils.broadcasted_shape(result_plates,
-                                                    child_plates)
-
-            # Output keys, that is, the keys of the parent[index]
-            parent_keys = parent_plate_keys + parent_dim_keys
-
-            # Performance trick: Check which axes can be summed because they
-            # have length 1 or are non-existing in parent[index]. Thus, remove
-            # keys corresponding to unit length axes in parent[index] so that
-            # einsum sums over those axes. After computations, these axes must
-            # be added back in order to get the correct shape for the message.
-
-            parent_shape = parent.get_shape(ind)
-            removed_axes = []
-            for j in range(len(parent_keys)):
-                if parent_shape[j] == 1:
-                    # Remove the key (take into account the number of keys that
-                    # have already been removed)
-                    del parent_keys[j-len(removed_axes)]
-                    removed_axes.append(j)
-
+            args.append(keys_m)
             args.append(parent_keys)
 
             # THE BEEF: Compute the message
-            msg[ind] = np.einsum(*args)
-
-            # Find the correct shape for the message array
-            message_shape = list(np.shape(msg[ind]))
-            # First, add back the axes with length 1
-            for ax in removed_axes:
-                message_shape.insert(ax, 1)
-            # Second, remove leading axes for plates that were not present in
-            # the child nor other parents' messages. This is not really
-            # necessary, but it is just elegant to remove the leading unit
-            # length axes that we added artificially at the beginning just
-            # because we wanted the key mapping to be simple.
-            if parent_num_plates > result_num_plates:
-                del message_shape[:(parent_num_plates-result_num_plates)]
-            # Then, the actual reshaping
-            msg[ind] = np.reshape(msg[ind], message_shape)
-
-            # Apply plate multiplier: If this node has non-unit plates that are
-            # unit plates in the parent, those plates are summed. However, if
-            # the message has unit axis for that plate, it should be first
-            # broadcasted to the plates of this node and then summed to the
-            # plates of the parent. In order to avoid this broadcasting and
-            # summing, it is more efficient to just multiply by the correct
-            # factor.
-            r = self._plate_multiplier(self.plates, 
-                                       result_plates,
-                                       parent.plates)
+            if (out is not None and out[ind] is not None
+                and np.shape(out[ind]) == message_shape):
+                np.einsum(*args, out=np.reshape(out[ind], shape_sum))
+                msg[ind] = out[ind]
+            else:
+                msg[ind] = np.einsum(*args)
+                # Then, the actual reshaping
+                msg[ind] = np.reshape(msg[ind], message_shape)
+
+            # Apply plate multiplier
             if r != 1:
                 msg[ind] *= r
         
         return msg
 
+    def _compute_message_plan(self, index, ind, shape_mask, shapes_u, shape_m):
+        """
+        Compute the einsum keys for the message to parent[index].
+
+        Parameters
+        ----------
+        index : int
+           The index of the parent
+        ind : int
+           The index of the message (0 for the mean, 1 for the second moment)
+        shape_mask : tuple
+           The shape of the mask
+        shapes_u : tuple
+           The shapes of the moments of the other parents (None for the
+           parent[index] itself)
+        shape_m : tuple
+           The shape of the message from the children
+        """
+
+        parent = self.parents[index]
+
+        # The total number of keys for the non-plate dimensions
+        N = (ind+1) * self.N_keys
+
+        # Add an array of ones to ensure proper shape and number of
+        # plates. Note that this adds an axis for each plate. At the end, we
+        # want to remove axes that were created only because of this
+        parent_num_dims = len(parent.dims[ind])
+        parent_num_plates = len(parent.plates)
+        parent_plate_keys = list(range(N + parent_num_plates,
+                                       N,
+                                       -1))
+        parent_dim_keys = self.in_keys[index]
+        if ind == 1:
+            parent_dim_keys = ([key + self.N_keys
+                                for key in self.in_keys[index]]
+                               + parent_dim_keys)
+        ones = np.ones((1,)*parent_num_plates + parent.dims[ind])
+        keys_ones = parent_plate_keys + parent_dim_keys
+
+        # This variable counts the maximum number of plates of the
+        # arguments, thus it will tell the number of plates in the result
+        # (if the artificially added plates above were ignored).
+        result_num_plates = 0
+        result_plates = ()
+
+        # Mask and its keys
+        mask_num_plates = len(shape_mask)
+        mask_plates = shape_mask
+        keys_mask = list(range(N + mask_num_plates, 
+                               N,
+                               -1))
+        result_num_plates = max(result_num_plates,
+                                mask_num_plates)
+        result_plates = utils.broadcasted_shape(result_plates,
+                                                mask_plates)
+
+        # Keys of other parents
+        keys_u = []
+        for (k, shape_u) in enumerate(shapes_u):
+            if k != index:
+                num_dims = (ind+1) * len(self.in_keys[k])
+                num_plates = len(shape_u) - num_dims
+                plates = shape_u[:num_plates]
+                plate_keys = list(range(N + num_plates, 
+                                        N,
+                                        -1))
+                dim_keys = self.in_keys[k]
+                if ind == 1:
+                    dim_keys = ([key + self.N_keys 
+                                 for key in self.in_keys[k]]
+                                + dim_keys)
+                keys_u.append((k, plate_keys + dim_keys))
+
+                result_num_plates = max(result_num_plates, num_plates)
+                result_plates = utils.broadcasted_shape(result_plates,
+                                                        plates)
+
+        # Keys of the message from children
+        child_num_dims = (ind+1) * len(self.out_keys)
+        child_num_plates = len(shape_m) - child_num_dims
+        child_plates = shape_m[:child_num_plates]
+        child_plate_keys = list(range(N + child_num_plates,
+                                      N,
+                                      -1))
+        child_dim_keys = self.out_keys
+        if ind == 1:
+            child_dim_keys = ([key + self.N_keys
+                               for key in self.out_keys]
+                              + child_dim_keys)
+        keys_m = child_plate_keys + child_dim_keys
+
+        result_num_plates = max(result_num_plates, child_num_plates)
+        result_plates = utils.broadcasted_shape(result_plates,
+                                                child_plates)
+
+        # Output keys, that is, the keys of the parent[index]
+        parent_keys = parent_plate_keys + parent_dim_keys
+
+        # Performance trick: Check which axes can be summed because they
+        # have length 1 or are non-existing in parent[index]. Thus, remove
+        # keys corresponding to unit length axes in parent[index] so that
+        # einsum sums over those axes. After computations, these axes must
+        # be added back in order to get the correct shape for the message.
+
+        parent_shape = parent.get_shape(ind)
+        removed_axes = []
+        for j in range(len(parent_keys)):
+            if parent_shape[j] == 1:
+                # Remove the key (take into account the number of keys that
+                # have already been removed)
+                del parent_keys[j-len(removed_axes)]
+                removed_axes.append(j)
+
+        # Remove leading axes for plates that were not present in the child
+        # nor other parents' messages. This is not really necessary, but it is
+        # just elegant to remove the leading unit length axes that we added
+        # artificially at the beginning just because we wanted the key mapping
+        # to be simple.
+        num_removed_plates = max(0, parent_num_plates - result_num_plates)
+
+        # The shape of the einsum result and the shape of the message, which
+        # has the removed axes back as unit axes but not the leading plates
+        # that were not present in the child nor other parents' messages
+        shapes = [np.shape(ones), keys_ones, shape_mask, keys_mask]
+        for (k, keys) in keys_u:
+            shapes += [shapes_u[k], keys]
+        shapes += [shape_m, keys_m, parent_keys]
+        shape_sum = utils.einsum_shape_from_shapes(*shapes)
+        message_shape = list(shape_sum)
+        for ax in removed_axes:
+            message_shape.insert(ax, 1)
+        message_shape = tuple(message_shape[num_removed_plates:])
+
+        # Plate multiplier: If this node has non-unit plates that are unit
+        # plates in the parent, those plates are summed. However, if the
+        # message has unit axis for that plate, it should be first broadcasted
+        # to the plates of this node and then summed to the plates of the
+        # parent. In order to avoid this broadcasting and summing, it is more
+        # efficient to just multiply by the correct factor.
+        r = self._plate_multiplier(self.plates, 
+                                   result_plates,
+                                   parent.plates)
+
+        return (ones, keys_ones, keys_mask, keys_u, keys_m, parent_keys,
+                shape_sum, message_shape, r)
+
 def Dot(*args, **kwargs):
     """
     Node for computing inner product of several Gaussian vectors.
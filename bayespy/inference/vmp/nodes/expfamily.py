@@ -24,6 +24,7 @@
 import numpy as np
 
 from bayespy.utils import utils
+from bayespy.utils import linalg
 
 from .stochastic import Stochastic
 
@@ -47,6 +48,10 @@ class ExponentialFamily(Stochastic):
     
     """
 
+    # Indices of the natural parameters which are symmetric matrices (stored
+    # packed if packed=True)
+    _symmetric_parameters = ()
+
     def __init__(self, *args, initialize=True, **kwargs):
 
         # Terms for the lower bound (G for latent and F for observed)
@@ -147,29 +152,102 @@ class ExponentialFamily(Stochastic):
 
     def _update_distribution_and_lowerbound(self, m_children, *u_parents):
 
+        phi = self.phi
+
         # Update phi first from parents..
         self._update_phi_from_parents(*u_parents)
         # .. then just add children's message
         for i in range(len(self.phi)):
             self.phi[i] = self.phi[i] + m_children[i]
+            # Keep the parameters of the frozen plates (unless they have not
+            # changed, which keeps broadcasted parameters small)
+            if (np.any(self.frozen) and
+                not (np.shape(phi[i]) == np.shape(self.phi[i]) and
+                     np.array_equal(phi[i], self.phi[i]))):
+                frozen = utils.add_trailing_axes(self.frozen, self.ndims[i])
+                self.phi[i] = np.where(frozen, phi[i], self.phi[i])
 
         # Update u and g
         self._update_moments_and_cgf()
 
+    @staticmethod
+    def _check_parameters(phi):
+        """
+        Check whether the natural parameters are valid.
+
+        The accelerated updates use this to reject extrapolated parameters
+        outside the domain.  Sub-classes can add constraints, for instance,
+        positive shape parameters.  Positive-definiteness is checked by the
+        Cholesky decompositions when computing the moments.
+        """
+        return not any(np.any(np.isnan(np.asarray(p))) for p in phi)
+
     def _update_moments_and_cgf(self):
         """
         Update moments and cgf based on current phi.
         """
-        # Mask for plates to update (i.e., unobserved plates)
-        update_mask = np.logical_not(self.observed)
-
-        # Compute the moments (u) and CGF (g)...
-        (u, g) = self._compute_moments_and_cgf(self.phi, mask=update_mask)
-        # ... and store them
-        self._set_moments_and_cgf(u, g, mask=update_mask)
+        # Mask for plates to update (i.e., unobserved and not frozen plates)
+        update_mask = np.logical_not(np.logical_or(self.observed, 
+                                                   self.frozen))
+
+        if np.any(self.frozen) and not self._packed:
+            self._update_unfrozen_moments_and_cgf(update_mask)
+        else:
+            # Compute the moments (u) and CGF (g)...
+            (u, g) = self._compute_moments_and_cgf(self.phi,
+                                                   mask=update_mask)
+            if np.any(self.frozen):
+                g = np.where(self.frozen, self.g, g)
+            # ... and store them
+            self._set_moments_and_cgf(u, g, mask=update_mask)
+
+        # The natural parameters are not needed as dense arrays until the
+        # next update
+        if self._packed:
+            for i in self._symmetric_parameters:
+                self.phi[i] = linalg.pack_symmetric(self.phi[i])
             
-    def lower_bound_contribution(self, gradient=False):
-        # Compute E[ log p(X|parents) - log q(X) ] over q(X)q(parents)
+    def _update_unfrozen_moments_and_cgf(self, update_mask):
+        """
+        Update the moments and CGF only for the plates in the mask.
+
+        The plates are gathered into one axis, thus the moments are computed
+        only for the updated plates.  This matters because keeping the
+        parameters of the frozen plates broadcasts shared parameters to all
+        plates.  The other plates keep their moments and CGF.
+        """
+        update_mask = np.broadcast_to(update_mask, self.plates)
+        if not np.any(update_mask):
+            return
+        index = np.nonzero(update_mask)
+        phi = [np.broadcast_to(self.phi[i], self.get_shape(i))[index]
+               for i in range(len(self.phi))]
+        (u_index, g_index) = self._compute_moments_and_cgf(phi)
+        if not all(isinstance(u_i, np.ndarray) for u_i in u_index):
+            # Special moment types are computed for all plates
+            (u, g) = self._compute_moments_and_cgf(self.phi, mask=update_mask)
+            g = np.where(self.frozen, self.g, g)
+            self._set_moments_and_cgf(u, g, mask=update_mask)
+            return
+        u = []
+        for i in range(len(u_index)):
+            u_i = np.array(np.broadcast_to(self.u[i], self.get_shape(i)),
+                           dtype=np.result_type(self.u[i], u_index[i]))
+            u_i[index] = u_index[i]
+            u.append(u_i)
+        g = np.array(np.broadcast_to(self.g, self.plates),
+                     dtype=np.result_type(self.g, g_index))
+        g[index] = g_index
+        self._set_moments_and_cgf(u, g)
+
+    def lower_bound_contribution(self, gradient=False, batch_axes=0):
+        """
+        Compute E[ log p(X|parents) - log q(X) ] over q(X)q(parents)
+
+        If batch_axes is positive, the given number of leading plate axes are
+        not summed over, thus the contributions of the batch members are
+        returned.
+        """
         
         # Messages from parents
         #u_parents = [parent.message_to_child() for parent in self.parents]
@@ -177,6 +255,9 @@ class ExponentialFamily(Stochastic):
         phi = self._compute_phi_from_parents(*u_parents)
         # G from parents
         L = self._compute_cgf_from_parents(*u_parents)
+        # Use the sums of the observations for fully observed nodes
+        if self._statistics is not None and np.all(self.observed):
+            return self._observed_lower_bound(phi, L, batch_axes=batch_axes)
         # L = g
         # G for unobserved variables (ignored variables are handled
         # properly automatically)
@@ -201,12 +282,51 @@ class ExponentialFamily(Stochastic):
 
             L = L + Z
 
+        if batch_axes > 0:
+            L = np.where(self.mask, L, 0)
+            L = utils.add_leading_axes(L, len(self.plates) - np.ndim(L))
+            r = self._plate_multiplier(self.plates[batch_axes:],
+                                       np.shape(L)[batch_axes:])
+            L = np.sum(L, axis=tuple(range(batch_axes, np.ndim(L))))
+            return r * L * np.ones(self.plates[:batch_axes])
+
         return (np.sum(np.where(self.mask, L, 0))
                 * self._plate_multiplier(self.plates,
                                          np.shape(L),
                                          np.shape(self.mask)))
         #return L
 
+    def _observed_lower_bound(self, phi, g, batch_axes=0):
+        """
+        Compute E[ log p(X|parents) ] for fully observed nodes.
+
+        The observed statistics are summed over the plates that the parameters
+        phi and g do not have, thus the cost depends on the plates of the
+        parameters instead of the number of observations.
+        """
+        plates = self.plates
+
+        def plates_of(x, ndim):
+            # The plates of x aligned to the plates of this node and the
+            # batch axes kept
+            sh = np.shape(x)[:max(0, np.ndim(x)-ndim)]
+            sh = (1,)*(len(plates)-len(sh)) + sh
+            return plates[:batch_axes] + sh[batch_axes:]
+
+        def total(x, ndim):
+            # Sum over the variable axes and the plates other than the batch
+            # axes
+            x = utils.add_leading_axes(x, len(plates) + ndim - np.ndim(x))
+            x = np.sum(x, axis=tuple(range(batch_axes, np.ndim(x))))
+            return x * np.ones(plates[:batch_axes])
+
+        L = total(g * self._observed_sum('n', plates_of(g, 0)), 0)
+        L = L + total(self._observed_sum('f', plates_of(0, 0)), 0)
+        for (i, (phi_i, ndim)) in enumerate(zip(phi, self.ndims)):
+            u_i = self._observed_sum(i, plates_of(phi_i, ndim))
+            L = L + total(phi_i * u_i, ndim)
+        return L
+
     def logpdf(self, X, mask=True):
         """
         Compute the log probability density function Q(X) of this node.
@@ -252,21 +372,13 @@ class ExponentialFamily(Stochastic):
             L = L + np.sum(phi_i * u_i, axis=axis_sum)
         return L
 
-    def save(self, group):
+    def snapshot(self):
         """
-        Save the state of the node into a HDF5 file.
-
-        group can be the root
+        Return the state of the node for saving.
         """
-        ## if name is None:
-        ##     name = self.name
-        ## subgroup = group.create_group(name)
-        
-        for i in range(len(self.phi)):
-            utils.write_to_hdf5(group, self.phi[i], 'phi%d' % i)
-        utils.write_to_hdf5(group, self.f, 'f')
-        utils.write_to_hdf5(group, self.g, 'g')
-        super().save(group)
+        snapshot = super().snapshot()
+        snapshot.update(phi=list(self.phi), f=self.f, g=self.g)
+        return snapshot
     
     def load(self, group):
         """
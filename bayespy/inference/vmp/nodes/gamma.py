@@ -109,6 +109,13 @@ class Gamma(ExponentialFamily):
         g = a * log_b - gammaln_a
         return g
 
+    @staticmethod
+    def _check_parameters(phi):
+        """
+        Check that the shape and the rate are positive.
+        """
+        return np.all(phi[0] < 0) and np.all(phi[1] > 0)
+
     @staticmethod
     def _compute_moments_and_cgf(phi, mask=True):
         log_b = np.log(-phi[0])
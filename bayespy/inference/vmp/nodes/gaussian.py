@@ -168,6 +168,8 @@ class Gaussian(ExponentialFamily):
     _statistics_class = GaussianStatistics
     
     ndims = (1, 2)
+    _symmetric_moments = (1,)
+    _symmetric_parameters = (1,)
     ndims_parents = [(1, 2), (2, 0)]
     # Observations are vectors (1-D):
     ndim_observations = 1
@@ -211,7 +213,7 @@ class Gaussian(ExponentialFamily):
         mumu = u_mu[1]
         Lambda = u_Lambda[0]
         logdet_Lambda = u_Lambda[1]
-        g = (-0.5 * np.einsum('...ij,...ij',mumu,Lambda)
+        g = (-0.5 * utils.linalg.symmetric_inner(mumu, Lambda)
              + 0.5 * logdet_Lambda)
         return g
 
@@ -355,7 +357,7 @@ class Gaussian(ExponentialFamily):
             # Transform moments and g using R
             self.u[0] = mvdot(R, self.u[0])
             self.u[1] = dot(R, self.u[1], R.T)
-            self.g -= logdetR
+            self.g = self.g - logdetR
 
     def rotate_matrix(self, R1, R2, inv1=None, logdet1=None, inv2=None, logdet2=None, Q=None):
         """
@@ -827,6 +829,8 @@ def _GaussianArrayARD(shape, shape_mu=None):
         
         # Number of axes for the mean and covariance
         ndims = (ndim, 2*ndim)
+        _symmetric_moments = (1,) if ndim == 1 else ()
+        _symmetric_parameters = (1,) if ndim == 1 else ()
         # Number of axes for the parameters of the parents
         ndims_parents = [(ndim_mu, 2*ndim_mu), (0, 0)]
         # Observations are scalar/vectors/matrices/tensors based on ndim:
@@ -1201,7 +1205,7 @@ def _GaussianArrayARD(shape, shape_mu=None):
                                           ndim=ndim)
             s = list(self.dims[0])
             s.pop(axis)
-            self.g -= logdetR * np.prod(s)
+            self.g = self.g - logdetR * np.prod(s)
 
             return
 
@@ -1237,4 +1241,6 @@ def _GaussianArrayARD(shape, shape_mu=None):
             return
 
 
+    __GaussianArrayARD._factory = (_GaussianArrayARD, (shape,),
+                                   dict(shape_mu=shape_mu))
     return __GaussianArrayARD
@@ -88,6 +88,7 @@ class _TemplateGaussianMarkovChain(ExponentialFamily):
 
     # phi[0] is (N,D), phi[1] is (N,D,D), phi[2] is (N-1,D,D)
     ndims = (2, 3, 3)
+    _symmetric_moments = (1,)
     # Observations are a set of vectors (thus 2-D matrix):
     ndim_observations = 2
     
@@ -289,7 +290,7 @@ class _TemplateGaussianMarkovChain(ExponentialFamily):
             u1 = linalg.dot(R, self.u[1], R.T)
             u2 = linalg.dot(R, self.u[2], R.T)
             self.u = [u0, u1, u2]
-            self.g -= N*logdetR
+            self.g = self.g - N*logdetR
 
             
 def _compute_cgf_for_gaussian_markov_chain(mumu, Lambda, logdet_Lambda, 
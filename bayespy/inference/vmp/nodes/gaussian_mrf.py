@@ -0,0 +1,220 @@
+######################################################################
+# Copyright (C) 2013 Jaakko Luttinen
+#
+# This file is licensed under Version 3.0 of the GNU General Public
+# License. See LICENSE for a text of the license.
+######################################################################
+
+######################################################################
+# This file is part of BayesPy.
+#
+# BayesPy is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# BayesPy is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with BayesPy.  If not, see <http://www.gnu.org/licenses/>.
+######################################################################
+
+"""
+Gaussian Markov random field node with a sparse precision matrix.
+"""
+
+import numpy as np
+import scipy.sparse as sparse
+
+from bayespy.utils import utils
+from bayespy.utils import linalg
+
+from .stochastic import Stochastic
+from .constant import Constant
+from .gamma import Gamma
+
+
+class GaussianMRF(Stochastic):
+    r"""
+    VMP node for a Gaussian Markov random field.
+
+    The node represents a vector with a sparse prior precision matrix
+
+    .. math::
+
+       \mathbf{x} \sim \mathcal{N}(\boldsymbol{\mu}, \tau \mathbf{\Lambda}),
+
+    where :math:`\mathbf{\Lambda}` is a fixed sparse matrix (e.g., a
+    neighbourhood structure) and :math:`\tau` is a scalar.  The elements of
+    the vector are the plates of the node and the moments are the means and
+    the second moments of the elements, thus the children use the node as
+    ``GaussianArrayARD`` with ``shape=()``.  The messages from the children
+    are diagonal, thus the posterior precision, that is, -2 times the natural
+    parameter ``phi[1]``, stays sparse.  The posterior is computed with a
+    sparse Cholesky decomposition and the marginal variances with the
+    selected inversion, thus the dense covariance matrix is never formed.
+    Some elements can be observed, and then the posterior of the other
+    elements is conditioned on them.  The plates are the elements of the
+    vector, thus the node can not be batched.
+
+    Parameters
+    ----------
+    mu : array
+        The prior mean, shape (D,) or scalar
+    Lambda : sparse matrix
+        The prior precision structure, shape (D,D)
+    tau : Node or scalar
+        Gamma distributed scale of the prior precision
+
+    See also
+    --------
+    GaussianArrayARD, bayespy.utils.linalg.SparseCholesky
+    """
+
+    ndims = (0, 0)
+
+    def __init__(self, mu, Lambda, tau=1, initialize=True, **kwargs):
+
+        # Check for constant tau
+        if utils.is_numeric(tau):
+            tau = Constant(Gamma)(tau)
+        if np.prod(tau.plates) != 1:
+            raise ValueError("The precision scale %s must not have plates"
+                             % tau.name)
+
+        Lambda = sparse.csc_matrix(Lambda)
+        D = Lambda.shape[0]
+        if Lambda.shape != (D, D):
+            raise ValueError("The precision matrix must be square")
+        self._Lambda = Lambda
+        self._mu = np.array(np.broadcast_to(mu, (D,)), dtype=np.float64)
+        self._logdet_Lambda = linalg.SparseCholesky(Lambda).logdet()
+
+        # No observations
+        self._x = np.zeros(D)
+
+        super().__init__(tau, plates=(D,), initialize=False, **kwargs)
+
+        if self.plates != (D,):
+            raise ValueError("The plates of the node %s must be the elements "
+                             "of the vector, now %s (batches are not "
+                             "supported)"
+                             % (self.name, self.plates))
+
+        if initialize:
+            self.initialize_from_prior()
+
+    @staticmethod
+    def compute_dims(tau):
+        """
+        Compute the dimensions of the moments and check the parents.
+        """
+        if tau.dims != ((), ()):
+            raise ValueError("The precision scale %s must be a scalar"
+                             % tau.name)
+        return ((), ())
+
+    def observe(self, x, mask=True, cache=False):
+        """
+        Fix the observed elements and condition the other elements on them.
+
+        The posterior of the unobserved elements is recomputed from the
+        current messages, thus the moments are consistent with the
+        observations.  The node does not use cached statistics, thus `cache`
+        has no effect.
+        """
+        D = self.plates[0]
+        self._x = np.array(np.broadcast_to(x, (D,)), dtype=np.float64)
+        self.observed = np.array(np.broadcast_to(mask, (D,)), dtype=bool)
+        self._update_mask()
+        self._update_distribution_and_lowerbound(
+            self._message_from_children(),
+            *self._message_from_parents())
+
+    def unobserve(self):
+        super().unobserve()
+        self._x = np.zeros(self.plates[0])
+
+    def initialize_from_prior(self):
+        u_tau = self._message_from_parents()[0]
+        self._update_distribution_and_lowerbound([0, 0], u_tau)
+
+    def _update_distribution_and_lowerbound(self, m_children, u_tau):
+        """
+        Compute the posterior from the sparse precision matrix.
+
+        The unobserved elements are conditioned on the observed elements,
+        thus only the block of the precision matrix for the unobserved
+        elements is decomposed.  The covariances of the observed elements
+        are zero.
+        """
+        D = self.plates[0]
+        m0 = np.broadcast_to(m_children[0], (D,))
+        m1 = np.broadcast_to(m_children[1], (D,))
+        tau = np.reshape(u_tau[0], ())
+        Q = (tau*self._Lambda - 2*sparse.diags(m1, 0)).tocsc()
+        b = tau*self._Lambda.dot(self._mu) + m0
+        self.phi = [b, -0.5*Q]
+        observed = np.broadcast_to(self.observed, (D,))
+        hidden = np.flatnonzero(~observed)
+        mean = np.where(observed, self._x, 0)
+        # Covariances in the sparsity pattern of the precision
+        self._Cov = sparse.csc_matrix((D, D))
+        self._logdet_Q = 0
+        if len(hidden) > 0:
+            Q_h = Q[hidden][:,hidden]
+            b_h = b[hidden] - Q[hidden].dot(mean)
+            U = linalg.SparseCholesky(Q_h)
+            mean[hidden] = U.solve(b_h)
+            P = sparse.csc_matrix((np.ones(len(hidden)),
+                                   (hidden, np.arange(len(hidden)))),
+                                  shape=(D, len(hidden)))
+            self._Cov = P.dot(U.selected_inverse()).dot(P.T).tocsc()
+            self._logdet_Q = U.logdet()
+        self.u = [mean, mean**2 + self._Cov.diagonal()]
+
+    def _message_to_parent(self, index, out=None):
+        """
+        Compute the message to the precision scale.
+
+        The expectation of (x-mu)'*Lambda*(x-mu) needs the covariances only
+        in the sparsity pattern of Lambda, thus the selected inverse is
+        enough.
+        """
+        if index != 0:
+            raise ValueError("Parent index larger than the number of parents")
+        D = self.plates[0]
+        e = self.u[0] - self._mu
+        m0 = -0.5 * (self._Lambda.multiply(self._Cov).sum()
+                     + np.dot(e, self._Lambda.dot(e)))
+        m1 = 0.5 * D
+        plates = self.parents[0].plates
+        return [m0 * np.ones(plates), m1 * np.ones(plates)]
+
+    def lower_bound_contribution(self, gradient=False, batch_axes=0):
+        """
+        Compute E[ log p(X|parents) - log q(X) ] over q(X)q(parents)
+
+        The entropy term is over the unobserved elements only.
+        """
+        if batch_axes > 0:
+            raise ValueError("The node %s can not be batched" % self.name)
+        D = self.plates[0]
+        N = np.count_nonzero(np.broadcast_to(self.observed, (D,)))
+        u_tau = self._message_from_parents()[0]
+        (m0, m1) = self._message_to_parent(0)
+        L = (np.sum(u_tau[0]*m0 + u_tau[1]*m1)
+             + 0.5*self._logdet_Lambda
+             + 0.5*(D-N)
+             - 0.5*N*np.log(2*np.pi)
+             - 0.5*self._logdet_Q)
+        return L
+
+    def show(self):
+        print("%s ~ GaussianMRF(mu, Lambda)" % self.name)
+        print("  mean = ")
+        print(self.u[0])
+        print("  var = ")
+        print(self.u[1] - self.u[0]**2)
@@ -0,0 +1,529 @@
+######################################################################
+# Copyright (C) 2013 Jaakko Luttinen
+#
+# This file is licensed under Version 3.0 of the GNU General Public
+# License. See LICENSE for a text of the license.
+######################################################################
+
+######################################################################
+# This file is part of BayesPy.
+#
+# BayesPy is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# BayesPy is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with BayesPy.  If not, see <http://www.gnu.org/licenses/>.
+######################################################################
+
+"""
+Fused likelihood node for linear Gaussian models.
+"""
+
+import numpy as np
+import scipy.sparse as sparse
+
+from bayespy.utils import utils
+
+from .stochastic import Stochastic
+from .constant import Constant
+from .gamma import Gamma
+
+
+def sum_to_plates(plates, plates_parent, ndim, *arrays, keepdims=True):
+    """
+    Sum the product of arrays over the plates that a parent does not have.
+
+    The arrays are aligned to the right and their last `ndim` axes are the
+    variable axes.  If an array broadcasts over a summed plate, the sum is
+    multiplied by the length of the plate.
+
+    Parameters
+    ----------
+    plates : tuple
+        The plates of the node
+    plates_parent : tuple
+        The plates of the parent
+    ndim : int
+        The number of variable axes in the arrays
+    keepdims : bool
+        If False, the variable axes are summed over too
+    """
+    n = len(plates)
+    N = n + ndim
+    plates_full = (1,)*(n-len(plates_parent)) + tuple(plates_parent)
+    shape_full = utils.broadcasted_shape((1,)*N,
+                                         *[np.shape(x) for x in arrays])
+    axes = [j for j in range(n) if plates_full[j] == 1]
+    r = 1
+    for j in axes:
+        if shape_full[j] == 1:
+            r *= plates[j]
+    if not keepdims:
+        axes += list(range(n, N))
+    max_dim = max(np.ndim(x) for x in arrays)
+    axes = [j - N for j in axes if j - N >= -max_dim]
+    m = utils.sum_multiply(*arrays, axis=axes, keepdims=True)
+    if keepdims:
+        m = utils.squeeze_to_dim(m, len(plates_parent) + ndim)
+    else:
+        m = np.reshape(m, np.shape(m)[:np.ndim(m)-ndim])
+        m = utils.squeeze_to_dim(m, len(plates_parent))
+    return r * m
+
+
+class LinearGaussian(Stochastic):
+    r"""
+    VMP node for the linear Gaussian likelihood.
+
+    The node represents scalar observations
+
+    .. math::
+
+       y \sim \mathcal{N}(\mathbf{c}^{\mathrm{T}} \mathbf{x}, \tau),
+
+    which is equivalent to ``GaussianArrayARD(SumMultiply('i,i', C, X),
+    tau)``.  However, the messages to the parents and the lower bound term
+    are computed directly from the masked products of the observations and
+    the moments of the parents.  Thus, the moments of the inner product are
+    never stored and the messages are not expanded to the full plates.
+
+    The node is meant for observations only: it can not have children and
+    the unobserved plates are treated as missing values.
+
+    Parameters
+    ----------
+    C : Node
+        Gaussian vectors with moments of shape (D,) and (D,D)
+    X : Node
+        Gaussian vectors with moments of shape (D,) and (D,D)
+    tau : Node or array
+        Gamma distributed noise precision
+
+    See also
+    --------
+    SumMultiply, GaussianArrayARD
+    """
+
+    ndims = (0, 0)
+
+    # Observations are scalars
+    ndim_observations = 0
+
+    def __init__(self, C, X, tau, **kwargs):
+
+        # Check for constant tau
+        if utils.is_numeric(tau):
+            tau = Constant(Gamma)(tau)
+
+        super().__init__(C, X, tau, **kwargs)
+
+        # The masked observations
+        self._mask = np.array(0.0)
+        self._y = np.array(0.0)
+
+    @staticmethod
+    def compute_dims(C, X, tau):
+        """
+        Compute the dimensions of the moments and check the parents.
+        """
+        if len(C.dims[0]) != 1 or C.dims[0] != X.dims[0]:
+            raise ValueError("The parents %s and %s must be Gaussian vectors "
+                             "of equal length"
+                             % (C.name, X.name))
+        if tau.dims != ((), ()):
+            raise ValueError("The noise precision %s must be a scalar"
+                             % tau.name)
+        return ((), ())
+
+    def initialize_from_prior(self):
+        # The unobserved plates are treated as missing values
+        pass
+
+    def _add_child(self, child, index):
+        raise ValueError("The linear Gaussian node %s can not have children"
+                         % self.name)
+
+    @staticmethod
+    def _compute_fixed_moments_and_f(x, mask=True):
+        """ Compute u(x) and f(x) for given x. """
+        u = [x, x**2]
+        f = -0.5*np.log(2*np.pi)
+        return (u, f)
+
+    def observe(self, x, mask=True, cache=False):
+        """
+        Fix the observations and compute the masked observations.
+        """
+        super().observe(x, mask=mask, cache=cache)
+        self._mask = np.asarray(self.observed, dtype=np.float64)
+        self._y = np.where(self.observed, self.u[0], 0)
+
+    def unobserve(self):
+        super().unobserve()
+        self._mask = np.array(0.0)
+        self._y = np.array(0.0)
+
+    def update(self):
+        # The node does not have children, thus the unobserved plates do not
+        # need to be updated
+        pass
+
+    def _message_to_parent(self, index, out=None):
+        """
+        Compute the message to a parent node.
+        """
+        if index >= len(self.parents):
+            raise ValueError("Parent index larger than the number of parents")
+
+        u_parents = self._message_from_parents()
+
+        if index == 2:
+            (m0, m1) = self._message_to_tau(*u_parents)
+            return [m0, m1]
+
+        # Message to C from X or to X from C.  Combine the plate-wise
+        # weights first so that the heavy sums are products of two arrays.
+        u = u_parents[1-index]
+        tau = u_parents[2][0]
+        plates = self._plates_to_parent(index)
+        plates_parent = self.parents[index].plates
+        add_axes = utils.add_trailing_axes
+        m0 = sum_to_plates(plates, plates_parent, 1,
+                           add_axes(tau*self._y, 1),
+                           u[0])
+        m1 = -0.5 * sum_to_plates(plates, plates_parent, 2,
+                                  add_axes(tau*self._mask, 2),
+                                  u[1])
+        return [m0, m1]
+
+    def _sum_inner_product(self, ndim, w, u_C, u_X, plates_to):
+        """
+        Compute the weighted sum of the inner products of u_C and u_X.
+
+        The weights w are summed with the moments of one parent to the plates
+        of the other parent (and plates_to) first, thus the result is never
+        computed for the full plates.
+        """
+        plates = self.plates
+        plates_C = utils.broadcasted_shape(self.parents[0].plates, plates_to)
+        plates_X = utils.broadcasted_shape(self.parents[1].plates, plates_to)
+        if np.prod(plates_C) <= np.prod(plates_X):
+            (plates_1, u_1, u_2) = (plates_C, u_C, u_X)
+        else:
+            (plates_1, u_1, u_2) = (plates_X, u_X, u_C)
+        w = utils.add_trailing_axes(w, ndim)
+        t = sum_to_plates(plates, plates_1, ndim, w, u_2)
+        plates_1 = (1,)*(len(plates)-len(plates_1)) + plates_1
+        return sum_to_plates(plates_1, plates_to, ndim, u_1, t,
+                             keepdims=False)
+
+    def _message_to_tau(self, u_C, u_X, u_tau):
+        """
+        Compute the message to the noise precision.
+
+        The message is computed from the masked sums of y*y, y*c'*x and
+        tr(cc'*xx') over the plates that tau does not have.  The sums of y*y
+        and the numbers of observations are cached by `observe`.
+        """
+        plates_tau = self.parents[2].plates
+        ndim_tau = len(plates_tau)
+        yy = utils.squeeze_to_dim(self._observed_sum(1, plates_tau), ndim_tau)
+        ycx = self._sum_inner_product(1, self._y, u_C[0], u_X[0], plates_tau)
+        ccxx = self._sum_inner_product(2, self._mask, u_C[1], u_X[1],
+                                       plates_tau)
+        m0 = -0.5 * (yy - 2*ycx + ccxx)
+        n = utils.squeeze_to_dim(self._observed_sum('n', plates_tau), ndim_tau)
+        m1 = 0.5 * n
+        return (m0, m1)
+
+    def lower_bound_contribution(self, gradient=False, batch_axes=0):
+        """
+        Compute E[ log p(Y|parents) ] over q(parents)
+
+        If batch_axes is positive, the given number of leading plate axes are
+        not summed over, thus the contributions of the batch members are
+        returned.
+        """
+        u_parents = self._message_from_parents()
+        (m0, m1) = self._message_to_tau(*u_parents)
+        u_tau = u_parents[2]
+        plates_tau = self.parents[2].plates
+        n = utils.squeeze_to_dim(self._observed_sum('n', plates_tau),
+                                 len(plates_tau))
+        L = u_tau[0]*m0 + u_tau[1]*m1 - 0.5*np.log(2*np.pi)*n
+        if batch_axes > 0:
+            L = utils.add_leading_axes(L, len(self.plates) - np.ndim(L))
+            L = np.sum(L, axis=tuple(range(batch_axes, np.ndim(L))))
+            return L * np.ones(self.plates[:batch_axes])
+        return np.sum(L)
+
+
+class SparseLinearGaussian(Stochastic):
+    r"""
+    VMP node for the linear Gaussian likelihood of sparse observations.
+
+    The node represents scalar observations
+
+    .. math::
+
+       y_{mn} \sim \mathcal{N}(\mathbf{c}_m^{\mathrm{T}} \mathbf{x}_n, \tau),
+
+    for the observed pairs (m,n) only, as `LinearGaussian` with a mask.
+    However, the observations are stored as sparse matrices and the messages
+    and the lower bound term are computed with sparse matrix products over
+    the observed entries, thus the cost scales with the number of
+    observations instead of the number of plates.  The observations can be
+    given as coordinate arrays with `observe_coo`.  The plates are the rows
+    and the columns, thus the node can not be batched.
+
+    Parameters
+    ----------
+    C : Node
+        Gaussian vectors for the rows with plates (M,1)
+    X : Node
+        Gaussian vectors for the columns with plates (N,) or (1,N)
+    tau : Node or array
+        Gamma distributed noise precision without plates
+
+    See also
+    --------
+    LinearGaussian
+    """
+
+    ndims = (0, 0)
+
+    # Observations are scalars
+    ndim_observations = 0
+
+    def __init__(self, C, X, tau, **kwargs):
+
+        # Check for constant tau
+        if utils.is_numeric(tau):
+            tau = Constant(Gamma)(tau)
+
+        super().__init__(C, X, tau, **kwargs)
+
+        if len(self.plates) != 2:
+            raise ValueError("The plates of the node %s must be the rows "
+                             "and the columns, now %s (batches are not "
+                             "supported)"
+                             % (self.name, self.plates))
+        for (index, axis) in ((0, 1), (1, 0)):
+            plates = self.parents[index].plates
+            plates = (1,)*(2-len(plates)) + plates
+            if len(plates) != 2 or plates[axis] != 1:
+                raise ValueError("The plates %s of the parent %s do not "
+                                 "match the plates %s of the node %s"
+                                 % (self.parents[index].plates,
+                                    self.parents[index].name,
+                                    self.plates,
+                                    self.name))
+
+        # No observations
+        self._Y = None
+        self._N = None
+        self._YY = None
+        self._yy = 0
+        self._count = 0
+
+    @staticmethod
+    def compute_dims(C, X, tau):
+        """
+        Compute the dimensions of the moments and check the parents.
+        """
+        dims = LinearGaussian.compute_dims(C, X, tau)
+        if np.prod(tau.plates) != 1:
+            raise ValueError("The noise precision %s must not have plates"
+                             % tau.name)
+        return dims
+
+    def initialize_from_prior(self):
+        # The unobserved plates are treated as missing values
+        pass
+
+    def _add_child(self, child, index):
+        raise ValueError("The linear Gaussian node %s can not have children"
+                         % self.name)
+
+    def observe(self, x, mask=True, cache=False):
+        """
+        Fix the observations of the plates given by the mask.
+
+        The observed statistics are stored as sparse matrices, thus `cache`
+        has no effect.
+        """
+        mask = np.broadcast_to(mask, self.plates)
+        (rows, cols) = np.nonzero(mask)
+        x = np.broadcast_to(x, self.plates)
+        self.observe_coo(rows, cols, x[rows,cols])
+
+    def observe_coo(self, rows, cols, values):
+        """
+        Fix the observations given in the coordinate format.
+
+        Parameters
+        ----------
+        rows : array of ints
+            The row indices of the observations
+        cols : array of ints
+            The column indices of the observations
+        values : array
+            The observed values
+        """
+        values = np.ravel(np.asarray(values, dtype=np.float64))
+        ij = (np.ravel(rows), np.ravel(cols))
+        # Multiple observations of the same entry are summed by the sparse
+        # matrices which gives the correct statistics
+        self._Y = sparse.csr_matrix((values, ij), shape=self.plates)
+        self._N = sparse.csr_matrix((np.ones(len(values)), ij),
+                                    shape=self.plates)
+        self._YY = sparse.csr_matrix((values**2, ij), shape=self.plates)
+        self._update_sums()
+        self.observed = True
+        self._update_mask()
+
+    def update_observations(self, x, index):
+        """
+        Change the observations of some entries.
+
+        The previous observations of the entries are replaced.  The entries
+        are added to the dirty plates as in `Stochastic.update_observations`.
+
+        Parameters
+        ----------
+        x : array
+            The new observations, shape (n,)
+        index : tuple of int arrays or boolean array
+            The indices of the n changed entries, for instance, from
+            `numpy.nonzero`, or a boolean array of the plates.
+        """
+        index = self._plate_index(index)
+        n = len(index[0])
+        x = np.ravel(np.asarray(x, dtype=np.float64))
+        if np.shape(x) != (n,):
+            raise ValueError("The shape of the observations %s does not "
+                             "match the shape %s"
+                             % (np.shape(x), (n,)))
+        if self._Y is None:
+            self.observe_coo(index[0], index[1], x)
+        else:
+            # Remove the previous observations of the entries
+            changed = sparse.csr_matrix((np.ones(n), index),
+                                        shape=self.plates)
+            changed.data[:] = 1
+            keep = lambda A: A - A.multiply(changed)
+            self._Y = keep(self._Y) + sparse.csr_matrix((x, index),
+                                                        shape=self.plates)
+            self._N = keep(self._N) + changed
+            self._YY = keep(self._YY) + sparse.csr_matrix((x**2, index),
+                                                          shape=self.plates)
+            self._update_sums()
+
+        if self.dirty is None:
+            self.dirty = np.zeros(self.plates, dtype=bool)
+        else:
+            self.dirty = np.array(self.dirty)
+        self.dirty[index] = True
+
+    def _update_sums(self):
+        self._yy = self._YY.sum()
+        self._count = self._N.sum()
+
+    def unobserve(self):
+        super().unobserve()
+        self._Y = None
+        self._N = None
+        self._YY = None
+        self._yy = 0
+        self._count = 0
+
+    def update(self):
+        # The node does not have children, thus the unobserved plates do not
+        # need to be updated
+        pass
+
+    def _factors(self, u, index):
+        """
+        Reshape the moments of parent[index] to (rows or columns) x D^k.
+        """
+        length = self.plates[index]
+        x0 = utils.add_leading_axes(u[0], 3 - np.ndim(u[0]))
+        x1 = utils.add_leading_axes(u[1], 4 - np.ndim(u[1]))
+        if index == 0:
+            (x0, x1) = (x0[:,0], x1[:,0])
+        else:
+            (x0, x1) = (x0[0], x1[0])
+        D = np.shape(x0)[-1]
+        return (np.broadcast_to(x0, (length, D)),
+                np.reshape(np.broadcast_to(x1, (length, D, D)),
+                           (length, D*D)))
+
+    def _message_to_parent(self, index, out=None):
+        """
+        Compute the message to a parent node.
+        """
+        if index >= len(self.parents):
+            raise ValueError("Parent index larger than the number of parents")
+        if self._Y is None:
+            raise ValueError("The node %s is not observed" % self.name)
+
+        (u_C, u_X, u_tau) = self._message_from_parents()
+
+        if index == 2:
+            (m0, m1) = self._message_to_tau(u_C, u_X)
+            return [m0, m1]
+
+        # Sum the moments of the other parent over the observed entries of
+        # each row (or column)
+        tau = np.reshape(u_tau[0], ())
+        if index == 0:
+            (x0, x1) = self._factors(u_X, 1)
+            (Y, N) = (self._Y, self._N)
+        else:
+            (x0, x1) = self._factors(u_C, 0)
+            (Y, N) = (self._Y.T, self._N.T)
+        D = np.shape(x0)[-1]
+        m0 = tau * Y.dot(x0)
+        m1 = -0.5 * tau * np.reshape(N.dot(x1), (-1, D, D))
+
+        # Sum to the plates of the parent
+        plates = [1, 1]
+        plates[index] = self.plates[index]
+        plates = tuple(plates)
+        plates_parent = self.parents[index].plates
+        m0 = np.reshape(m0, plates + (D,))
+        m1 = np.reshape(m1, plates + (D,D))
+        return [sum_to_plates(plates, plates_parent, 1, m0),
+                sum_to_plates(plates, plates_parent, 2, m1)]
+
+    def _message_to_tau(self, u_C, u_X):
+        """
+        Compute the message to the noise precision.
+        """
+        (c0, c1) = self._factors(u_C, 0)
+        (x0, x1) = self._factors(u_X, 1)
+        ycx = np.sum(c0 * self._Y.dot(x0))
+        ccxx = np.sum(c1 * self._N.dot(x1))
+        m0 = -0.5 * (self._yy - 2*ycx + ccxx)
+        m1 = 0.5 * self._count
+        shape = self.parents[2].plates
+        return (m0 * np.ones(shape), m1 * np.ones(shape))
+
+    def lower_bound_contribution(self, gradient=False, batch_axes=0):
+        """
+        Compute E[ log p(Y|parents) ] over q(parents)
+        """
+        if batch_axes > 0:
+            raise ValueError("The node %s can not be batched" % self.name)
+        if self._Y is None:
+            return 0
+        (u_C, u_X, u_tau) = self._message_from_parents()
+        (m0, m1) = self._message_to_tau(u_C, u_X)
+        return (np.sum(u_tau[0]*m0 + u_tau[1]*m1)
+                - 0.5*np.log(2*np.pi)*self._count)
@@ -28,6 +28,7 @@ import scipy.linalg.decomp_cholesky as decomp
 import scipy.linalg as linalg
 import scipy.special as special
 import scipy.spatial.distance as distance
+import scipy.sparse
 
 from bayespy.utils import utils
 
@@ -35,6 +36,129 @@ from .expfamily import ExponentialFamily
 from .constant import Constant
 from .categorical import Categorical
 
+def truncated_responsibilities(P):
+    """
+    Return the indices and the weights of truncated responsibilities.
+
+    Returns None if the responsibilities are not truncated.  See
+    `Categorical` for the truncation.
+    """
+    indices = getattr(P, 'indices', None)
+    if indices is None:
+        return None
+    return (indices, P.weights)
+
+
+def cluster_parameters(X, ndim):
+    """
+    Reshape cluster parameters to shape (K, D1, ..., Dndim).
+
+    The cluster axis must be the last plate axis of X.  Returns None if X
+    has other non-unit plate axes, that is, the parameters are not shared
+    by all the data points.
+    """
+    X = utils.add_leading_axes(X, ndim + 1 - np.ndim(X))
+    shape = np.shape(X)
+    n = len(shape) - ndim - 1
+    if any(s != 1 for s in shape[:n]):
+        return None
+    return np.reshape(X, shape[n:])
+
+
+def gather_clusters(X, ndim, indices, weights):
+    """
+    Compute weighted sums of cluster parameters over truncated clusters.
+
+    Parameters
+    ----------
+    X : array, shape (..., K, D1, ..., Dndim)
+        The cluster axis is the last plate axis.  The result is None if X
+        has other non-unit plate axes.
+    ndim : int
+        The number of variable axes
+    indices : int array, shape (N1, ..., Nn, k)
+    weights : array, shape (N1, ..., Nn, k)
+
+    Returns
+    -------
+    array, shape (N1, ..., Nn, D1, ..., Dndim)
+    """
+    X = cluster_parameters(X, ndim)
+    if X is None:
+        return None
+    if np.shape(X)[0] == 1:
+        w = utils.add_trailing_axes(np.sum(weights, axis=-1), ndim)
+        return w * X[0]
+    w = utils.add_trailing_axes(weights, ndim)
+    return np.sum(w * X[indices], axis=-1-ndim)
+
+
+def dot_clusters(X, ndim, P):
+    """
+    Compute weighted sums of cluster parameters as a matrix product.
+
+    Parameters
+    ----------
+    X : array, shape (..., K, D1, ..., Dndim)
+        The cluster axis is the last plate axis.  The result is None if X
+        has other non-unit plate axes.
+    ndim : int
+        The number of variable axes
+    P : array, shape (N1, ..., Nn, K)
+
+    Returns
+    -------
+    array, shape (N1, ..., Nn, D1, ..., Dndim)
+    """
+    X = cluster_parameters(X, ndim)
+    if X is None:
+        return None
+    P = np.asarray(P)
+    if np.shape(X)[0] == 1:
+        w = utils.add_trailing_axes(np.sum(P, axis=-1), ndim)
+        return w * X[0]
+    K = np.shape(P)[-1]
+    Y = np.dot(np.reshape(P, (-1, K)), np.reshape(X, (K, -1)))
+    return np.reshape(Y, np.shape(P)[:-1] + np.shape(X)[1:])
+
+
+def cluster_logpdf(u, phi, g, ndims):
+    """
+    Compute the expected log-densities of data points for each cluster.
+
+    The inner products of the moments and the natural parameters are
+    computed as matrix products, thus no arrays of shape (N, K, D1, ...,
+    Dd) are formed.
+
+    Parameters
+    ----------
+    u : list of arrays, shapes (N1, ..., Nn, D1, ..., Dd)
+    phi : list of arrays, shapes (..., K, D1, ..., Dd)
+        The cluster axis is the last plate axis.  The result is None if
+        the parameters have other non-unit plate axes.
+    g : array, shape (..., K)
+    ndims : list of ints
+        The number of variable axes for each moment
+
+    Returns
+    -------
+    array, shape (N1, ..., Nn, K)
+    """
+    g = cluster_parameters(g, 0)
+    if g is None:
+        return None
+    L = g
+    for (u_i, phi_i, ndim) in zip(u, phi, ndims):
+        phi_i = cluster_parameters(phi_i, ndim)
+        if phi_i is None:
+            return None
+        plates = np.shape(u_i)[:np.ndim(u_i)-ndim]
+        phi_i = np.reshape(phi_i, (np.shape(phi_i)[0], -1))
+        u_i = np.reshape(u_i, (-1, np.shape(phi_i)[-1]))
+        L = L + np.reshape(np.dot(u_i, phi_i.T), plates + (-1,))
+    return L
+
+
 def Mixture(distribution, cluster_plate=-1):
 
     if cluster_plate >= 0:
@@ -69,6 +193,22 @@ def Mixture(distribution, cluster_plate=-1):
             # Contributions/weights/probabilities
             P = u_parents[0][0]
 
+            # If the cluster parameters are shared by all data points, sum
+            # over the clusters with matrix products or, if the
+            # responsibilities are truncated, only over the non-zero
+            # responsibilities
+            if cluster_plate == -1:
+                R = truncated_responsibilities(P)
+                if R is not None:
+                    phi = [gather_clusters(Phi[ind], distribution.ndims[ind],
+                                           *R)
+                           for ind in range(len(Phi))]
+                else:
+                    phi = [dot_clusters(Phi[ind], distribution.ndims[ind], P)
+                           for ind in range(len(Phi))]
+                if all(phi_i is not None for phi_i in phi):
+                    return phi
+
             phi = list()
             
             for ind in range(len(Phi)):
@@ -123,6 +263,17 @@ def Mixture(distribution, cluster_plate=-1):
             # Compute g for clusters:
             # Shape(g)      = [Nn,..,K,..,N0]
             g = distribution._compute_cgf_from_parents(*(u_parents[1:]))
+
+            # Sum over the clusters as in _compute_phi_from_parents
+            if cluster_plate == -1:
+                P = u_parents[0][0]
+                R = truncated_responsibilities(P)
+                if R is not None:
+                    g_P = gather_clusters(g, 0, *R)
+                else:
+                    g_P = dot_clusters(g, 0, P)
+                if g_P is not None:
+                    return g_P
             
             # Move cluster axis to last:
             # Shape(g)      = [Nn,..,N0,K]
@@ -168,6 +319,15 @@ def Mixture(distribution, cluster_plate=-1):
                 # Compute g:
                 # Shape(g)      = [Nn,..,K,..,N0]
                 g = distribution._compute_cgf_from_parents(*(u_parents[1:]))
+
+                # If the cluster parameters are shared by all data points,
+                # compute the log-densities with matrix products
+                if cluster_plate == -1:
+                    phi = distribution._compute_phi_from_parents(*(u_parents[1:]))
+                    L = cluster_logpdf(u, phi, g, distribution.ndims)
+                    if L is not None:
+                        return [L]
+
                 # Reshape(g):
                 # Shape(g)      = [Nn,..,N0,K]
                 g = utils.moveaxis(g, cluster_plate, -1)
@@ -221,7 +381,8 @@ def Mixture(distribution, cluster_plate=-1):
                     u_self.append(np.expand_dims(u[ind], axis=cluster_axis))
                     
                 # Message from the mixed distribution
-                m = distribution._compute_message_to_parent(index, 
+                m = distribution._compute_message_to_parent(parent,
+                                                            index, 
                                                             u_self, 
                                                             *(u_parents[1:]))
 
@@ -285,6 +446,81 @@ def Mixture(distribution, cluster_plate=-1):
             super().__init__(z, *args,
                              **kwargs)
 
+        def _compute_mask_to_parent(self, index, mask):
+            # Add the cluster axis to the mask for the cluster parameters
+            if index >= 1 and np.ndim(mask) > 0:
+                mask = np.expand_dims(mask, axis=cluster_plate)
+            return mask
+
+        def _message_to_parent(self, index, out=None):
+            if index >= 1:
+                m = self._weighted_message_to_parent(index)
+                if m is not None:
+                    return m
+            return super()._message_to_parent(index, out=out)
+
+        def _weighted_message_to_parent(self, index):
+            """
+            Compute the message to a cluster parameter parent from
+            responsibility-weighted sufficient statistics.
+
+            The message from a data point is affine in the moments of the
+            data point, thus the messages of each cluster can be computed
+            from the responsibility-weighted sums of the moments.  This
+            avoids arrays of shape (N, K, D1, ..., Dd).  If the
+            responsibilities are truncated, the sums use only the non-zero
+            responsibilities.  Returns None if the cluster parameters are
+            not shared by all data points.
+            """
+            if cluster_plate != -1:
+                return None
+            for parent in self.parents[1:]:
+                if np.prod(parent.plates[:-1]) != 1:
+                    return None
+            u_parents = self._message_from_parents(exclude=index)
+
+            # Responsibility matrix (K x N) of the data points in the mask
+            K = self.parents[0].dims[0][0]
+            N = int(np.prod(self.plates))
+            mask = utils.broadcast_to_shape(self.mask, self.plates)
+            P = u_parents[0][0]
+            R = truncated_responsibilities(P)
+            if R is not None and np.shape(R[0])[:-1] == self.plates:
+                (indices, weights) = R
+                k = np.shape(indices)[-1]
+                weights = weights * mask[...,np.newaxis]
+                W = scipy.sparse.csr_matrix((np.ravel(weights),
+                                             (np.ravel(indices),
+                                              np.repeat(np.arange(N), k))),
+                                            shape=(K, N))
+            else:
+                P = utils.broadcast_to_shape(np.asarray(P), self.plates + (K,))
+                W = np.reshape(P * mask[...,np.newaxis], (N, K)).T
+
+            # Weighted averages of the moments for each cluster
+            # Shape(u)      = [K,Dd,..,D0]
+            counts = np.asarray(W.sum(axis=1)).ravel()
+            scale = 1 / np.where(counts > 0, counts, 1)
+            u_self = list()
+            for ind in range(len(self.u)):
+                dims = self.dims[ind]
+                u = utils.broadcast_to_shape(self.u[ind], self.plates + dims)
+                u = W.dot(np.reshape(u, (N, -1))) * scale[:,np.newaxis]
+                u_self.append(np.reshape(u, (K,) + dims))
+
+            # Message from the mixed distribution for the averages,
+            # multiplied by the total responsibilities
+            m = distribution._compute_message_to_parent(self.parents[index],
+                                                        index - 1,
+                                                        u_self,
+                                                        *(u_parents[1:]))
+            parent = self.parents[index]
+            for i in range(len(m)):
+                D = distribution.ndims_parents[index-1][i]
+                m[i] = m[i] * utils.add_trailing_axes(counts, D)
+                m[i] = utils.sum_to_shape(m[i], parent.plates + parent.dims[i])
+            return m
+
             #_compute_mask_to_parent(index, mask)
             #_plates_to_parent(self, index)
             #_plates_from_parent(self, index)
@@ -377,7 +613,9 @@ def Mixture(distribution, cluster_plate=-1):
                 return lpdf
 
             raise NotImplementedError()
-        
+
+    _Mixture._factory = (Mixture, (distribution,), 
+                         dict(cluster_plate=cluster_plate))
     return _Mixture
 
     ## def show(self):
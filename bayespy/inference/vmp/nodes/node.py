@@ -21,6 +21,9 @@
 # along with BayesPy.  If not, see <http://www.gnu.org/licenses/>.
 ######################################################################
 
+import threading
+import contextlib
+
 import numpy as np
 
 from bayespy.utils import utils
@@ -62,6 +65,31 @@ def message_sum_multiply(plates_parent, dims_parent, *arrays):
     m = utils.squeeze_to_dim(m, len(shape_parent))
     return m
 
+
+# The hooks for the nodes constructed in each thread
+_construction = threading.local()
+
+@contextlib.contextmanager
+def plates_hook(hook):
+    """
+    Modify the plates of the nodes constructed in this thread.
+
+    Within the context, hook(node, plates) is called at the beginning of the
+    construction of each node and it returns the plates for the node.  The
+    hook affects only the current thread, thus models can be constructed
+    concurrently in other threads.  The contexts can not be nested.  This is
+    used, for instance, for adding a batch plate axis, see
+    `bayespy.inference.vmp.batch`.
+    """
+    if getattr(_construction, 'plates_hook', None) is not None:
+        raise RuntimeError("Node construction hooks can not be nested")
+    _construction.plates_hook = hook
+    try:
+        yield
+    finally:
+        _construction.plates_hook = None
+
+
 class Statistics():
     """
     Base class for defining sufficient statistic for nodes.
@@ -94,6 +122,66 @@ class Statistics():
         else:
             raise Exception("No conversion defined")
     
+class SparseMessage():
+    """
+    Message array which is non-zero only in a sub-array.
+
+    Slicing nodes send messages which are zero outside the sliced region of
+    the parent.  Instead of allocating a full array of zeros, the message is
+    represented by the basic index of the region and the values in the
+    region.  The message is added to the dense message buffer of the parent
+    with an index-add.  The message can be converted to a dense array with
+    `toarray` or `numpy.asarray`.
+
+    Parameters
+    ----------
+    shape : tuple
+       The shape of the full message array
+    index : tuple
+       Basic index (integers and slices) of the non-zero region
+    values : ndarray
+       The values in the region (broadcastable to the shape of the region)
+    """
+
+    def __init__(self, shape, index, values):
+        self.shape = tuple(shape)
+        self.ndim = len(self.shape)
+        self.index = tuple(index)
+        self.values = values
+
+    def toarray(self):
+        m = np.zeros(self.shape)
+        m[self.index] = self.values
+        return m
+
+    def __array__(self, dtype=None):
+        m = self.toarray()
+        if dtype is not None:
+            m = m.astype(dtype)
+        return m
+
+    def multiply(self, x):
+        """
+        Multiply by an array which broadcasts to the shape of the message.
+        """
+        x = np.broadcast_to(x, self.shape)[self.index]
+        return SparseMessage(self.shape, self.index, self.values * x)
+
+    def add_to(self, x):
+        """
+        Add the message to an array in-place if possible.
+
+        Returns the array which may be a new array if x needed to be
+        broadcasted.
+        """
+        shape = utils.broadcasted_shape(np.shape(x), self.shape)
+        if np.shape(x) != shape:
+            x = x + np.zeros(shape)
+        index = (slice(None),)*(len(shape)-self.ndim) + self.index
+        x[index] += self.values
+        return x
+
+
 class Node():
     """
     Base class for all nodes.
@@ -120,9 +208,58 @@ class Node():
 
     # Child classes should consider overwriting this
     _statistics_class = Statistics
+
+    # Cached message plans, None if the node has not been compiled
+    _plans = None
+
+    # Whether a batch plate axis can be added to this node
+    _batchable = True
+
+    # Persistent buffers for accumulating the messages from children
+    _message_buffers = None
+
+    # For classes constructed by a class factory, (factory, args, kwargs) so
+    # that the class can be constructed again (see
+    # bayespy.inference.vmp.artifact)
+    _factory = None
+
+    def __new__(cls, *args, **kwargs):
+        # Record the constructor call so that the node can be constructed
+        # again.  The array arguments are released in __init__ (see
+        # _set_recipe).  Node factory functions may overwrite the recipe.
+        self = super().__new__(cls)
+        self._recipe = (cls, args, kwargs)
+        return self
     
+    def _set_recipe(self, constructor, args, kwargs):
+        """
+        Record how the node can be constructed again.
+
+        Array arguments that were converted to constant parent nodes are
+        replaced by the parent nodes, thus the node does not keep the arrays
+        alive.  The constant nodes are saved with their arrays in model
+        artifacts (see `bayespy.inference.vmp.artifact`).  Other arrays are
+        kept as they are.
+        """
+        def record(x):
+            if isinstance(x, np.ndarray):
+                for parent in self.parents:
+                    recipe = getattr(parent, '_recipe', None)
+                    if (recipe is not None and len(recipe[1]) > 0
+                        and recipe[1][0] is x):
+                        return parent
+            return x
+        self._recipe = (constructor,
+                        tuple(record(x) for x in args),
+                        {key: record(x) for (key, x) in kwargs.items()})
+
     def __init__(self, *parents, dims=None, plates=None, name="", plotter=None):
 
+        # Let the batching facility add the batch plate axis
+        hook = getattr(_construction, 'plates_hook', None)
+        if hook is not None:
+            plates = hook(self, plates)
+
         self.statistics = self._statistics_class(self)
 
         if dims is None:
@@ -136,6 +273,7 @@ class Node():
 
         # Parents
         self.parents = parents
+        self._set_recipe(*self._recipe)
         # Inform parent nodes
         for (index,parent) in enumerate(self.parents):
             if parent:
@@ -296,6 +434,10 @@ class Node():
     def _message_to_child(self):
 
         u = self.get_moments()
+
+        # The shapes have been validated when the plan was compiled
+        if self._plans is not None:
+            return u
         
         # Debug: Check that the message has appropriate shape
         for (ui, dim) in zip(u, self.dims):
@@ -328,8 +470,151 @@ class Node():
                            self.plates,
                            self.name))
         return u
+
+    def compile(self):
+        """
+        Start caching the shape algebra of the messages to parents.
+
+        After compiling, the plans computed by `_message_plan` are stored and
+        the debug checks of the moment shapes are skipped.
+        """
+        if self._plans is None:
+            self._plans = {}
+
+    def uncompile(self):
+        """
+        Remove the cached plans and restore the debug checks.
+        """
+        self._plans = None
+
+    def _message_plan(self, *args):
+        """
+        Get the plan for compacting a message to a parent.
+
+        The plan is computed by `_compute_message_plan` and it depends only on
+        the given shapes, thus it is cached for compiled nodes.
+        """
+        if self._plans is not None:
+            try:
+                return self._plans[args]
+            except KeyError:
+                plan = self._compute_message_plan(*args)
+                self._plans[args] = plan
+                return plan
+        return self._compute_message_plan(*args)
+
+    def _compute_message_plan(self, index, i, shape_m, plates_mask):
+        """
+        Compute the shape algebra for compacting a message to parent[index].
+
+        Returns a tuple (shape_mask, axes_mask, r, keys_mask, keys_m,
+        keys_out, shape_sum, shape_out): the mask is reshaped to shape_mask
+        and summed over axes_mask, then the masked message is computed with
+        einsum using the keys and multiplied by the plate multiplier r.  The
+        einsum result has shape shape_sum and it is reshaped to shape_out.  If
+        keys_out is None, the arrays are scalars and einsum must not be used.
+        """
+
+        # The parent we're sending the message to
+        parent = self.parents[index]
+
+        # Plates in the message
+        dim_parent = len(parent.dims[i])
+        if dim_parent > 0:
+            plates_m = shape_m[:-dim_parent]
+        else:
+            plates_m = shape_m
+
+        # Compute the multiplier (multiply by the number of plates for which
+        # the message, the mask and the parent have single plates).  Such a
+        # plate is meant to be broadcasted but because the parent has singular
+        # plate axis, it won't broadcast (and sum over it), so we need to
+        # multiply it.
+        plates_self = self._plates_to_parent(index)
+        try:
+            r = self._plate_multiplier(plates_self, 
+                                       plates_m,
+                                       plates_mask,
+                                       parent.plates)
+        except ValueError:
+            raise ValueError("The plates of the message, the mask and "
+                             "parent[%d] node (%s) are not a "
+                             "broadcastable subset of the plates of "
+                             "this node (%s).  The message has shape "
+                             "%s, meaning plates %s. The mask has "
+                             "plates %s. This node has plates %s with "
+                             "respect to the parent[%d], which has "
+                             "plates %s."
+                             % (index,
+                                parent.name,
+                                self.name,
+                                shape_m, 
+                                plates_m, 
+                                plates_mask,
+                                plates_self,
+                                index, 
+                                parent.plates))
+
+        # Add variable axes to the mask
+        shape_mask = plates_mask + (1,) * dim_parent
+
+        # Sum the mask over plates that are not in the message nor in the
+        # parent
+        shape_parent = parent.get_shape(i)
+        shape_msg = utils.broadcasted_shape(shape_m, shape_parent)
+        axes_mask = utils.axes_to_collapse(shape_mask, shape_msg)
+        shape_mask_sum = tuple(1 if j-len(shape_mask) in axes_mask else d
+                               for (j, d) in enumerate(shape_mask))
+
+        # Sum over the plates that the parent does not have
+        axes_msg = utils.axes_to_collapse(shape_msg, shape_parent)
+
+        # Keys for einsum (the arrays are aligned to the right)
+        max_dim = max(len(shape_mask), len(shape_m))
+        keys_mask = list(range(max_dim-len(shape_mask), max_dim))
+        keys_m = list(range(max_dim-len(shape_m), max_dim))
+        shape_full = utils.broadcasted_shape(shape_mask_sum, shape_m)
+        keys_out = [k for k in range(max_dim) if k-max_dim not in axes_msg]
+        if max_dim == 0:
+            keys_out = None
+
+        # Restore summed axes as singleton axes and remove leading singular
+        # plates if the parent does not have those plate axes
+        shape_out = tuple(1 if k-max_dim in axes_msg else d
+                          for (k, d) in enumerate(shape_full))
+        ndim_extra = len(shape_out) - len(shape_parent)
+        if ndim_extra > 0:
+            if any(d != 1 for d in shape_out[:ndim_extra]):
+                raise ValueError("The message to parent[%d] node (%s) has "
+                                 "shape %s which can not be squeezed to the "
+                                 "shape %s of the parent."
+                                 % (index,
+                                    parent.name,
+                                    shape_out,
+                                    shape_parent))
+            shape_out = shape_out[ndim_extra:]
+
+        if keys_out is None:
+            shape_sum = ()
+        else:
+            shape_sum = utils.einsum_shape_from_shapes(shape_mask_sum,
+                                                       keys_mask,
+                                                       shape_m,
+                                                       keys_m,
+                                                       keys_out)
+
+        return (shape_mask, axes_mask, r, keys_mask, keys_m, keys_out,
+                shape_sum, shape_out)
                 
-    def _message_to_parent(self, index):
+    def _message_to_parent(self, index, out=None):
+        """
+        Compute the message to a parent node.
+
+        If out is given, it is a list of arrays (or None) for the messages.
+        If a message has exactly the shape of the corresponding array, the
+        message is written into the array and the array is returned as the
+        message.  Otherwise, a new array is allocated.
+        """
 
         # Compute the message, check plates, apply mask and sum over some plates
         if index >= len(self.parents):
@@ -342,89 +627,141 @@ class Node():
         # Plates in the mask
         plates_mask = np.shape(mask)
 
-        # The parent we're sending the message to
-        parent = self.parents[index]
-
         # Compact the message to a proper shape
         for i in range(len(m)):
 
             # Empty messages are given as None. We can ignore those.
             if m[i] is not None:
 
-                # Plates in the message
-                shape_m = np.shape(m[i])
-                dim_parent = len(parent.dims[i])
-                if dim_parent > 0:
-                    plates_m = shape_m[:-dim_parent]
-                else:
-                    plates_m = shape_m
-
-                # Compute the multiplier (multiply by the number of plates for
-                # which the message, the mask and the parent have single
-                # plates).  Such a plate is meant to be broadcasted but because
-                # the parent has singular plate axis, it won't broadcast (and
-                # sum over it), so we need to multiply it.
-                plates_self = self._plates_to_parent(index)
-                try:
-                    r = self._plate_multiplier(plates_self, 
-                                               plates_m,
-                                               plates_mask,
-                                               parent.plates)
-                except ValueError:
-                    raise ValueError("The plates of the message, the mask and "
-                                     "parent[%d] node (%s) are not a "
-                                     "broadcastable subset of the plates of "
-                                     "this node (%s).  The message has shape "
-                                     "%s, meaning plates %s. The mask has "
-                                     "plates %s. This node has plates %s with "
-                                     "respect to the parent[%d], which has "
-                                     "plates %s."
-                                     % (index,
-                                        parent.name,
-                                        self.name,
-                                        np.shape(m[i]), 
-                                        plates_m, 
-                                        plates_mask,
-                                        plates_self,
-                                        index, 
-                                        parent.plates))
-
-                # Add variable axes to the mask
-                shape_mask = np.shape(mask) + (1,) * len(parent.dims[i])
-                mask_i = np.reshape(mask, shape_mask)
+                (shape_mask, axes_mask, r, keys_mask, keys_m, keys_out,
+                 shape_sum, shape_out) = self._message_plan(index, 
+                                                 i, 
+                                                 np.shape(m[i]), 
+                                                 plates_mask)
 
-                # Sum over plates that are not in the message nor in the parent
-                shape_parent = parent.get_shape(i)
-                shape_msg = utils.broadcasted_shape(shape_m, shape_parent)
-                axes_mask = utils.axes_to_collapse(shape_mask, shape_msg)
-                mask_i = np.sum(mask_i, axis=axes_mask, keepdims=True)
+                # Add variable axes to the mask and sum over plates that are
+                # not in the message nor in the parent
+                mask_i = np.reshape(mask, shape_mask)
+                if len(axes_mask) > 0:
+                    mask_i = np.sum(mask_i, axis=axes_mask, keepdims=True)
+
+                # Sparse messages can be kept sparse if no axes are summed
+                if isinstance(m[i], SparseMessage):
+                    if (shape_out == m[i].shape 
+                        and keys_out == list(range(m[i].ndim))):
+                        m[i] = m[i].multiply(mask_i)
+                        if r != 1:
+                            m[i] = m[i].multiply(r)
+                        continue
+                    else:
+                        m[i] = m[i].toarray()
 
                 # Compute the masked message and sum over the plates that the
                 # parent does not have.
-                axes_msg = utils.axes_to_collapse(shape_msg, shape_parent)
-                m[i] = utils.sum_multiply(mask_i, m[i], r, 
-                                          axis=axes_msg, 
-                                          keepdims=True)
-
-                # Remove leading singular plates if the parent does not have
-                # those plate axes.
-                m[i] = utils.squeeze_to_dim(m[i], len(shape_parent))
+                if keys_out is None:
+                    m[i] = mask_i * m[i] * r
+                elif (out is not None and out[i] is not None
+                      and np.shape(out[i]) == shape_out):
+                    args = (mask_i, keys_mask, m[i], keys_m, r, [], keys_out)
+                    np.einsum(*args, out=np.reshape(out[i], shape_sum))
+                    m[i] = out[i]
+                    continue
+                else:
+                    m[i] = np.einsum(mask_i, keys_mask,
+                                     m[i], keys_m,
+                                     r, [],
+                                     keys_out)
+                m[i] = np.reshape(m[i], shape_out)
 
         return m
 
     def _message_from_children(self):
-        msg = [np.array(0.0) for i in range(len(self.dims))]
+        """
+        Sum the messages from the children.
+
+        The messages are accumulated into persistent buffers which have the
+        shapes of the previous sums.  The children write their messages
+        directly into the buffers if the shapes match, thus the buffers are
+        reused as long as the message shapes do not change.  The returned
+        arrays may be the buffers, thus they must not be stored or modified.
+        """
+        buffers = self._message_buffers
+        if buffers is None:
+            buffers = [(None, None) for i in range(len(self.dims))]
+        msg = [None for i in range(len(self.dims))]
+        owned = [False for i in range(len(self.dims))]
+        count = [0 for i in range(len(self.dims))]
+        sparse = [[] for i in range(len(self.dims))]
         for (child,index) in self.children:
-            m = child._message_to_parent(index)
+            # The first message is written into the buffer and the rest into
+            # the scratch buffer
+            out = [buffers[i][0] if msg[i] is None else buffers[i][1]
+                   for i in range(len(self.dims))]
+            if all(out_i is None for out_i in out):
+                m = child._message_to_parent(index)
+            else:
+                m = child._message_to_parent(index, out=out)
             for i in range(len(self.dims)):
                 if m[i] is not None:
                     # Check broadcasting shapes
-                    sh = utils.broadcasted_shape(self.get_shape(i), np.shape(m[i]))
-                    try:
-                        # Try exploiting broadcasting rules
+                    if self._plans is None:
+                        sh = utils.broadcasted_shape(self.get_shape(i),
+                                                     np.shape(m[i]))
+                    if isinstance(m[i], SparseMessage):
+                        # Add sparse messages after the dense messages
+                        sparse[i].append(m[i])
+                        continue
+                    count[i] += 1
+                    buffer = buffers[i][0]
+                    if msg[i] is None:
+                        if m[i] is buffer:
+                            # The child wrote the message into the buffer
+                            (msg[i], owned[i]) = (buffer, True)
+                        elif (buffer is not None and
+                              utils.is_shape_subset(np.shape(m[i]),
+                                                    np.shape(buffer))):
+                            np.copyto(buffer, m[i])
+                            (msg[i], owned[i]) = (buffer, True)
+                        else:
+                            # Do not modify the array of the child
+                            (msg[i], owned[i]) = (m[i], False)
+                    elif (owned[i] and
+                          utils.is_shape_subset(np.shape(m[i]),
+                                                np.shape(msg[i]))):
+                        # Exploit broadcasting rules
                         msg[i] += m[i]
-                    except ValueError:
+                    else:
                         msg[i] = msg[i] + m[i]
+                        owned[i] = True
+
+        # Scatter-add the sparse messages
+        for i in range(len(self.dims)):
+            if len(sparse[i]) > 0:
+                if msg[i] is None:
+                    buffer = buffers[i][0]
+                    if buffer is not None:
+                        buffer.fill(0)
+                        (msg[i], owned[i]) = (buffer, True)
+                    else:
+                        (msg[i], owned[i]) = (np.array(0.0), True)
+                elif not owned[i]:
+                    msg[i] = np.array(msg[i], dtype=np.float64)
+            for m_i in sparse[i]:
+                msg[i] = m_i.add_to(msg[i])
+            if msg[i] is None:
+                msg[i] = np.array(0.0)
+
+        # Allocate new buffers if the shapes of the messages changed
+        for i in range(len(self.dims)):
+            (buffer, scratch) = buffers[i]
+            sh = np.shape(msg[i])
+            if buffer is None or np.shape(buffer) != sh:
+                buffer = None if sh == () else np.empty(sh)
+                scratch = None
+            if scratch is None and count[i] > 1 and buffer is not None:
+                scratch = np.empty(sh)
+            buffers[i] = (buffer, scratch)
+        self._message_buffers = buffers
 
         return msg
 
@@ -541,8 +878,15 @@ class Slice(Deterministic):
 
     Similar to:
     http://docs.scipy.org/doc/numpy/reference/arrays.indexing.html#basic-slicing
+
+    The messages to the parent are sent as sparse messages if the slice covers
+    less than the fraction `sparse_threshold` of the parent.
     """
 
+    # Use sparse messages if the slice covers less than this fraction of the
+    # message array of the parent
+    sparse_threshold = 0.5
+
     def __init__(self, X, slices, **kwargs):
 
         # Force a list
@@ -670,9 +1014,12 @@ class Slice(Deterministic):
         return tuple(plates)
 
     @staticmethod
-    def __reverse_indexing(slices, m_child, plates, dims):
+    def __reverse_indexing(slices, m_child, plates, dims, sparse_threshold=0):
         """
         A helpful function for performing reverse indexing/slicing
+
+        If the sliced region is smaller than the fraction sparse_threshold of
+        the full message, a sparse message is returned.
         """
 
         j = -1 # plate index for parent
@@ -717,6 +1064,15 @@ class Slice(Deterministic):
                 j -= 1
                 i -= 1
 
+        # Use a sparse message if the region is small
+        shape = msg_plates + dims
+        if len(shape) > 0 and len(parent_slices) > 0:
+            region = np.broadcast_to(np.empty(()), shape)[parent_slices]
+            if region.size < sparse_threshold * np.prod(shape):
+                if np.ndim(m_child) > 0:
+                    m_child = m_child[child_slices]
+                return SparseMessage(shape, parent_slices, m_child)
+
         # Set the elements of the message
         m_parent = np.zeros(msg_plates + dims)
         if np.ndim(m_parent) == 0 and np.ndim(m_child) == 0:
@@ -757,7 +1113,8 @@ class Slice(Deterministic):
         msg = [self.__reverse_indexing(self.slices, 
                                        m_child,
                                        parent.plates, 
-                                       dims)
+                                       dims,
+                                       sparse_threshold=self.sparse_threshold)
                for (m_child, dims) in zip(m, parent.dims)]
 
         # Apply reverse indexing for the mask
@@ -934,6 +1291,7 @@ def AddPlateAxis(to_plate):
 
             return u
 
+    _AddPlateAxis._factory = (AddPlateAxis, (to_plate,), {})
     return _AddPlateAxis
         
 
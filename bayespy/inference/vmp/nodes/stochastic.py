@@ -24,6 +24,7 @@
 import numpy as np
 
 from bayespy.utils import utils
+from bayespy.utils import linalg
 
 from .node import Node
 
@@ -50,15 +51,30 @@ class Stochastic(Node):
        _compute_mask_to_parent(index, mask)
        _plates_to_parent(self, index)
        _plates_from_parent(self, index)
+
+    If packed=True is given, the moments listed in `_symmetric_moments`
+    (symmetric matrices in the last two axes) are stored as
+    `linalg.PackedSymmetric`.  This roughly halves the memory of the stored
+    moments but not the computations: only the CGF of `Gaussian` uses the
+    packed elements directly, and the other consumers (e.g., `SumMultiply` and the
+    messages to the parents) convert the moments to dense arrays whenever
+    they use them.  Thus, packing is off by default and it is useful only if
+    the memory of the stored moments is the bottleneck.
     
     """
 
-    def __init__(self, *args, initialize=True, **kwargs):
+    # Indices of the moments which are symmetric matrices
+    _symmetric_moments = ()
+
+    def __init__(self, *args, initialize=True, packed=False, **kwargs):
 
         super().__init__(*args,
                          dims=self.compute_dims(*args),
                          **kwargs)
 
+        # Store symmetric moments in packed format
+        self._packed = packed
+
         # Initialize moment array
         axes = len(self.plates)*(1,)
         self.u = [utils.nans(axes+dim) for dim in self.dims]
@@ -66,6 +82,16 @@ class Stochastic(Node):
         # Not observed
         self.observed = False
 
+        # Not frozen
+        self.frozen = False
+
+        # No cached statistics of the observations
+        self._statistics = None
+
+        # Plates whose observations have changed since the last update (see
+        # update_observations)
+        self.dirty = None
+
         if initialize:
             self.initialize_from_prior()
 
@@ -104,23 +130,32 @@ class Stochastic(Node):
             # contains only axes for the plates).
             u_mask = utils.add_trailing_axes(mask, self.ndims[ind])
 
-            # Enlarge self.u[ind] as necessary so that it can store the
-            # broadcasted result.
+            # The shape of self.u[ind] is enlarged as necessary so that it
+            # can store the broadcasted result.  The moments are stored as
+            # read-only broadcast views whenever possible, and full arrays
+            # are allocated only if the mask mixes new and old values.
             sh = utils.broadcasted_shape_from_arrays(self.u[ind], u[ind], u_mask)
-            self.u[ind] = utils.repeat_to_shape(self.u[ind], sh)
 
-            # TODO/FIXME/BUG: The mask of observations is not used, observations
-            # may be overwritten!!! ???
-            
             # Hah, this function is used to set the observations! The caller
             # should be careful what mask he uses! If you want to set only
             # latent variables, then use such a mask.
-            
+
             # Use mask to update only unobserved plates and keep the
             # observed as before
-            np.copyto(self.u[ind],
-                      u[ind],
-                      where=u_mask)
+            if isinstance(self.u[ind], linalg.PackedSymmetric):
+                dtype = np.result_type(self.u[ind].dtype, u[ind])
+                if not np.all(u_mask):
+                    self.u[ind] = self.u[ind].toarray()
+            else:
+                dtype = np.result_type(self.u[ind], u[ind])
+            if np.all(u_mask):
+                self.u[ind] = utils.broadcast_to_shape(
+                    np.asarray(u[ind], dtype=dtype),
+                    sh)
+            elif not np.any(u_mask):
+                self.u[ind] = utils.broadcast_to_shape(self.u[ind], sh)
+            else:
+                self.u[ind] = np.where(u_mask, u[ind], self.u[ind])
 
             # Make sure u has the correct number of dimensions:
             # TODO/FIXME: Maybe it would be good to also check that u has a
@@ -129,7 +164,8 @@ class Stochastic(Node):
             ndim = len(shape)
             ndim_u = np.ndim(self.u[ind])
             if ndim > ndim_u:
-                self.u[ind] = utils.add_leading_axes(u[ind], ndim - ndim_u)
+                self.u[ind] = utils.add_leading_axes(self.u[ind],
+                                                     ndim - ndim_u)
             elif ndim < ndim_u:
                 raise RuntimeError(
                     "The size of the variable %s's %s-th moment "
@@ -144,16 +180,24 @@ class Stochastic(Node):
                        self.plates,
                        self.dims[ind]))
 
+            if self._packed and ind in self._symmetric_moments:
+                self.u[ind] = linalg.pack_symmetric(self.u[ind])
+
                 
     def update(self):
-        if not np.all(self.observed):
+        if not np.all(np.logical_or(self.observed, self.frozen)):
             u_parents = self._message_from_parents()
             m_children = self._message_from_children()
             self._update_distribution_and_lowerbound(m_children, *u_parents)
 
-    def observe(self, x, mask=True):
+    def observe(self, x, mask=True, cache=False):
         """
         Fix moments, compute f and propagate mask.
+
+        If cache is True, the sums of the observed statistics computed by
+        `_observed_sum` are cached until the observations change.  Caching
+        is off by default because the cached sums take memory for each
+        combination of plates the parents ask for.
         """
 
         # Compute fixed moments
@@ -181,10 +225,210 @@ class Stochastic(Node):
         self.observed = mask
         self._update_mask()
 
+        # Invalidate the statistics of the previous observations
+        self._statistics = dict() if cache else None
+
+    def update_observations(self, x, index):
+        """
+        Change the observations of some plates.
+
+        Only the fixed moments of the given plates are computed and the cached
+        sums of the observed statistics (see `_observed_sum`) are updated by
+        the differences of the old and the new observations of the plates.
+        Thus, the cost depends on the number of changed plates instead of the
+        number of observations, except that broadcast arrays are expanded.
+        The plates are marked as observed and they are added to the dirty
+        plates.  The posterior is then updated with `VB.update` as usual,
+        which does not compare the bound to the bound before the change and
+        clears the dirty plates.
+
+        Parameters
+        ----------
+        x : array
+            The new observations, shape (n,) + the shape of one observation.
+        index : tuple of int arrays or boolean array
+            The indices of the n changed plates, for instance, from
+            `numpy.nonzero`, or a boolean array of the plates.
+        """
+        index = self._plate_index(index)
+        n = len(index[0])
+        (u, f) = self._compute_fixed_moments_and_f(np.asanyarray(x))
+        for (i, ui) in enumerate(u):
+            if np.shape(ui) != (n,) + self.dims[i]:
+                raise ValueError("The shape of the observations %s does not "
+                                 "match the shape %s"
+                                 % (np.shape(ui), (n,) + self.dims[i]))
+        observed = self._gather(self.observed, self.plates, index)
+
+        # Update the cached sums by the differences of the statistics
+        if self._statistics:
+            statistics = dict()
+            for ((key, plates), total) in self._statistics.items():
+                if key == 'n':
+                    old = observed
+                    new = np.ones(n)
+                elif key == 'f':
+                    old = np.where(observed,
+                                   self._gather(self.f, self.plates, index),
+                                   0)
+                    new = np.broadcast_to(f, (n,))
+                else:
+                    old = np.where(
+                        utils.add_trailing_axes(observed,
+                                                len(self.dims[key])),
+                        self._gather(self.u[key], self.get_shape(key), index),
+                        0)
+                    new = u[key]
+                # The plates of the sum
+                total_index = tuple(
+                    np.zeros(n, dtype=int) if d_to == 1 else ind
+                    for (d_to, ind) in zip(plates, index))
+                shape = tuple(1 if d_to == 1 else d
+                              for (d_to, d) in zip(plates, self.plates))
+                shape = shape + np.shape(new)[1:]
+                total = np.array(np.broadcast_to(total, shape),
+                                 dtype=np.float64)
+                np.add.at(total, total_index, np.asarray(new) - old)
+                statistics[(key, plates)] = total
+            self._statistics = statistics
+
+        self._set_observed_moments(u, index)
+
+        # Update f
+        if not (np.ndim(self.f) == 0 and np.ndim(f) == 0 and
+                np.all(self.f == f)):
+            self.f = np.array(np.broadcast_to(self.f, self.plates),
+                              dtype=np.result_type(self.f, f))
+            self.f[index] = f
+
+        # Mark the plates observed
+        if not np.all(observed):
+            self.observed = np.array(np.broadcast_to(self.observed,
+                                                     self.plates))
+            self.observed[index] = True
+            self._update_mask()
+
+        if self.dirty is None:
+            self.dirty = np.zeros(self.plates, dtype=bool)
+        else:
+            self.dirty = np.array(self.dirty)
+        self.dirty[index] = True
+
+    def _plate_index(self, index):
+        """
+        Convert plate indices to a tuple of one-dimensional index arrays.
+        """
+        if np.asarray(index).dtype == bool:
+            index = np.asarray(index)
+            if np.shape(index) != self.plates:
+                raise ValueError("The shape of the boolean index %s does "
+                                 "not match the plates %s"
+                                 % (np.shape(index), self.plates))
+            return np.nonzero(index)
+        if not isinstance(index, tuple):
+            index = (index,)
+        if len(index) != len(self.plates):
+            raise ValueError("Give indices for all the plates %s"
+                             % (self.plates,))
+        return tuple(np.ravel(ind)
+                     for ind in np.broadcast_arrays(*[np.asarray(ind,
+                                                                 dtype=int)
+                                                      for ind in index]))
+
+    @staticmethod
+    def _gather(x, shape, index):
+        """
+        Take the given plates of an array that broadcasts to the shape.
+        """
+        if isinstance(x, np.ndarray) or np.isscalar(x):
+            return np.broadcast_to(x, shape)[index]
+        return x[index]
+
+    def _set_observed_moments(self, u, index):
+        """
+        Replace the moments of the given plates.
+
+        The moment arrays are replaced with new arrays instead of modifying
+        them, see `snapshot`.
+        """
+        for (i, ui) in enumerate(u):
+            (x, ui) = (np.asarray(self.u[i]), np.asarray(ui))
+            x = np.array(np.broadcast_to(x, self.get_shape(i)),
+                         dtype=np.result_type(x, ui))
+            x[index] = ui
+            if self._packed and i in self._symmetric_moments:
+                x = linalg.pack_symmetric(x)
+            self.u[i] = x
+
     def unobserve(self):
         # Update mask
         self.observed = False
         self._update_mask()
+        self._statistics = None
+
+    def _observed_sum(self, key, plates):
+        """
+        Sum an observed statistic over the plates that are not in plates.
+
+        The sums are taken over the observed plates only and they are
+        computed from the fixed observations, thus they are cached if the
+        node was observed with cache=True.
+
+        Parameters
+        ----------
+        key : int or str
+            The index of the moment, 'f' for the log-base measure or 'n' for
+            the number of observations
+        plates : tuple
+            The plates to which the statistic is summed (broadcasting rules
+            apply).  The result has the same number of plate axes as this
+            node.
+        """
+        plates = (1,)*(len(self.plates)-len(plates)) + tuple(plates)
+        if self._statistics is not None:
+            try:
+                return self._statistics[(key, plates)]
+            except KeyError:
+                pass
+
+        if key == 'n':
+            (x, ndim) = (np.asarray(self.observed, dtype=np.float64), 0)
+        elif key == 'f':
+            (x, ndim) = (np.where(self.observed, self.f, 0), 0)
+        else:
+            ndim = len(self.dims[key])
+            observed = utils.add_trailing_axes(self.observed, ndim)
+            x = np.where(observed, self.u[key], 0)
+        x = utils.add_leading_axes(x, len(self.plates) + ndim - np.ndim(x))
+
+        # Sum over the plates (and multiply by the number of plates for
+        # broadcasted axes)
+        r = 1
+        axes = []
+        for (j, (d_to, d)) in enumerate(zip(plates, self.plates)):
+            if d_to == 1 and d != 1:
+                if np.shape(x)[j] == 1:
+                    r *= d
+                else:
+                    axes.append(j)
+        x = r * np.sum(x, axis=tuple(axes), keepdims=True)
+
+        if self._statistics is not None:
+            self._statistics[(key, plates)] = x
+        return x
+
+    def freeze(self, mask=True):
+        """
+        Stop updating the distribution of the plates given by the mask.
+
+        The frozen plates keep their current distribution, which can be used,
+        for instance, for stopping the iteration of converged models in a
+        batch.  The mask must broadcast to the plates.
+        """
+        self.frozen = np.logical_or(self.frozen, mask)
+
+    def unfreeze(self):
+        self.frozen = False
 
     def lowerbound(self):
         # Sub-class should implement this
@@ -201,19 +445,38 @@ class Stochastic(Node):
 
 
 
+    def snapshot(self):
+        """
+        Return the state of the node for saving.
+
+        The arrays are not copied.  The updates replace the arrays of the
+        moments and the parameters instead of modifying them in place, thus
+        the snapshot is not affected by later updates and it can be written
+        while the inference continues.
+        """
+        return dict(u=list(self.u), observed=self.observed)
+
+    @staticmethod
+    def write_snapshot(group, snapshot):
+        """
+        Write a snapshot of the state into a HDF5 group.
+
+        Lists of arrays are written as numbered datasets, e.g., u0 and u1.
+        """
+        for (key, value) in snapshot.items():
+            if isinstance(value, list):
+                for (i, v) in enumerate(value):
+                    utils.write_to_hdf5(group, np.asarray(v), '%s%d' % (key, i))
+            else:
+                utils.write_to_hdf5(group, np.asarray(value), key)
+
     def save(self, group):
         """
         Save the state of the node into a HDF5 file.
 
         group can be the root
         """
-        ## if name is None:
-        ##     name = self.name
-        ## subgroup = group.create_group(name)
-        
-        for i in range(len(self.u)):
-            utils.write_to_hdf5(group, self.u[i], 'u%d' % i)
-        utils.write_to_hdf5(group, self.observed, 'observed')
+        self.write_snapshot(group, self.snapshot())
 
     def load(self, group):
         """
@@ -226,6 +489,8 @@ class Stochastic(Node):
 
         old_observed = self.observed
         self.observed = group['observed'][...]
+        if self._statistics is not None:
+            self._statistics = dict()
         # Update masks if necessary
         if np.any(old_observed != self.observed):
             self._update_mask()
@@ -0,0 +1,67 @@
+######################################################################
+# Copyright (C) 2013 Jaakko Luttinen
+#
+# This file is licensed under Version 3.0 of the GNU General Public
+# License. See LICENSE for a text of the license.
+######################################################################
+
+######################################################################
+# This file is part of BayesPy.
+#
+# BayesPy is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# BayesPy is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with BayesPy.  If not, see <http://www.gnu.org/licenses/>.
+######################################################################
+
+"""
+Unit tests for `categorical` module.
+"""
+
+import numpy as np
+
+from ..categorical import Categorical, OneHot
+from ..dirichlet import Dirichlet
+
+from bayespy.utils.utils import TestCase
+
+
+class TestCategorical(TestCase):
+
+    def test_observed_indices(self):
+        """
+        Test that observations are stored and used as indices
+        """
+        K = 4
+        x = np.random.randint(K, size=(3,5))
+        u = np.identity(K)[x]
+        p = Dirichlet(np.ones(K), plates=(3,1))
+        z = Categorical(p, plates=(3,5))
+        z.observe(x)
+        self.assertIsInstance(z.u[0], OneHot)
+        self.assertAllClose(np.asarray(z.u[0]), u)
+
+        # Counts as the message to the parent
+        self.assertAllClose(z._message_to_parent(0)[0],
+                            np.sum(u, axis=1, keepdims=True))
+        self.assertAllClose(z.u[0].count((1,), weights=np.arange(5)),
+                            np.einsum('nk,mnk->k', np.arange(5)[:,None], u)
+                            [None,None,:])
+
+        # Lower bound from the counts
+        logp = p.get_moments()[0]
+        self.assertAllClose(z.lower_bound_contribution(),
+                            np.sum(logp * u))
+
+        # Partial observations are stored as dense arrays
+        z.observe(x, mask=(np.arange(5) > 1))
+        self.assertAllClose(z.u[0][:,2:], u[:,2:])
+
+        self.assertRaises(ValueError, z.observe, x + K)
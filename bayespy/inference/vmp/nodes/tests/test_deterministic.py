@@ -168,6 +168,32 @@ class TestTile(unittest.TestCase):
                                     err_msg="Incorrect message.")
 
 
+    def test_broadcast_moments(self):
+        """
+        Test that Tile node keeps broadcast moments as views.
+        """
+        class Dummy(Node):
+            pass
+
+        # Moments shared over the plates are not copied
+        x = np.broadcast_to(np.array([1.0, 2.0]), (1000,2))
+        X = Dummy(dims=[(2,)], plates=(1000,))
+        Y = tile(X, 3)
+        u = Y._compute_moments([x])
+        self.assertEqual(np.shape(u[0]), (3000,2))
+        self.assertEqual(u[0].strides[0], 0)
+        testing.assert_allclose(u[0], np.tile(x, (3,1)))
+
+        # Only the axes with actual data are tiled
+        x = np.broadcast_to(np.array([[1.0], [2.0]]), (2,3))
+        X = Dummy(dims=[()], plates=(2,3))
+        Y = tile(X, (2,2))
+        u = Y._compute_moments([x])
+        self.assertEqual(np.shape(u[0]), (4,6))
+        self.assertEqual(u[0].strides[1], 0)
+        testing.assert_allclose(u[0], np.tile(x, (2,2)))
+
+
     def test_message_to_parent(self):
         """
         Test the parent message of Tile node.
@@ -683,6 +683,43 @@ class TestGaussianArrayARD(TestCase):
 
         pass
 
+    def test_observed_lowerbound(self):
+        """
+        Test the lower bound term computed from the observed statistics.
+        """
+        def check(plates_mu, plates_alpha, plates, shape=(2,), mask=True):
+            mu = GaussianArrayARD(np.random.randn(*(plates_mu+shape)),
+                                  1,
+                                  shape=shape,
+                                  plates=plates_mu)
+            alpha = Gamma(2, np.random.rand(*(plates_alpha+shape)) + 1)
+            Y = GaussianArrayARD(mu, alpha, shape=shape, plates=plates)
+            y = np.random.randn(*(plates+shape))
+            Y.observe(y, mask=mask)
+            L = Y.lower_bound_contribution()
+            self.assertIsNone(Y._statistics)
+            Y.observe(y, mask=mask, cache=True)
+            self.assertAllClose(Y.lower_bound_contribution(), L)
+            # The cached statistics are used for fully observed nodes
+            if mask is True:
+                self.assertTrue(len(Y._statistics) > 0)
+            self.assertAllClose(Y.lower_bound_contribution(), L)
+
+        check((), (), (3,4))
+        check((4,), (3,1), (3,4))
+        check((3,4), (), (3,4))
+        check((), (), (3,4), mask=[True, False, True, True])
+
+        # Statistics are invalidated by new observations
+        Y = GaussianArrayARD(0, 1, plates=(3,))
+        Y.observe(np.ones(3), cache=True)
+        self.assertAllClose(Y._observed_sum(0, ()), [3])
+        self.assertAllClose(Y._observed_sum('n', ()), [3])
+        Y.observe(2*np.ones(3), mask=[True, False, True], cache=True)
+        self.assertAllClose(Y._observed_sum(0, ()), [4])
+        self.assertAllClose(Y._observed_sum(1, (3,)), [4, 0, 4])
+        self.assertAllClose(Y._observed_sum('n', ()), [2])
+
     def test_rotate(self):
         """
         Test the rotation of Gaussian ARD arrays.
@@ -0,0 +1,154 @@
+######################################################################
+# Copyright (C) 2013 Jaakko Luttinen
+#
+# This file is licensed under Version 3.0 of the GNU General Public
+# License. See LICENSE for a text of the license.
+######################################################################
+
+######################################################################
+# This file is part of BayesPy.
+#
+# BayesPy is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# BayesPy is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with BayesPy.  If not, see <http://www.gnu.org/licenses/>.
+######################################################################
+
+"""
+Unit tests for `gaussian_mrf` module.
+"""
+
+import numpy as np
+import scipy.sparse as sparse
+
+from ..gaussian_mrf import GaussianMRF
+from ..gaussian import Gaussian, GaussianArrayARD
+from ..gamma import Gamma
+
+from ...vmp import VB
+from ...batch import batch
+
+from bayespy.utils.utils import TestCase
+
+
+class TestGaussianMRF(TestCase):
+
+    def precision(self, D):
+        return sparse.diags([-np.ones(D-1), 2.5*np.ones(D), -np.ones(D-1)],
+                            [-1, 0, 1]).tocsc()
+
+    def test_posterior(self):
+        """
+        Test the posterior against a dense Gaussian node
+        """
+        D = 6
+        Lambda = self.precision(D)
+        mu = np.random.randn(D)
+        y = np.random.randn(D)
+        tau_y = 0.5 + np.random.rand(D)
+
+        X = GaussianMRF(mu, Lambda, 1.5)
+        Y = GaussianArrayARD(X, tau_y, shape=())
+        Y.observe(y)
+        Q = VB(Y, X)
+        Q.update(X)
+
+        Xd = Gaussian(mu, 1.5*Lambda.toarray())
+        Yd = GaussianArrayARD(Xd, tau_y, shape=(D,))
+        Yd.observe(y)
+        Qd = VB(Yd, Xd)
+        Qd.update(Xd)
+
+        self.assertAllClose(X.u[0], Xd.u[0])
+        self.assertAllClose(X.u[1], np.diag(Xd.u[1]))
+        self.assertAllClose(Q.compute_lowerbound(),
+                            Qd.compute_lowerbound())
+
+    def test_message_to_tau(self):
+        """
+        Test the message from the node to the precision scale
+        """
+        D = 5
+        Lambda = self.precision(D)
+        mu = np.random.randn(D)
+        tau = Gamma(3, 2)
+        X = GaussianMRF(mu, Lambda, tau)
+        Y = GaussianArrayARD(X, 2, shape=())
+        Y.observe(np.random.randn(D))
+        X.update()
+
+        Cov = np.linalg.inv(-2*X.phi[1].toarray())
+        xx = Cov + np.outer(X.u[0], X.u[0])
+        A = Lambda.toarray()
+        m0 = -0.5 * (np.sum(A*xx) - 2*np.dot(X.u[0], A.dot(mu))
+                     + np.dot(mu, A.dot(mu)))
+        (m0_mrf, m1_mrf) = X._message_to_parent(0)
+        self.assertAllClose(m0_mrf, m0)
+        self.assertAllClose(m1_mrf, 0.5*D)
+
+    def test_observe(self):
+        """
+        Test the posterior conditioned on observed elements
+        """
+        D = 6
+        Lambda = self.precision(D)
+        A = 1.5*Lambda.toarray()
+        mu = np.random.randn(D)
+        y = np.random.randn(D)
+        tau_y = 0.5 + np.random.rand(D)
+        x = np.random.randn(D)
+        observed = np.array([False, True, False, False, True, False])
+        (h, o) = (~observed, observed)
+
+        X = GaussianMRF(mu, Lambda, 1.5)
+        Y = GaussianArrayARD(X, tau_y, shape=())
+        Y.observe(y)
+        X.observe(x, mask=observed)
+        X.update()
+
+        # The conditional posterior of the unobserved elements
+        Q = A + np.diag(tau_y)
+        b = A.dot(mu) + tau_y*y
+        Cov = np.linalg.inv(Q[np.ix_(h,h)])
+        mean = np.where(observed, x, 0)
+        mean[h] = Cov.dot(b[h] - Q[np.ix_(h,o)].dot(x[o]))
+        var = np.zeros(D)
+        var[h] = np.diag(Cov)
+        self.assertAllClose(X.u[0], mean)
+        self.assertAllClose(X.u[1], mean**2 + var)
+
+        # E[log p(x)] - E[log q(x)]
+        xx = np.outer(mean, mean)
+        xx[np.ix_(h,h)] += Cov
+        e = np.trace(A.dot(xx)) - 2*mean.dot(A.dot(mu)) + mu.dot(A.dot(mu))
+        L = (0.5*np.linalg.slogdet(A)[1] - 0.5*D*np.log(2*np.pi) - 0.5*e
+             + 0.5*np.linalg.slogdet(2*np.pi*np.e*Cov)[1])
+        self.assertAllClose(X.lower_bound_contribution(), L)
+
+        # Fully observed
+        X.observe(x)
+        X.update()
+        self.assertAllClose(X.u[0], x)
+        self.assertAllClose(X.u[1], x**2)
+        e = (x-mu).dot(A.dot(x-mu))
+        self.assertAllClose(X.lower_bound_contribution(),
+                            0.5*np.linalg.slogdet(A)[1]
+                            - 0.5*D*np.log(2*np.pi) - 0.5*e)
+
+    def test_batch(self):
+        """
+        Test that batches are rejected
+        """
+        D = 4
+        Lambda = self.precision(D)
+        self.assertRaises(ValueError,
+                          batch,
+                          lambda: GaussianMRF(np.zeros(D), Lambda),
+                          3)
@@ -0,0 +1,221 @@
+######################################################################
+# Copyright (C) 2013 Jaakko Luttinen
+#
+# This file is licensed under Version 3.0 of the GNU General Public
+# License. See LICENSE for a text of the license.
+######################################################################
+
+######################################################################
+# This file is part of BayesPy.
+#
+# BayesPy is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# BayesPy is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with BayesPy.  If not, see <http://www.gnu.org/licenses/>.
+######################################################################
+
+"""
+Unit tests for `linear_gaussian` module.
+"""
+
+import numpy as np
+
+from ..linear_gaussian import LinearGaussian, SparseLinearGaussian
+from ..gaussian import GaussianArrayARD
+from ..gamma import Gamma
+from ..dot import SumMultiply
+
+from ...vmp import VB
+from ...batch import batch
+
+from bayespy.utils.utils import TestCase
+
+
+class TestLinearGaussian(TestCase):
+
+    def model(self, fused, plates_C=(4,1), plates_X=(5,), plates_tau=(4,1)):
+        D = 3
+        C = GaussianArrayARD(np.random.randn(*(plates_C+(D,))),
+                             1,
+                             shape=(D,),
+                             plates=plates_C)
+        X = GaussianArrayARD(np.random.randn(*(plates_X+(D,))),
+                             1,
+                             shape=(D,),
+                             plates=plates_X)
+        tau = Gamma(2, 3, plates=plates_tau)
+        if fused:
+            Y = LinearGaussian(C, X, tau)
+        else:
+            Y = GaussianArrayARD(SumMultiply('i,i', C, X), tau, shape=())
+        return (Y, C, X, tau)
+
+    def check(self, y, mask, **kwargs):
+        seed = np.random.randint(1000)
+        np.random.seed(seed)
+        (Y0, C0, X0, tau0) = self.model(False, **kwargs)
+        np.random.seed(seed)
+        (Y1, C1, X1, tau1) = self.model(True, **kwargs)
+        Y0.observe(y, mask=mask)
+        Y1.observe(y, mask=mask)
+
+        # Messages to the parents
+        for (P0, P1) in zip((C0, X0, tau0), (C1, X1, tau1)):
+            m0 = P0._message_from_children()
+            m1 = P1._message_from_children()
+            self.assertAllClose(m0[0] * np.ones(P0.get_shape(0)),
+                                m1[0] * np.ones(P1.get_shape(0)))
+            self.assertAllClose(m0[1] * np.ones(P0.get_shape(1)),
+                                m1[1] * np.ones(P1.get_shape(1)))
+
+        # Lower bound term
+        self.assertAllClose(Y0.lower_bound_contribution(),
+                            Y1.lower_bound_contribution())
+
+    def test_messages(self):
+        """
+        Test the parity with the SumMultiply likelihood
+        """
+        y = np.random.randn(4,5)
+        mask = np.random.rand(4,5) < 0.7
+        self.check(y, True)
+        self.check(y, mask)
+        self.check(y, mask, plates_tau=())
+        self.check(y, mask, plates_C=(4,5), plates_tau=(5,))
+        self.check(y, mask, plates_X=(1,5), plates_tau=(1,1))
+
+    def test_inference(self):
+        """
+        Test that the fused node gives the same posterior
+        """
+        y = np.random.randn(4,5)
+        mask = np.random.rand(4,5) < 0.7
+        L = []
+        for fused in (False, True):
+            np.random.seed(42)
+            (Y, C, X, tau) = self.model(fused)
+            Y.observe(y, mask=mask)
+            Q = VB(Y, C, X, tau)
+            Q.update(C, X, tau, repeat=5)
+            L.append(Q.L[:5])
+        self.assertAllClose(L[0], L[1])
+
+    def test_children(self):
+        """
+        Test that the fused node can not have children
+        """
+        (Y, C, X, tau) = self.model(True)
+        self.assertRaises(ValueError,
+                          GaussianArrayARD,
+                          Y,
+                          1)
+
+
+class TestSparseLinearGaussian(TestCase):
+
+    def test_parity(self):
+        """
+        Test the parity with the masked LinearGaussian node
+        """
+        (M, N, D) = (6, 7, 3)
+        y = np.random.randn(M,N)
+        mask = np.random.rand(M,N) < 0.4
+        (rows, cols) = np.nonzero(mask)
+        c = np.random.randn(M,1,D)
+        x = np.random.randn(N,D)
+        L = []
+        for fused in (LinearGaussian, SparseLinearGaussian):
+            C = GaussianArrayARD(c, 1, shape=(D,), plates=(M,1))
+            X = GaussianArrayARD(x, 1, shape=(D,), plates=(N,))
+            tau = Gamma(2, 3)
+            Y = fused(C, X, tau)
+            if fused is LinearGaussian:
+                Y.observe(y, mask=mask)
+            else:
+                Y.observe_coo(rows, cols, y[rows,cols])
+            L.append([Y._message_to_parent(0),
+                      Y._message_to_parent(1),
+                      Y._message_to_parent(2),
+                      Y.lower_bound_contribution()])
+        for (m0, m1) in zip(L[0][:3], L[1][:3]):
+            self.assertAllClose(m0[0], m1[0])
+            self.assertAllClose(m0[1], m1[1])
+        self.assertAllClose(L[0][3], L[1][3])
+
+    def test_observe(self):
+        """
+        Test the dense observations and changing the observations
+        """
+        (M, N, D) = (4, 5, 2)
+        y = np.random.randn(M,N)
+        mask = np.random.rand(M,N) < 0.5
+        C = GaussianArrayARD(np.random.randn(M,1,D), 1, shape=(D,),
+                             plates=(M,1))
+        X = GaussianArrayARD(np.random.randn(N,D), 1, shape=(D,),
+                             plates=(N,))
+        tau = Gamma(2, 3)
+        def check(Y, y, mask):
+            Y0 = LinearGaussian(C, X, tau)
+            Y0.observe(y, mask=mask)
+            for index in range(3):
+                m0 = Y0._message_to_parent(index)
+                m = Y._message_to_parent(index)
+                self.assertAllClose(m[0], m0[0])
+                self.assertAllClose(m[1], m0[1])
+            self.assertAllClose(Y.lower_bound_contribution(),
+                                Y0.lower_bound_contribution())
+
+        # The base class signature
+        Y = SparseLinearGaussian(C, X, tau)
+        Y.observe(y, mask=mask)
+        check(Y, y, mask)
+
+        # Change observed and unobserved entries
+        index = (np.array([0, 1, 3]), np.array([2, 2, 4]))
+        y = y.copy()
+        y[index] = [3, -2, 1]
+        mask = mask.copy()
+        mask[index] = True
+        Y.update_observations(y[index], index)
+        check(Y, y, mask)
+        self.assertEqual(np.sum(Y.dirty), 3)
+        self.assertTrue(np.all(Y.dirty[index]))
+
+        Y.unobserve()
+        self.assertEqual(Y.lower_bound_contribution(), 0)
+
+    def test_init(self):
+        """
+        Test the plates of the sparse node
+        """
+        C = GaussianArrayARD(0, 1, shape=(2,), plates=(4,1))
+        X = GaussianArrayARD(0, 1, shape=(2,), plates=(5,))
+        Y = SparseLinearGaussian(C, X, 1)
+        self.assertEqual(Y.plates, (4,5))
+        X = GaussianArrayARD(0, 1, shape=(2,), plates=(4,5))
+        self.assertRaises(ValueError,
+                          SparseLinearGaussian,
+                          C,
+                          X,
+                          1)
+        X = GaussianArrayARD(0, 1, shape=(2,), plates=(5,))
+        tau = Gamma(1, 1, plates=(5,))
+        self.assertRaises(ValueError,
+                          SparseLinearGaussian,
+                          C,
+                          X,
+                          tau)
+
+        # Batches are not supported
+        def model():
+            C = GaussianArrayARD(0, 1, shape=(2,), plates=(4,1))
+            X = GaussianArrayARD(0, 1, shape=(2,), plates=(5,))
+            return SparseLinearGaussian(C, X, 1)
+        self.assertRaises(ValueError, batch, model, 3)
@@ -0,0 +1,176 @@
+######################################################################
+# Copyright (C) 2013 Jaakko Luttinen
+#
+# This file is licensed under Version 3.0 of the GNU General Public
+# License. See LICENSE for a text of the license.
+######################################################################
+
+######################################################################
+# This file is part of BayesPy.
+#
+# BayesPy is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# BayesPy is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with BayesPy.  If not, see <http://www.gnu.org/licenses/>.
+######################################################################
+
+"""
+Unit tests for `mixture` module.
+"""
+
+import numpy as np
+
+from ..mixture import Mixture
+from ..categorical import Categorical, Responsibilities, OneHot
+from ..dirichlet import Dirichlet
+from ..gaussian import Gaussian
+from ..wishart import Wishart
+from ..expfamily import ExponentialFamily
+
+from ...vmp import VB
+
+from bayespy.utils import linalg
+
+from bayespy.utils.utils import TestCase
+
+
+class TestMixture(TestCase):
+
+    def test_shared_cluster_parameters(self):
+        """
+        Test the mixture messages for cluster parameters shared by the data
+        """
+        (N, K, D) = (20, 4, 3)
+        alpha = Dirichlet(np.ones(K))
+        z = Categorical(alpha, plates=(N,))
+        X = Gaussian(np.zeros(D), 0.01*np.identity(D), plates=(K,))
+        Lambda = Wishart(D, 0.01*np.identity(D), plates=(K,))
+        Y = Mixture(Gaussian)(z, X, Lambda, plates=(N,))
+        X.initialize_from_value(np.random.randn(K,D))
+        Y.observe(np.random.randn(N,D), mask=(np.arange(N) > 5))
+        z.update()
+
+        u_parents = Y._message_from_parents()
+        P = u_parents[0][0]
+        phi = Gaussian._compute_phi_from_parents(*u_parents[1:])
+        g = Gaussian._compute_cgf_from_parents(*u_parents[1:])
+
+        # Weighted averages of the cluster parameters
+        self.assertAllClose(Y._compute_phi_from_parents(*u_parents)[1],
+                            np.einsum('nk,kij->nij', P, phi[1]))
+        self.assertAllClose(Y._compute_cgf_from_parents(*u_parents),
+                            np.einsum('nk,k->n', P, g))
+
+        # Log-densities for each cluster
+        u = [Y.u[0][:,None,:], Y.u[1][:,None,:,:]]
+        L = Gaussian._compute_logpdf(u, phi, g, 0)
+        self.assertAllClose(Y._message_to_parent(0)[0],
+                            L * Y.mask[:,None])
+
+        # Messages to the cluster parameters
+        for index in [1, 2]:
+            m = Y._message_to_parent(index)
+            m_dense = ExponentialFamily._message_to_parent(Y, index)
+            for (m_i, m_dense_i) in zip(m, m_dense):
+                self.assertAllClose(m_i, m_dense_i)
+
+    def test_packed_moments(self):
+        """
+        Test the mixture with packed second moments of the cluster parameters
+        """
+        (N, K, D) = (30, 3, 2)
+        y = np.random.randn(N,D)
+        x = np.random.randn(K,D)
+        L = list()
+        for packed in [False, True]:
+            alpha = Dirichlet(np.ones(K))
+            z = Categorical(alpha, plates=(N,))
+            X = Gaussian(np.zeros(D), 0.01*np.identity(D), plates=(K,),
+                         packed=packed)
+            Lambda = Wishart(D, 0.01*np.identity(D), plates=(K,),
+                             packed=packed)
+            Y = Mixture(Gaussian)(z, X, Lambda, plates=(N,))
+            X.initialize_from_value(x)
+            Y.observe(y)
+            Q = VB(Y, X, Lambda, z, alpha)
+            Q.update(repeat=3)
+            self.assertEqual(isinstance(X.u[1], linalg.PackedSymmetric),
+                             packed)
+            self.assertEqual(isinstance(Lambda.u[0], linalg.PackedSymmetric),
+                             packed)
+            L.append(Q.compute_lowerbound())
+        self.assertAllClose(L[0], L[1])
+
+    def test_truncated_responsibilities(self):
+        """
+        Test the mixture with truncated responsibilities
+        """
+        (N, K, D) = (50, 10, 2)
+        alpha = Dirichlet(np.ones(K))
+        z = Categorical(alpha, plates=(N,), truncate=3)
+        X = Gaussian(np.zeros(D), 0.01*np.identity(D), plates=(K,))
+        Lambda = Wishart(D, 0.01*np.identity(D), plates=(K,))
+        Y = Mixture(Gaussian)(z, X, Lambda, plates=(N,))
+        X.initialize_from_value(np.random.randn(K,D))
+        Y.observe(np.random.randn(N,D), mask=(np.arange(N) > 5))
+        Q = VB(Y, X, Lambda, z, alpha)
+        Q.update(repeat=2)
+
+        # At most three non-zero responsibilities
+        P = z.get_moments()[0]
+        self.assertIsInstance(P, Responsibilities)
+        # The truncation is stored with the moments
+        self.assertIs(P, z.u[0])
+        self.assertAllClose(np.sum(P, axis=-1), np.ones(N))
+        self.assertTrue(np.all(np.sum(P > 0, axis=-1) <= 3))
+        self.assertAllClose(np.sort(P, axis=-1)[:,-3:],
+                            np.sort(P.weights, axis=-1))
+
+        # Parity with the dense computations
+        u_parents = Y._message_from_parents()
+        u_dense = [[np.asarray(P)]] + u_parents[1:]
+        phi = Y._compute_phi_from_parents(*u_parents)
+        phi_dense = Y._compute_phi_from_parents(*u_dense)
+        for (phi_i, phi_dense_i) in zip(phi, phi_dense):
+            self.assertAllClose(phi_i, phi_dense_i)
+        self.assertAllClose(Y._compute_cgf_from_parents(*u_parents),
+                            Y._compute_cgf_from_parents(*u_dense))
+        for index in [1, 2]:
+            m = Y._message_to_parent(index)
+            m_dense = ExponentialFamily._message_to_parent(Y, index)
+            for (m_i, m_dense_i) in zip(m, m_dense):
+                self.assertAllClose(m_i, m_dense_i)
+
+    def test_observed_labels(self):
+        """
+        Test the mixture with observed cluster assignments
+        """
+        (N, K, D) = (20, 4, 2)
+        alpha = Dirichlet(np.ones(K))
+        z = Categorical(alpha, plates=(N,))
+        X = Gaussian(np.zeros(D), 0.01*np.identity(D), plates=(K,))
+        Lambda = Wishart(D, 0.01*np.identity(D), plates=(K,))
+        Y = Mixture(Gaussian)(z, X, Lambda, plates=(N,))
+        X.initialize_from_value(np.random.randn(K,D))
+        Y.observe(np.random.randn(N,D))
+        z.observe(np.random.randint(K, size=N))
+        self.assertIsInstance(z.get_moments()[0], OneHot)
+
+        u_parents = Y._message_from_parents()
+        u_dense = [[np.asarray(u_parents[0][0])]] + u_parents[1:]
+        phi = Y._compute_phi_from_parents(*u_parents)
+        phi_dense = Y._compute_phi_from_parents(*u_dense)
+        for (phi_i, phi_dense_i) in zip(phi, phi_dense):
+            self.assertAllClose(phi_i, phi_dense_i)
+        for index in [1, 2]:
+            m = Y._message_to_parent(index)
+            m_dense = ExponentialFamily._message_to_parent(Y, index)
+            for (m_i, m_dense_i) in zip(m, m_dense):
+                self.assertAllClose(m_i, m_dense_i)
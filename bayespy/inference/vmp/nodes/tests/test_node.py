@@ -33,7 +33,7 @@ import scipy
 
 from numpy import testing
 
-from ..node import Node
+from ..node import Node, SparseMessage
 
 from ...vmp import VB
 
@@ -227,6 +227,35 @@ class TestNode(unittest.TestCase):
                           (4,),
                           (1,))
 
+    def test_message_from_children(self):
+        """
+        Test the accumulation of the messages into persistent buffers
+        """
+        m1 = np.random.randn(4,3,2)
+        m2 = np.random.randn(3,2)
+        m3 = np.random.randn(4,1,2)
+
+        class Dummy(Node):
+            def _get_message_and_mask_to_parent(self, index):
+                return ([self.m], True)
+        parent = Dummy(dims=[(2,)], plates=(4,3))
+        for m in (m1, m2, m3):
+            child = Dummy(parent, dims=[(2,)], plates=(4,3))
+            child.m = m
+
+        # The first sum allocates the buffers
+        msg = parent._message_from_children()
+        testing.assert_allclose(msg[0], m1 + m2 + m3)
+        (buffer, scratch) = parent._message_buffers[0]
+        self.assertEqual(np.shape(buffer), (4,3,2))
+        self.assertEqual(np.shape(scratch), (4,3,2))
+
+        # The buffers are reused and the messages are written into them
+        msg = parent._message_from_children()
+        self.assertIs(msg[0], buffer)
+        self.assertIs(parent._message_buffers[0][1], scratch)
+        testing.assert_allclose(msg[0], m1 + m2 + m3)
+
 class TestSlice(utils.TestCase):
 
     def test_init(self):
@@ -559,7 +588,7 @@ class TestSlice(utils.TestCase):
                 super().__init__(X, **kwargs)
                 self.m = m
                 self.mask2 = mask
-            def _message_to_parent(self, index):
+            def _message_to_parent(self, index, out=None):
                 return self.m
             def _mask_to_parent(self, index):
                 return self.mask2
@@ -754,3 +783,48 @@ class TestSlice(utils.TestCase):
         
 
         pass
+
+    def test_sparse_message(self):
+        """
+        Test sparse messages of X[..] node operator.
+        """
+
+        class ChildNode(Node):
+            def __init__(self, X, m, **kwargs):
+                super().__init__(X, **kwargs)
+                self.m = m
+            def _message_to_parent(self, index, out=None):
+                return self.m
+            def _mask_to_parent(self, index):
+                return True
+
+        # Small slices of the parent are sent as sparse messages
+        V = Node(plates=(10,3),
+                 dims=((2,),))
+        X1 = V[2:4]
+        X2 = V[7,1:]
+        m1 = np.random.randn(2,3,2)
+        m2 = np.random.randn(2,2)
+        ChildNode(X1, [m1], dims=((2,),))
+        ChildNode(X2, [m2], dims=((2,),))
+        X1._update_mask()
+        X2._update_mask()
+        msg = X1._message_to_parent(0)
+        self.assertIsInstance(msg[0], SparseMessage)
+        self.assertEqual(np.shape(msg[0]), (10,3,2))
+        m = np.zeros((10,3,2))
+        m[2:4] = m1
+        self.assertMessage(msg, [m])
+
+        # The parent accumulates the sparse messages with index-add
+        m[7,1:] = m2
+        self.assertMessage(V._message_from_children(), [m])
+
+        # Large slices are sent as dense messages
+        X3 = V[1:]
+        m3 = np.random.randn(9,3,2)
+        ChildNode(X3, [m3], dims=((2,),))
+        X3._update_mask()
+        self.assertIsInstance(X3._message_to_parent(0)[0], np.ndarray)
+        m[1:] += m3
+        self.assertMessage(V._message_from_children(), [m])
@@ -61,6 +61,8 @@ class Wishart(ExponentialFamily):
 
 
     ndims = (2, 0)
+    _symmetric_moments = (0,)
+    _symmetric_parameters = (0,)
     ndims_parents = [None, (2, 0)]
 
     # Observations/values are 2-D matrices
@@ -105,6 +107,14 @@ class Wishart(ExponentialFamily):
         return [-0.5 * u_parents[1][0],
                 0.5 * u_parents[0][0]]
 
+    @staticmethod
+    def _check_parameters(phi):
+        """
+        Check that the degrees of freedom are larger than D-1.
+        """
+        k = np.shape(phi[0])[-1]
+        return np.all(phi[1] > 0.5*(k-1))
+
     @staticmethod
     def _compute_moments_and_cgf(phi, mask=True):
         U = utils.m_chol(-phi[0])
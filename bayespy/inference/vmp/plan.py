@@ -0,0 +1,115 @@
+######################################################################
+# Copyright (C) 2013 Jaakko Luttinen
+#
+# This file is licensed under Version 3.0 of the GNU General Public
+# License. See LICENSE for a text of the license.
+######################################################################
+
+######################################################################
+# This file is part of BayesPy.
+#
+# BayesPy is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# BayesPy is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with BayesPy.  If not, see <http://www.gnu.org/licenses/>.
+######################################################################
+
+"""
+Static execution plans for variational message passing.
+
+The graph and the shapes of the arrays do not change during the iteration,
+thus the shape algebra of the messages (plate multipliers, reduction axes,
+mask reshapes and einsum keys) needs to be computed only once.  An execution
+plan compiles the nodes of a model so that the shape algebra is cached and
+the shapes are validated only when the plan is built.
+"""
+
+from bayespy.inference.vmp.nodes.node import Node
+from bayespy.inference.vmp.schedule import Schedule
+
+
+def graph(*nodes):
+    """
+    Find all nodes connected to the given nodes.
+
+    The nodes are returned in the order they are found by a breadth-first
+    search along the parents and the children.
+    """
+    found = []
+    visited = set()
+    queue = [node for node in nodes if isinstance(node, Node)]
+    while len(queue) > 0:
+        node = queue.pop(0)
+        if id(node) in visited:
+            continue
+        visited.add(id(node))
+        found.append(node)
+        queue.extend(parent for parent in node.parents
+                     if isinstance(parent, Node))
+        queue.extend(child for (child, index) in node.children)
+    return found
+
+
+class ExecutionPlan():
+    """
+    Compiled execution plan for a fixed model graph.
+
+    Parameters
+    ----------
+    nodes : nodes
+       The nodes of the model.
+
+    Attributes
+    ----------
+    nodes : list
+       All nodes connected to the model, including deterministic nodes.
+    schedule : Schedule
+       The update schedule of the model nodes.
+    order : list
+       The nodes that are updated, in the update order.
+    """
+
+    def __init__(self, *nodes):
+        self.nodes = graph(*nodes)
+        self.schedule = Schedule(*nodes)
+        self.order = self.schedule.order
+        self.compile()
+
+    def compile(self):
+        """
+        Validate the shapes and compile the nodes.
+
+        The moments of each node are validated once using the debug checks.
+        Then, the nodes are compiled and the messages used by the updates are
+        computed once in order to fill the plan caches.
+        """
+        for node in self.nodes:
+            node.uncompile()
+        for node in self.nodes:
+            node._message_to_child()
+        for node in self.nodes:
+            node.compile()
+        for node in self.order:
+            node._message_from_children()
+
+    def uncompile(self):
+        """
+        Remove the cached plans from the nodes.
+        """
+        for node in self.nodes:
+            node.uncompile()
+
+    def run(self, threads=None, callback=None):
+        """
+        Update the nodes once using the schedule.
+
+        See `Schedule.run` for the parameters.
+        """
+        self.schedule.run(threads=threads, callback=callback)
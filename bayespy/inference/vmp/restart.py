@@ -0,0 +1,199 @@
+######################################################################
+# Copyright (C) 2013 Jaakko Luttinen
+#
+# This file is licensed under Version 3.0 of the GNU General Public
+# License. See LICENSE for a text of the license.
+######################################################################
+
+######################################################################
+# This file is part of BayesPy.
+#
+# BayesPy is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# BayesPy is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with BayesPy.  If not, see <http://www.gnu.org/licenses/>.
+######################################################################
+
+"""
+Parallel random restarts of variational Bayesian inference.
+
+The VB iteration converges to a local optimum, thus models such as Gaussian
+mixtures are often fitted several times from random initializations.  The
+restarts are run in separate processes, each with its own random seed::
+
+    def gaussianmix(N, K, D, y):
+        ...
+        Y.observe(y)
+        X.initialize_from_parameters(X.random(), np.identity(D))
+        return (Y, X, Lambda, z, alpha)
+
+    (model, Q, L) = restart(gaussianmix, 8, args=(N, K, D, y), repeat=200)
+
+The bounds of the restarts are shared between the processes.  A restart is
+pruned if its bound trails the bound of the best restart at the same
+iteration by more than a margin, so that the cores are freed for the
+remaining restarts as soon as one of the restarts clearly dominates.  The
+state of the best restart is passed back in the HDF5 format of `VB.save`.
+"""
+
+import os
+import io
+import shutil
+import tempfile
+import contextlib
+import multiprocessing
+
+import numpy as np
+
+from bayespy.inference.vmp.vmp import VB
+
+
+# The bounds shared by the worker processes, set by the pool initializer
+_shared = None
+
+
+def _initialize_worker(L, repeat):
+    global _shared
+    _shared = (L, repeat)
+
+
+def _shared_bounds():
+    (L, repeat) = _shared
+    return np.frombuffer(L.get_obj()).reshape((-1, repeat))
+
+
+def _run(build, args, kwargs, index, seed, repeat, prune_after, margin, tol,
+         filename):
+    """
+    Run one restart in a worker process.
+
+    Returns the bound trace and whether the restart was pruned.
+    """
+    np.random.seed(seed)
+    model = build(*args, **kwargs)
+    Q = VB(*model)
+    L = _shared_bounds()
+
+    pruned = False
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(repeat):
+            Q.update()
+            L[index,i] = Q.L[i]
+
+            # Prune if the best restart at this iteration is clearly better
+            if i + 1 >= prune_after:
+                with np.errstate(invalid='ignore'):
+                    best = np.nanmax(L[:,i])
+                if best - Q.L[i] > margin:
+                    pruned = True
+                    break
+
+            # Check for convergence.  The bound stays at the converged value,
+            # thus the later iterations are filled for the comparisons.
+            if i > 0 and Q.L[i] - Q.L[i-1] < tol * np.abs(Q.L[i]):
+                L[index,i+1:] = Q.L[i]
+                break
+
+        if not pruned:
+            Q.save(filename)
+
+    return (np.array(L[index]), pruned)
+
+
+def restart(build, restarts, args=(), kwargs=None, repeat=100, prune_after=10,
+            margin=10, tol=1e-6, processes=None, seed=None, filename=None):
+    """
+    Run VB from several random initializations in parallel.
+
+    Parameters
+    ----------
+    build : function
+       A function which constructs the model, observes the data and
+       initializes the nodes randomly.  It must return the nodes of the model
+       and the nodes must have unique names.  The function is called in the
+       worker processes, thus it must be a module-level function.
+    restarts : int
+       The number of restarts.
+    args, kwargs :
+       The arguments given to the function.
+    repeat : int
+       The maximum number of iterations for each restart.
+    prune_after : int
+       The number of iterations before a restart can be pruned.
+    margin : float
+       A restart is pruned if its bound is lower than the best bound at the
+       same iteration by more than this margin.
+    tol : float
+       Relative tolerance for the convergence of a restart.
+    processes : int, optional
+       The number of worker processes.  By default, the number of cores.
+    seed : int, optional
+       The seed of the first restart, the others get consecutive seeds.
+    filename : str, optional
+       If given, the state of the best restart is saved to this HDF5 file.
+
+    Returns
+    -------
+    model :
+       The return value of the model-building function, with the state of the
+       best restart loaded.
+    Q : VB
+       The inference engine of the model.
+    L : ndarray
+       The bound traces of the restarts, shape (restarts, repeat).  The traces
+       of the pruned restarts end with NaNs.
+    """
+
+    if kwargs is None:
+        kwargs = {}
+    if seed is None:
+        seed = np.random.randint(2**31 - restarts)
+
+    L_shared = multiprocessing.Array('d', restarts*repeat)
+    L = np.frombuffer(L_shared.get_obj()).reshape((restarts, repeat))
+    L[...] = np.nan
+
+    tmpdir = tempfile.mkdtemp(prefix='vb_restart_')
+    try:
+        filenames = [os.path.join(tmpdir, 'restart_%d.hdf5' % r)
+                     for r in range(restarts)]
+        pool = multiprocessing.Pool(processes,
+                                    initializer=_initialize_worker,
+                                    initargs=(L_shared, repeat))
+        try:
+            results = [pool.apply_async(_run,
+                                        (build, args, kwargs, r, seed+r,
+                                         repeat, prune_after, margin, tol,
+                                         filenames[r]))
+                       for r in range(restarts)]
+            results = [result.get() for result in results]
+        finally:
+            pool.close()
+            pool.join()
+
+        L = np.array([trace for (trace, pruned) in results])
+        pruned = np.array([pruned for (trace, pruned) in results])
+
+        # Select the best restart by the last bound
+        last = np.array([trace[~np.isnan(trace)][-1] for trace in L])
+        last[pruned] = -np.inf
+        best = np.argmax(last)
+
+        # Rebuild the model and load the state of the best restart
+        np.random.seed(seed + best)
+        model = build(*args, **kwargs)
+        Q = VB(*model)
+        Q.load(filename=filenames[best])
+        if filename is not None:
+            shutil.copyfile(filenames[best], filename)
+    finally:
+        shutil.rmtree(tmpdir)
+
+    return (model, Q, L)
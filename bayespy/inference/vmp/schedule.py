@@ -0,0 +1,224 @@
+######################################################################
+# Copyright (C) 2013 Jaakko Luttinen
+#
+# This file is licensed under Version 3.0 of the GNU General Public
+# License. See LICENSE for a text of the license.
+######################################################################
+
+######################################################################
+# This file is part of BayesPy.
+#
+# BayesPy is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# BayesPy is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with BayesPy.  If not, see <http://www.gnu.org/licenses/>.
+######################################################################
+
+"""
+Update scheduling for variational message passing.
+
+The update of a stochastic node uses the moments of the nodes in its Markov
+blanket only.  Thus, the nodes can be updated in a sweep over the graph from
+the observations towards the top-level nodes, and the nodes which are not in
+the Markov blankets of each other can be updated concurrently.  NumPy releases
+the GIL in BLAS and einsum, thus the concurrent updates can use several cores.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+from bayespy.inference.vmp.nodes.node import Node
+from bayespy.inference.vmp.nodes.deterministic import Deterministic
+
+
+def is_updatable(node):
+    """
+    Check whether the node has an update method.
+    """
+    return hasattr(node, 'update') and callable(node.update)
+
+
+def stochastic_parents(node):
+    """
+    Find the non-deterministic parents of a node.
+
+    Deterministic parents are passed through.
+    """
+    parents = []
+    for parent in node.parents:
+        if isinstance(parent, Deterministic):
+            parents.extend(stochastic_parents(parent))
+        elif isinstance(parent, Node):
+            parents.append(parent)
+    return parents
+
+
+def stochastic_children(node):
+    """
+    Find the non-deterministic children of a node.
+
+    Deterministic children are passed through.
+    """
+    children = []
+    for (child, index) in node.children:
+        if isinstance(child, Deterministic):
+            children.extend(stochastic_children(child))
+        else:
+            children.append(child)
+    return children
+
+
+def markov_blanket(node):
+    """
+    Find the Markov blanket of a node.
+
+    The Markov blanket consists of the parents, the children and the
+    co-parents of the children.  Deterministic nodes are passed through and
+    constant nodes are ignored, thus the blanket contains only nodes which can
+    be updated.
+    """
+    blanket = []
+    children = stochastic_children(node)
+    coparents = [other 
+                 for child in children 
+                 for other in stochastic_parents(child)]
+    for other in stochastic_parents(node) + children + coparents:
+        if (other is not node 
+            and is_updatable(other)
+            and all(other is not x for x in blanket)):
+            blanket.append(other)
+    return blanket
+
+
+class Schedule():
+    """
+    Update schedule for a set of nodes.
+
+    The nodes are ordered topologically so that the children are updated
+    before the parents, that is, the sweep goes from the observations towards
+    the top-level nodes.  The ordered nodes are then greedily divided into groups such that
+    the nodes in a group are not in the Markov blankets of each other.  The
+    groups are updated one after another and the nodes in a group can be
+    updated concurrently.  Because a node is put after the groups of all the
+    preceding nodes in its Markov blanket, the result is equal to updating
+    the nodes one by one in the topological order.
+
+    Parameters
+    ----------
+    nodes : nodes
+       The nodes to update.  Nodes without an update method are ignored.
+    sort : bool
+       If False, the nodes are updated in the given order.
+
+    Attributes
+    ----------
+    order : list
+       The nodes in the update order.
+    groups : list of lists
+       The groups of nodes that can be updated concurrently.
+    """
+
+    def __init__(self, *nodes, sort=True):
+        nodes = [node for node in nodes if is_updatable(node)]
+        if not sort:
+            self.order = nodes
+        else:
+            self.order = self._sort(nodes)
+
+        # Greedy grouping: put a node to the first group after the groups of
+        # the already ordered nodes in its Markov blanket
+        self.groups = []
+        group_of = {}
+        for node in self.order:
+            g = group_of.get(id(node), -1) + 1
+            for other in markov_blanket(node):
+                if id(other) in group_of:
+                    g = max(g, group_of[id(other)] + 1)
+            if g == len(self.groups):
+                self.groups.append([])
+            self.groups[g].append(node)
+            group_of[id(node)] = g
+
+    @staticmethod
+    def _sort(nodes):
+        """
+        Sort the nodes topologically, children first.
+
+        The nodes are sorted by their depth, that is, the length of the
+        longest path to the leaf nodes.  The nodes with equal depth are sorted
+        by their height, that is, the length of the longest path to the root
+        nodes, in descending order.  Thus, for instance, the mixing matrix of
+        a linear state-space model is updated before the observation noise
+        and then the noise and the ARD parameters can be updated
+        concurrently.  Otherwise, the order of the given nodes is used.
+        """
+
+        ids = set(id(node) for node in nodes)
+
+        def find(neighbours):
+            # Neighbours of each node among the scheduled nodes
+            return {id(node): [other
+                               for other in neighbours(node)
+                               if id(other) in ids and other is not node]
+                    for node in nodes}
+
+        def longest_path(neighbours):
+            # Length of the longest path along the neighbours
+            lengths = {}
+            def length(node):
+                if id(node) not in lengths:
+                    # Guard against cycles
+                    lengths[id(node)] = 0
+                    lengths[id(node)] = max([length(other) + 1
+                                             for other in neighbours[id(node)]],
+                                            default=0)
+                return lengths[id(node)]
+            return {id(node): length(node) for node in nodes}
+
+        depth = longest_path(find(stochastic_children))
+        height = longest_path(find(stochastic_parents))
+
+        return [node
+                for (k, node) in sorted(enumerate(nodes),
+                                        key=lambda x: (depth[id(x[1])],
+                                                       -height[id(x[1])],
+                                                       x[0]))]
+
+    def run(self, threads=None, callback=None):
+        """
+        Update the nodes once.
+
+        Parameters
+        ----------
+        threads : int
+           The number of threads used for updating the nodes of a group
+           concurrently.  If None or 1, the nodes are updated one by one.
+        callback : function
+           A function which is called for each updated node after its group
+           has been updated.
+        """
+        if threads is None or threads <= 1:
+            for node in self.order:
+                node.update()
+                if callback is not None:
+                    callback(node)
+            return
+
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            for group in self.groups:
+                if len(group) == 1:
+                    group[0].update()
+                else:
+                    futures = [executor.submit(node.update) 
+                               for node in group]
+                    for future in futures:
+                        future.result()
+                if callback is not None:
+                    for node in group:
+                        callback(node)
@@ -0,0 +1,381 @@
+######################################################################
+# Copyright (C) 2013 Jaakko Luttinen
+#
+# This file is licensed under Version 3.0 of the GNU General Public
+# License. See LICENSE for a text of the license.
+######################################################################
+
+######################################################################
+# This file is part of BayesPy.
+#
+# BayesPy is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# BayesPy is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with BayesPy.  If not, see <http://www.gnu.org/licenses/>.
+######################################################################
+
+"""
+Serving posterior predictions for many small queries.
+
+A fitted model is often used to answer a large number of small queries, such
+as GP predictions at a few inputs or forecasts a few steps ahead.  Handling
+the queries one by one wastes time in the Python overhead and in small matrix
+products.  `PredictionServer` collects the concurrent queries into batches,
+evaluates each batch with one vectorized call and distributes the results::
+
+    (X,) = load_artifact('lssm')
+    server = PredictionServer(MarkovChainForecast(X), latency=0.002)
+    (mean, var) = server.predict([1, 2, 10])
+
+The prediction function takes an array of inputs, stacked along the first
+axis, and returns a tuple (mean, variance) of arrays whose first axis
+corresponds to the inputs.  If the function has a `validate` method, it is
+called for each query when the query is submitted, so that an invalid query
+fails alone instead of failing the whole batch.  The quantities that do not
+depend on the inputs should be computed once when the function is
+constructed.  For instance, the
+moment function of `bayespy.utils.gp.gp_posterior_moment_function` contains
+the Cholesky factor of the data covariance, thus a GP can be served with::
+
+    get_moments = gp_posterior_moment_function(m, k, x, y, noise=noise)
+    server = PredictionServer(lambda h: get_moments(h, covariance=1))
+
+The server can also be accessed over HTTP, by TCP or a Unix socket, see
+`serve_http`.
+"""
+
+import os
+import stat
+import json
+import time
+import queue
+import threading
+import socketserver
+import http.server
+import concurrent.futures
+
+import numpy as np
+
+from bayespy.utils import utils
+
+
+class PredictionServer():
+    """
+    Evaluate concurrent prediction queries in batches.
+
+    The queries are collected by a background thread.  A batch is evaluated
+    when it has `max_batch` inputs or when the first query of the batch has
+    waited for `latency` seconds.  The queries of a batch are grouped by the
+    shape of their inputs and each group is evaluated with one call.  If the
+    evaluation of a group fails, its queries are evaluated one by one, thus
+    an error fails only the queries that cause it.
+
+    Parameters
+    ----------
+    predict : function
+       Vectorized prediction function, see the module documentation.
+    max_batch : int
+       The maximum number of inputs in a batch.  A single query can be larger.
+    latency : float
+       The maximum time (in seconds) a query waits for other queries.
+    """
+
+    def __init__(self, predict, max_batch=1024, latency=0.005):
+        self.predict_batch = predict
+        self.max_batch = max_batch
+        self.latency = latency
+        # The number of evaluated batches and queries
+        self.batches = 0
+        self.queries = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def submit(self, x):
+        """
+        Submit a query.
+
+        The inputs are stacked along the first axis, thus a scalar is not a
+        valid query.  Invalid queries raise an error immediately.  Returns a
+        `concurrent.futures.Future` of the tuple (mean, variance).
+        """
+        if self._thread is None:
+            raise RuntimeError("The server has been closed")
+        x = np.asarray(x)
+        if np.ndim(x) == 0:
+            raise ValueError("The inputs must be stacked along the first "
+                             "axis, give a list of the inputs")
+        validate = getattr(self.predict_batch, 'validate', None)
+        if validate is not None:
+            validate(x)
+        future = concurrent.futures.Future()
+        self._queue.put((x, future))
+        return future
+
+    def predict(self, x):
+        """
+        Compute the predictions for the inputs, waiting for the result.
+        """
+        return self.submit(x).result()
+
+    def close(self):
+        """
+        Evaluate the pending queries and stop the background thread.
+        """
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            size = len(item[0])
+            deadline = time.monotonic() + self.latency
+            stop = False
+            while size < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+                size += len(item[0])
+            # The thread must survive any error, otherwise the pending and
+            # later queries would wait forever
+            try:
+                groups = dict()
+                for item in batch:
+                    groups.setdefault(np.shape(item[0])[1:], []).append(item)
+                for group in groups.values():
+                    self._evaluate(group)
+            except Exception as error:
+                for (x, future) in batch:
+                    if not future.done():
+                        future.set_exception(error)
+            self.queries += len(batch)
+            if stop:
+                return
+
+    def _evaluate(self, batch):
+        """
+        Evaluate queries with one call or, if that fails, one by one.
+        """
+        (inputs, futures) = zip(*batch)
+        self.batches += 1
+        try:
+            outputs = self.predict_batch(np.concatenate(inputs, axis=0))
+            ends = np.cumsum([len(x) for x in inputs])
+            results = [tuple(None if y is None else y[start:end]
+                             for y in outputs)
+                       for (start, end) in zip(np.concatenate([[0],
+                                                               ends[:-1]]),
+                                               ends)]
+        except Exception as error:
+            if len(batch) > 1:
+                for item in batch:
+                    self._evaluate([item])
+            else:
+                futures[0].set_exception(error)
+            return
+        for (future, result) in zip(futures, results):
+            future.set_result(result)
+
+
+class MarkovChainForecast():
+    """
+    Forecast a Gaussian Markov chain beyond the last time instance.
+
+    The forecast of x[N-1+h] is computed from the posterior moments of the
+    last state and of the dynamics of the last time instance.  The second
+    moments are propagated with the second moments of the rows of the
+    dynamics matrix, thus the uncertainty of the dynamics is taken into
+    account.  The innovation variance is approximated by the inverse of the
+    expected precision.  The moments are computed once and the forecasts are
+    cached, thus a query costs only indexing.
+
+    Parameters
+    ----------
+    X : GaussianMarkovChain
+       The fitted Markov chain node.
+
+    Calling the object with an array of horizons (positive integers) returns
+    the tuple (mean, variance) of the forecasts with shape (len(h),) +
+    plates + (D,).
+    """
+
+    def __init__(self, X):
+        (A, v) = (X.parents[2], X.parents[3])
+        u_A = A.get_moments()
+        u_v = v.get_moments()
+        # Moments of the last time instance (the last plate axis of A and v
+        # is the state dimension, the one before that the time)
+        if len(A.plates) >= 2:
+            self._A = np.asarray(u_A[0])[...,-1,:,:]
+            self._AA = np.asarray(u_A[1])[...,-1,:,:,:]
+        else:
+            self._A = np.asarray(u_A[0])
+            self._AA = np.asarray(u_A[1])
+        if len(v.plates) >= 2:
+            self._noise = 1 / np.asarray(u_v[0])[...,-1,:]
+        else:
+            self._noise = 1 / np.asarray(u_v[0])
+        u_X = X.get_moments()
+        m = np.asarray(u_X[0])[...,-1,:]
+        S = np.asarray(u_X[1])[...,-1,:,:]
+        # The forecasts broadcast over the plates of the dynamics
+        plates = utils.broadcasted_shape(np.shape(m)[:-1],
+                                         np.shape(self._A)[:-2],
+                                         np.shape(self._AA)[:-3],
+                                         np.shape(self._noise)[:-1])
+        D = np.shape(m)[-1]
+        # The cached forecasts, the first axis is the horizon.  The arrays are
+        # grown by doubling, thus the cache is not copied for each query.
+        self._mean = np.array(np.broadcast_to(m, (1,) + plates + (D,)))
+        self._second = np.array(np.broadcast_to(S, (1,) + plates + (D,D)))
+        self._size = 1
+        self._lock = threading.Lock()
+
+    def _extend(self, horizon):
+        if horizon >= len(self._mean):
+            capacity = max(horizon+1, 2*len(self._mean))
+            mean = np.empty((capacity,) + np.shape(self._mean)[1:])
+            second = np.empty((capacity,) + np.shape(self._second)[1:])
+            mean[:self._size] = self._mean[:self._size]
+            second[:self._size] = self._second[:self._size]
+            (self._mean, self._second) = (mean, second)
+        while self._size <= horizon:
+            m = self._mean[self._size-1]
+            S = self._second[self._size-1]
+            m = np.einsum('...ij,...j->...i', self._A, m)
+            # <A S A'> with the exact diagonal
+            S_next = np.einsum('...ij,...jk,...lk->...il', self._A, S, self._A)
+            diag = (np.einsum('...ijk,...jk->...i', self._AA, S) 
+                    + self._noise)
+            D = np.shape(S_next)[-1]
+            S_next[...,np.arange(D),np.arange(D)] = diag
+            self._mean[self._size] = m
+            self._second[self._size] = S_next
+            self._size += 1
+
+    def validate(self, h):
+        """
+        Check that the forecast horizons are positive integers.
+        """
+        h = np.asarray(h)
+        if np.ndim(h) != 1:
+            raise ValueError("The forecast horizons must be a vector")
+        if len(h) > 0 and not np.issubdtype(h.dtype, np.integer):
+            raise ValueError("The forecast horizons must be integers")
+        if np.any(h < 1):
+            raise ValueError("The forecast horizons must be positive")
+
+    def __call__(self, h):
+        self.validate(h)
+        h = np.asarray(h, dtype=np.int64)
+        with self._lock:
+            if len(h) > 0:
+                self._extend(np.max(h))
+            mean = self._mean[h]
+            second = self._second[h]
+        var = np.einsum('...ii->...i', second) - mean**2
+        return (mean, var)
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    """
+    HTTP handler for posting queries as JSON.
+    """
+
+    def do_POST(self):
+        try:
+            length = int(self.headers['Content-Length'])
+            request = json.loads(self.rfile.read(length).decode('utf-8'))
+            (mean, var) = self.server.prediction_server.predict(
+                request['inputs'])
+            response = dict(mean=np.asarray(mean).tolist(),
+                            variance=(None if var is None
+                                      else np.asarray(var).tolist()))
+            status = 200
+        except Exception as error:
+            response = dict(error=str(error))
+            status = 400
+        body = json.dumps(response).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # Unix sockets do not have a host address
+        if isinstance(self.client_address, tuple):
+            return super().address_string()
+        return 'unix'
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _TCPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve_http(server, address=('127.0.0.1', 0)):
+    """
+    Serve the predictions over HTTP in a background thread.
+
+    The queries are posted as JSON objects ``{"inputs": [...]}`` and the
+    responses are JSON objects ``{"mean": [...], "variance": [...]}``.  Each
+    connection is handled in its own thread, thus concurrent queries are
+    batched by the prediction server.
+
+    Parameters
+    ----------
+    server : PredictionServer
+    address : tuple or str
+       The (host, port) to listen to, or the path of a Unix socket.  Port 0
+       chooses a free port.
+
+    Returns
+    -------
+    The HTTP server.  Its `server_address` attribute gives the address and
+    its `shutdown` method stops the serving.
+    """
+    if isinstance(address, str):
+        # Remove a stale socket
+        if (os.path.exists(address) 
+            and stat.S_ISSOCK(os.stat(address).st_mode)):
+            os.remove(address)
+        httpd = _UnixServer(address, _Handler)
+    else:
+        httpd = _TCPServer(address, _Handler)
+    httpd.prediction_server = server
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    return httpd
@@ -0,0 +1,119 @@
+######################################################################
+# Copyright (C) 2013 Jaakko Luttinen
+#
+# This file is licensed under Version 3.0 of the GNU General Public
+# License. See LICENSE for a text of the license.
+######################################################################
+
+######################################################################
+# This file is part of BayesPy.
+#
+# BayesPy is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# BayesPy is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with BayesPy.  If not, see <http://www.gnu.org/licenses/>.
+######################################################################
+
+"""
+Unit tests for `artifact` module.
+"""
+
+import io
+import shutil
+import tempfile
+import contextlib
+
+import numpy as np
+
+from bayespy.inference.vmp.vmp import VB
+from bayespy.inference.vmp.artifact import save_artifact, load_artifact
+from bayespy.inference.vmp.tests.test_vmp import pca_model
+from bayespy.inference.vmp.tests.test_restart import gaussianmix_model
+
+from bayespy.utils import utils
+
+
+class TestArtifact(utils.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def check(self, nodes):
+        Q = VB(*nodes)
+        with contextlib.redirect_stdout(io.StringIO()):
+            Q.update(repeat=5)
+        save_artifact(self.path, *nodes)
+
+        loaded = load_artifact(self.path)
+        self.assertEqual([node.name for node in loaded],
+                         [node.name for node in nodes])
+        for (node, node_loaded) in zip(nodes, loaded):
+            self.assertEqual(node_loaded.plates, node.plates)
+            for (u, u_loaded) in zip(node.u, node_loaded.u):
+                self.assertAllClose(np.asarray(u_loaded), np.asarray(u))
+        Q_loaded = VB(*loaded)
+        self.assertAllClose(Q_loaded.compute_lowerbound(),
+                            Q.compute_lowerbound())
+
+        # The memory-mapped model can be updated
+        with contextlib.redirect_stdout(io.StringIO()):
+            Q.update(repeat=1)
+            Q_loaded.update(repeat=1)
+        self.assertAllClose(Q_loaded.L[-1], Q.L[-1])
+
+        return loaded
+
+    def test_gaussian_mixture(self):
+        """
+        Test saving and loading a model with class factories
+        """
+        np.random.seed(1)
+        y = np.random.randn(20, 2)
+        loaded = self.check(gaussianmix_model(y, 3))
+        self.assertIsInstance(loaded[0].u[0], np.memmap)
+
+    def test_pca(self):
+        """
+        Test saving and loading a model with deterministic nodes
+        """
+        np.random.seed(1)
+        (Y, W, X, tau, alpha) = pca_model(4, 10, 2)
+        Y.observe(np.random.randn(4, 10), mask=np.random.rand(4, 10) > 0.3)
+        X.initialize_from_random()
+        self.check([Y, W, X, tau, alpha])
+
+    def test_recipe(self):
+        """
+        Test that the nodes do not keep their array arguments alive
+        """
+        from bayespy.inference.vmp.nodes.gaussian import Gaussian
+        mu = np.zeros(3)
+        X = Gaussian(mu, np.identity(3), name='X')
+        (cls, args, kwargs) = X._recipe
+        self.assertIs(args[0], X.parents[0])
+        self.assertFalse(any(isinstance(arg, np.ndarray) for arg in args))
+        save_artifact(self.path, X)
+        (X_loaded,) = load_artifact(self.path)
+        self.assertAllClose(X_loaded.parents[0].u[0], mu)
+
+    def test_not_importable(self):
+        """
+        Test that nodes of local classes are not accepted
+        """
+        from bayespy.inference.vmp.nodes.gamma import Gamma
+        class LocalGamma(Gamma):
+            pass
+        self.assertRaises(ValueError,
+                          save_artifact,
+                          self.path,
+                          LocalGamma(1, 1))
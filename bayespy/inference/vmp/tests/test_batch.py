@@ -0,0 +1,166 @@
+######################################################################
+# Copyright (C) 2013 Jaakko Luttinen
+#
+# This file is licensed under Version 3.0 of the GNU General Public
+# License. See LICENSE for a text of the license.
+######################################################################
+
+######################################################################
+# This file is part of BayesPy.
+#
+# BayesPy is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# BayesPy is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with BayesPy.  If not, see <http://www.gnu.org/licenses/>.
+######################################################################
+
+"""
+Unit tests for `batch` module.
+"""
+
+import io
+import threading
+import contextlib
+
+import numpy as np
+
+from bayespy.inference.vmp.nodes.gaussian import Gaussian
+from bayespy.inference.vmp.nodes.wishart import Wishart
+from bayespy.inference.vmp.nodes.dirichlet import Dirichlet
+from bayespy.inference.vmp.nodes.categorical import Categorical
+from bayespy.inference.vmp.nodes.mixture import Mixture
+from bayespy.inference.vmp.vmp import VB
+from bayespy.inference.vmp.batch import batch, BatchVB
+
+from bayespy.utils import utils
+
+
+def gaussianmix_model(N, K, D):
+    alpha = Dirichlet(np.ones(K), name='alpha')
+    z = Categorical(alpha, plates=(N,), name='z')
+    X = Gaussian(np.zeros(D), 0.01*np.identity(D), plates=(K,), name='X')
+    Lambda = Wishart(D, 0.01*np.identity(D), plates=(K,), name='Lambda')
+    Y = Mixture(Gaussian)(z, X, Lambda, plates=(N,), name='Y')
+    return (Y, X, Lambda, z, alpha)
+
+
+class TestBatch(utils.TestCase):
+
+    def test_batch(self):
+        """
+        Test that the batch plate axis is added and aligned
+        """
+        (Y, X, Lambda, z, alpha) = batch(gaussianmix_model, 4, 10, 3, 2)
+        self.assertEqual(Y.plates, (4,10))
+        self.assertEqual(z.plates, (4,10))
+        self.assertEqual(X.plates, (4,1,3))
+        self.assertEqual(Lambda.plates, (4,1,3))
+        self.assertEqual(alpha.plates, (4,1))
+
+        # Unbatched construction is not affected
+        (Y, X, Lambda, z, alpha) = gaussianmix_model(10, 3, 2)
+        self.assertEqual(Y.plates, (10,))
+        self.assertEqual(X.plates, (3,))
+
+        # Batches can not be nested
+        self.assertRaises(RuntimeError,
+                          batch,
+                          lambda: batch(gaussianmix_model, 2, 10, 3, 2),
+                          4)
+
+    def test_threads(self):
+        """
+        Test that batching does not affect models built in other threads
+        """
+        barrier = threading.Barrier(2, timeout=10)
+        def build(N, K, D):
+            # Let the other thread build its model in the middle
+            alpha = Dirichlet(np.ones(K), name='alpha')
+            barrier.wait()
+            barrier.wait()
+            z = Categorical(alpha, plates=(N,), name='z')
+            X = Gaussian(np.zeros(D), 0.01*np.identity(D), plates=(K,),
+                         name='X')
+            Lambda = Wishart(D, 0.01*np.identity(D), plates=(K,),
+                             name='Lambda')
+            Y = Mixture(Gaussian)(z, X, Lambda, plates=(N,), name='Y')
+            return (Y, X, Lambda, z, alpha)
+
+        models = {}
+        def run(key, *args):
+            models[key] = args[0](*args[1:])
+        threads = [threading.Thread(target=run,
+                                    args=('batch', batch, build, 4, 10, 3, 2))]
+        threads[0].start()
+        for i in range(2):
+            # Build an unbatched and a batched model during both passes of
+            # the batched construction in the other thread
+            barrier.wait()
+            run('plain%d' % i, gaussianmix_model, 10, 3, 2)
+            run('batch%d' % i, batch, gaussianmix_model, 5, 10, 3, 2)
+            barrier.wait()
+        threads[0].join()
+
+        self.assertEqual(models['batch'][0].plates, (4,10))
+        self.assertEqual(models['batch'][1].plates, (4,1,3))
+        for i in range(2):
+            self.assertEqual(models['plain%d' % i][0].plates, (10,))
+            self.assertEqual(models['plain%d' % i][1].plates, (3,))
+            self.assertEqual(models['batch%d' % i][0].plates, (5,10))
+            self.assertEqual(models['batch%d' % i][1].plates, (5,1,3))
+
+    def test_batch_vb(self):
+        """
+        Test that the members of a batch are fitted as separate models
+        """
+        np.random.seed(1)
+        (B, N, K, D) = (3, 10, 2, 2)
+        y = np.random.randn(B,N,D) + 5*np.mod(np.arange(N), 2)[:,None]
+        x0 = np.random.randn(B,K,D)
+
+        (Y, X, Lambda, z, alpha) = batch(gaussianmix_model, B, N, K, D)
+        X.initialize_from_parameters(x0[:,None], np.identity(D))
+        Y.observe(y)
+        Q = BatchVB(Y, X, Lambda, z, alpha, tol=1e-8)
+        with contextlib.redirect_stdout(io.StringIO()):
+            Q.update(repeat=10)
+
+        self.assertEqual(np.shape(Q.L_members), (B, 10))
+        self.assertAllClose(np.sum(Q.L_members, axis=0), Q.L)
+
+        for b in range(B):
+            (Y, X, Lambda, z, alpha) = gaussianmix_model(N, K, D)
+            X.initialize_from_parameters(x0[b], np.identity(D))
+            Y.observe(y[b])
+            Q_b = VB(Y, X, Lambda, z, alpha)
+            with contextlib.redirect_stdout(io.StringIO()):
+                Q_b.update(repeat=10)
+            self.assertAllClose(Q.L_members[b], Q_b.L)
+
+    def test_freeze(self):
+        """
+        Test that frozen members are not updated
+        """
+        np.random.seed(1)
+        (B, N, K, D) = (2, 10, 2, 2)
+        (Y, X, Lambda, z, alpha) = batch(gaussianmix_model, B, N, K, D)
+        X.initialize_from_random()
+        Y.observe(np.random.randn(B,N,D))
+        Q = BatchVB(Y, X, Lambda, z, alpha, tol=1e-14)
+        with contextlib.redirect_stdout(io.StringIO()):
+            Q.update(repeat=2)
+            Q.freeze([0])
+            u = [ui.copy() for ui in X.u]
+            Q.update(repeat=2)
+        self.assertEqual(list(Q.converged), [True, False])
+        self.assertAllClose(Q.L_members[0,-1], Q.L_members[0,-2])
+        self.assertAllClose(X.u[0][0], u[0][0])
+        self.assertAllClose(X.u[1][0], u[1][0])
+        self.assertFalse(np.allclose(X.u[0][1], u[0][1]))
@@ -0,0 +1,105 @@
+######################################################################
+# Copyright (C) 2013 Jaakko Luttinen
+#
+# This file is licensed under Version 3.0 of the GNU General Public
+# License. See LICENSE for a text of the license.
+######################################################################
+
+######################################################################
+# This file is part of BayesPy.
+#
+# BayesPy is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# BayesPy is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with BayesPy.  If not, see <http://www.gnu.org/licenses/>.
+######################################################################
+
+"""
+Unit tests for `plan` module.
+"""
+
+import numpy as np
+
+from bayespy.inference.vmp.nodes.gaussian import GaussianArrayARD
+from bayespy.inference.vmp.nodes.gamma import Gamma
+from bayespy.inference.vmp.nodes.dot import SumMultiply
+from bayespy.inference.vmp.vmp import VB
+from bayespy.inference.vmp.plan import ExecutionPlan, graph
+
+from bayespy.utils import utils
+from bayespy.utils import random
+
+
+class TestExecutionPlan(utils.TestCase):
+
+    def model(self, seed):
+        np.random.seed(seed)
+        (M, N, D) = (4, 10, 2)
+        alpha = Gamma(1e-2, 1e-2, plates=(D,), name='alpha')
+        W = GaussianArrayARD(0, alpha, shape=(D,), plates=(M,1), name='W')
+        X = GaussianArrayARD(0, 1, shape=(D,), plates=(1,N), name='X')
+        F = SumMultiply('i,i', W, X, name='F')
+        tau = Gamma(1e-2, 1e-2, name='tau')
+        Y = GaussianArrayARD(F, tau, name='Y')
+        Y.observe(np.random.randn(M,N), mask=random.mask(M, N, p=0.7))
+        W.initialize_from_random()
+        X.initialize_from_random()
+        return (Y, W, X, tau, alpha)
+
+    def test_graph(self):
+        """
+        Test finding the nodes of the graph
+        """
+        (Y, W, X, tau, alpha) = self.model(1)
+        nodes = graph(Y)
+        self.assertIs(nodes[0], Y)
+        self.assertIn(Y.parents[0], nodes)
+        for node in (Y, W, X, tau, alpha):
+            self.assertIn(node, nodes)
+
+    def test_compile(self):
+        """
+        Test that compiling does not change the results
+        """
+        Q = VB(*self.model(1))
+        Q.update(repeat=5)
+
+        Q_compiled = VB(*self.model(1))
+        plan = Q_compiled.compile()
+        self.assertEqual(plan.order, list(Q_compiled.model))
+        for node in plan.nodes:
+            self.assertIsNotNone(node._plans)
+        Q_compiled.update(repeat=5)
+
+        self.assertAllClose(Q_compiled.L, Q.L)
+        for (name, node) in zip(['Y', 'W', 'X', 'tau', 'alpha'], Q.model):
+            for (u, u_compiled) in zip(node.get_moments(),
+                                       Q_compiled[name].get_moments()):
+                self.assertAllClose(u_compiled, u)
+
+        # The messages from F are cached for one shape only
+        W = Q_compiled['W']
+        F = W.children[0][0]
+        self.assertEqual(len(F._plans), 4)
+
+        # The compiled messages do not compute the shapes
+        einsum_shape = utils.einsum_shape
+        def fail(*args):
+            raise AssertionError("Shape computed in a compiled message")
+        utils.einsum_shape = fail
+        try:
+            Q_compiled.update(repeat=1)
+        finally:
+            utils.einsum_shape = einsum_shape
+
+        Q_compiled.uncompile()
+        self.assertIsNone(Q_compiled.plan)
+        for node in plan.nodes:
+            self.assertIsNone(node._plans)
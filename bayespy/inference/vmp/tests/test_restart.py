@@ -0,0 +1,87 @@
+######################################################################
+# Copyright (C) 2013 Jaakko Luttinen
+#
+# This file is licensed under Version 3.0 of the GNU General Public
+# License. See LICENSE for a text of the license.
+######################################################################
+
+######################################################################
+# This file is part of BayesPy.
+#
+# BayesPy is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# BayesPy is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with BayesPy.  If not, see <http://www.gnu.org/licenses/>.
+######################################################################
+
+"""
+Unit tests for `restart` module.
+"""
+
+import os
+import tempfile
+
+import numpy as np
+
+from bayespy.inference.vmp.nodes.gaussian import Gaussian
+from bayespy.inference.vmp.nodes.wishart import Wishart
+from bayespy.inference.vmp.nodes.dirichlet import Dirichlet
+from bayespy.inference.vmp.nodes.categorical import Categorical
+from bayespy.inference.vmp.nodes.mixture import Mixture
+from bayespy.inference.vmp.restart import restart
+
+from bayespy.utils import utils
+
+
+def gaussianmix_model(y, K):
+    (N, D) = np.shape(y)
+    alpha = Dirichlet(np.ones(K), name='alpha')
+    z = Categorical(alpha, plates=(N,), name='z')
+    X = Gaussian(np.zeros(D), 0.01*np.identity(D), plates=(K,), name='X')
+    Lambda = Wishart(D, 0.01*np.identity(D), plates=(K,), name='Lambda')
+    Y = Mixture(Gaussian)(z, X, Lambda, plates=(N,), name='Y')
+    Y.observe(y)
+    Lambda.initialize_from_parameters(D, 10*np.identity(D))
+    X.initialize_from_parameters(X.random(), np.identity(D))
+    return (Y, X, Lambda, z, alpha)
+
+
+class TestRestart(utils.TestCase):
+
+    def test_restart(self):
+        """
+        Test that the best restart is selected and the others are pruned
+        """
+        np.random.seed(1)
+        y = np.concatenate([np.random.randn(20, 2) - 4,
+                            np.random.randn(20, 2) + 4])
+        filename = tempfile.mktemp(suffix='.hdf5')
+        try:
+            (model, Q, L) = restart(gaussianmix_model, 4,
+                                    args=(y, 3),
+                                    repeat=30,
+                                    prune_after=3,
+                                    margin=0,
+                                    processes=2,
+                                    seed=10,
+                                    filename=filename)
+            self.assertTrue(os.path.exists(filename))
+        finally:
+            if os.path.exists(filename):
+                os.remove(filename)
+
+        self.assertEqual(np.shape(L), (4, 30))
+        last = np.array([l[~np.isnan(l)][-1] for l in L])
+        pruned = np.isnan(L[:,-1])
+        self.assertFalse(np.all(pruned))
+        self.assertAllClose(Q.L[Q.iter-1], np.max(last[~pruned]))
+
+        # The loaded state gives the same bound
+        self.assertAllClose(Q.compute_lowerbound(), Q.L[Q.iter-1])
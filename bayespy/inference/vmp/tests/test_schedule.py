@@ -0,0 +1,99 @@
+######################################################################
+# Copyright (C) 2013 Jaakko Luttinen
+#
+# This file is licensed under Version 3.0 of the GNU General Public
+# License. See LICENSE for a text of the license.
+######################################################################
+
+######################################################################
+# This file is part of BayesPy.
+#
+# BayesPy is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# BayesPy is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with BayesPy.  If not, see <http://www.gnu.org/licenses/>.
+######################################################################
+
+"""
+Unit tests for `schedule` module.
+"""
+
+import numpy as np
+
+from bayespy.inference.vmp.nodes.gaussian import GaussianArrayARD
+from bayespy.inference.vmp.nodes.gamma import Gamma
+from bayespy.inference.vmp.nodes.dot import SumMultiply
+from bayespy.inference.vmp.nodes.gaussian_markov_chain import GaussianMarkovChain
+from bayespy.inference.vmp.vmp import VB
+from bayespy.inference.vmp.schedule import Schedule, markov_blanket
+
+from bayespy.utils import utils
+
+
+class TestSchedule(utils.TestCase):
+
+    def lssm(self, seed):
+        np.random.seed(seed)
+        (M, N, D) = (3, 10, 2)
+        alpha = Gamma(1e-5, 1e-5, plates=(D,), name='alpha')
+        A = GaussianArrayARD(0, alpha, shape=(D,), plates=(D,), name='A')
+        X = GaussianMarkovChain(np.zeros(D), np.identity(D), A, np.ones(D),
+                                n=N, name='X')
+        gamma = Gamma(1e-5, 1e-5, plates=(D,), name='gamma')
+        C = GaussianArrayARD(0, gamma, shape=(D,), plates=(M,1), name='C')
+        tau = Gamma(1e-5, 1e-5, name='tau')
+        F = SumMultiply('i,i', C, X.as_gaussian(), name='F')
+        Y = GaussianArrayARD(F, tau, name='Y')
+        Y.observe(np.random.randn(M,N))
+        C.initialize_from_random()
+        return (alpha, A, X, gamma, C, tau, Y)
+
+    def test_markov_blanket(self):
+        """
+        Test finding the Markov blanket through deterministic nodes
+        """
+        (alpha, A, X, gamma, C, tau, Y) = self.lssm(1)
+        self.assertCountEqual([node.name for node in markov_blanket(tau)],
+                              ['Y', 'C', 'X'])
+        self.assertCountEqual([node.name for node in markov_blanket(C)],
+                              ['gamma', 'Y', 'tau', 'X'])
+        self.assertCountEqual([node.name for node in markov_blanket(alpha)],
+                              ['A'])
+
+    def test_schedule(self):
+        """
+        Test the update order and the concurrent groups
+        """
+        nodes = self.lssm(1)
+        schedule = Schedule(*nodes)
+        self.assertEqual([node.name for node in schedule.order],
+                         ['Y', 'X', 'C', 'tau', 'A', 'gamma', 'alpha'])
+        self.assertEqual([[node.name for node in group]
+                          for group in schedule.groups],
+                         [['Y'], ['X'], ['C', 'A'], ['tau', 'gamma', 'alpha']])
+
+        # Keep the given order
+        schedule = Schedule(*nodes, sort=False)
+        self.assertEqual([node.name for node in schedule.order],
+                         ['alpha', 'A', 'X', 'gamma', 'C', 'tau', 'Y'])
+        self.assertEqual([[node.name for node in group]
+                          for group in schedule.groups],
+                         [['alpha', 'gamma'], ['A'], ['X'], ['C'], ['tau'], 
+                          ['Y']])
+
+    def test_threads(self):
+        """
+        Test that concurrent updates give the same result as serial updates
+        """
+        Q = VB(*self.lssm(1))
+        Q.update(repeat=3)
+        Q_threads = VB(*self.lssm(1), threads=4)
+        Q_threads.update(repeat=3)
+        self.assertAllClose(Q_threads.L, Q.L)
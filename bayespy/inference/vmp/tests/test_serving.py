@@ -0,0 +1,182 @@
+######################################################################
+# Copyright (C) 2013 Jaakko Luttinen
+#
+# This file is licensed under Version 3.0 of the GNU General Public
+# License. See LICENSE for a text of the license.
+######################################################################
+
+######################################################################
+# This file is part of BayesPy.
+#
+# BayesPy is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# BayesPy is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with BayesPy.  If not, see <http://www.gnu.org/licenses/>.
+######################################################################
+
+"""
+Unit tests for `serving` module.
+"""
+
+import os
+import json
+import tempfile
+import threading
+import http.client
+
+import numpy as np
+
+from bayespy.inference.vmp.nodes.gaussian import Gaussian
+from bayespy.inference.vmp.nodes.gaussian_markov_chain import GaussianMarkovChain
+from bayespy.inference.vmp.serving import (PredictionServer,
+                                           MarkovChainForecast,
+                                           serve_http)
+
+from bayespy.utils import utils
+
+
+class TestPredictionServer(utils.TestCase):
+
+    def test_batching(self):
+        """
+        Test that concurrent queries are evaluated in batches
+        """
+        calls = []
+        def predict(x):
+            calls.append(len(x))
+            return (2*x, x**2)
+
+        with PredictionServer(predict, latency=0.2) as server:
+            futures = [server.submit(np.arange(i, i+3)) for i in range(5)]
+            for (i, future) in enumerate(futures):
+                (mean, var) = future.result()
+                self.assertAllClose(mean, 2*np.arange(i, i+3))
+                self.assertAllClose(var, np.arange(i, i+3)**2)
+        self.assertEqual(sum(calls), 15)
+        self.assertLess(len(calls), 5)
+        self.assertEqual(server.queries, 5)
+
+        # Errors are passed to the queries
+        with PredictionServer(lambda x: 1/0) as server:
+            self.assertRaises(ZeroDivisionError, server.predict, [1])
+
+    def test_invalid(self):
+        """
+        Test that invalid queries fail alone
+        """
+        def predict(x):
+            if np.any(x < 0):
+                raise ValueError("Negative input")
+            return (2*x, None)
+
+        with PredictionServer(predict, latency=0.2) as server:
+            # Scalars are rejected immediately
+            self.assertRaises(ValueError, server.submit, 3)
+            futures = [server.submit(np.ones((2,3))),
+                       server.submit([-1]),
+                       server.submit(np.ones((1,2))),
+                       server.submit([4, 5])]
+            self.assertAllClose(futures[0].result()[0], 2*np.ones((2,3)))
+            self.assertRaises(ValueError, futures[1].result)
+            self.assertAllClose(futures[2].result()[0], 2*np.ones((1,2)))
+            self.assertAllClose(futures[3].result()[0], [8, 10])
+            # The server keeps running
+            self.assertAllClose(server.predict([1])[0], [2])
+
+    def test_http(self):
+        """
+        Test the HTTP front end over TCP and a Unix socket
+        """
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'socket')
+        with PredictionServer(lambda x: (x+1, 0*x)) as server:
+            for address in [('127.0.0.1', 0), path]:
+                httpd = serve_http(server, address)
+                def post(inputs):
+                    if isinstance(address, str):
+                        connection = http.client.HTTPConnection('localhost')
+                        connection.sock = _unix_socket(path)
+                    else:
+                        connection = http.client.HTTPConnection(
+                            *httpd.server_address)
+                    connection.request('POST', '/',
+                                       json.dumps(dict(inputs=inputs)))
+                    response = connection.getresponse()
+                    result = (response.status,
+                              json.loads(response.read().decode('utf-8')))
+                    connection.close()
+                    return result
+                try:
+                    (status, response) = post([1, 2])
+                    self.assertEqual(status, 200)
+                    self.assertEqual(response['mean'], [2, 3])
+                    self.assertEqual(response['variance'], [0, 0])
+                    # Invalid queries do not stop the server
+                    (status, response) = post(3)
+                    self.assertEqual(status, 400)
+                    (status, response) = post([1])
+                    self.assertEqual(response['mean'], [2])
+                finally:
+                    httpd.shutdown()
+                    httpd.server_close()
+        os.remove(path)
+        os.rmdir(directory)
+
+
+def _unix_socket(path):
+    import socket
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(path)
+    return sock
+
+
+class TestMarkovChainForecast(utils.TestCase):
+
+    def test_forecast(self):
+        """
+        Test the forecasts against the Kalman prediction equations
+        """
+        np.random.seed(1)
+        (N, D) = (10, 2)
+        A = np.array([[0.9, 0.2], [-0.1, 0.8]])
+        v = np.array([2.0, 4.0])
+        X = GaussianMarkovChain(np.zeros(D), np.identity(D), A, v, n=N)
+        Y = Gaussian(X.as_gaussian(), np.identity(D))
+        Y.observe(np.random.randn(N, D))
+        X.update()
+
+        forecast = MarkovChainForecast(X)
+        (mean, var) = forecast(np.array([3, 1]))
+        self.assertEqual(np.shape(mean), (2, D))
+
+        m = X.u[0][-1]
+        C = np.asarray(X.u[1])[-1] - np.outer(m, m)
+        for h in range(1, 4):
+            m = np.dot(A, m)
+            C = np.dot(A, np.dot(C, A.T)) + np.diag(1/v)
+            if h == 1:
+                self.assertAllClose(mean[1], m)
+                self.assertAllClose(var[1], np.diag(C))
+        self.assertAllClose(mean[0], m)
+        self.assertAllClose(var[0], np.diag(C))
+
+        # Growing the cache keeps the earlier forecasts
+        (mean2, var2) = forecast(np.array([10, 3, 1]))
+        self.assertAllClose(mean2[1:], mean)
+        self.assertAllClose(var2[1:], var)
+        self.assertEqual(forecast._size, 11)
+
+        self.assertRaises(ValueError, forecast, [0])
+
+        # Invalid horizons fail when they are submitted
+        with PredictionServer(forecast) as server:
+            self.assertRaises(ValueError, server.submit, [0, 1])
+            self.assertRaises(ValueError, server.submit, [1.5])
+            self.assertAllClose(server.predict([1])[0], mean[1:])
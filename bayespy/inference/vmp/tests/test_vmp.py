@@ -0,0 +1,273 @@
+######################################################################
+# Copyright (C) 2013 Jaakko Luttinen
+#
+# This file is licensed under Version 3.0 of the GNU General Public
+# License. See LICENSE for a text of the license.
+######################################################################
+
+######################################################################
+# This file is part of BayesPy.
+#
+# BayesPy is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# BayesPy is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with BayesPy.  If not, see <http://www.gnu.org/licenses/>.
+######################################################################
+
+"""
+Unit tests for `vmp` module.
+"""
+
+import os
+import io
+import tempfile
+import contextlib
+import warnings
+
+import numpy as np
+
+from bayespy.inference.vmp.nodes.gaussian import GaussianArrayARD
+from bayespy.inference.vmp.nodes.gamma import Gamma
+from bayespy.inference.vmp.nodes.dot import SumMultiply
+from bayespy.inference.vmp.vmp import VB
+
+from bayespy.utils import utils
+
+
+def pca_model(M, N, D):
+    alpha = Gamma(1e-3, 1e-3, plates=(D,), name='alpha')
+    W = GaussianArrayARD(0, alpha, shape=(D,), plates=(M,1), name='W')
+    X = GaussianArrayARD(0, 1, shape=(D,), plates=(1,N), name='X')
+    tau = Gamma(1e-3, 1e-3, name='tau')
+    Y = GaussianArrayARD(SumMultiply('i,i', W, X), tau, name='Y')
+    return (Y, W, X, tau, alpha)
+
+
+class TestOptimize(utils.TestCase):
+
+    def fit(self, method, repeat, *nodes):
+        np.random.seed(1)
+        (M, N, D) = (10, 50, 3)
+        y = np.dot(np.random.randn(M, D), np.random.randn(D, N))
+        y = y + 0.2*np.random.randn(M, N)
+        (Y, W, X, tau, alpha) = pca_model(M, N, D)
+        Y.observe(y)
+        W.initialize_from_random()
+        X.initialize_from_random()
+        Q = VB(Y, W, X, tau, alpha)
+        with contextlib.redirect_stdout(io.StringIO()):
+            if method is None:
+                Q.update(repeat=repeat)
+            elif method == 'squarem':
+                Q.squarem(*nodes, repeat=repeat)
+            else:
+                Q.optimize(repeat=repeat, method=method)
+        return (Q.L, Q.accepted)
+
+    def test_optimize(self):
+        """
+        Test that the accelerated updates increase the bound faster
+        """
+        (L_vmp, accepted) = self.fit(None, 30)
+        self.assertTrue(np.all(np.isnan(accepted)))
+        for method in ['cg', 'momentum']:
+            (L, accepted) = self.fit(method, 30)
+            self.assertTrue(np.all(np.diff(L) > -1e-6))
+            self.assertGreaterEqual(L[-1], L_vmp[-1])
+
+        self.assertRaises(ValueError, VB().optimize, method='newton')
+
+    def test_squarem(self):
+        """
+        Test that the extrapolated sweeps increase the bound faster
+        """
+        # One extrapolated iteration costs two or three sweeps
+        (L_vmp, accepted) = self.fit(None, 30)
+        (L, accepted) = self.fit('squarem', 10)
+        self.assertTrue(np.all(np.diff(L) > -1e-6))
+        self.assertGreaterEqual(L[-1], L_vmp[-1])
+        self.assertEqual(np.shape(accepted), (10,))
+        self.assertTrue(np.nansum(accepted) > 0)
+
+        # Rejected steps do not change the nodes that are not extrapolated
+        (L, accepted) = self.fit('squarem', 10, 'X')
+        self.assertTrue(np.all(np.diff(L) > -1e-6))
+        self.assertTrue(np.any(accepted == 0))
+
+    def test_check_parameters(self):
+        """
+        Test that parameters outside the domain are rejected
+        """
+        tau = Gamma(2, 3)
+        self.assertTrue(tau._check_parameters([-np.ones(2), np.ones(2)]))
+        self.assertFalse(tau._check_parameters([-np.ones(2), -np.ones(2)]))
+        (Y, W, X, tau, alpha) = pca_model(2, 3, 2)
+        self.assertFalse(X._check_parameters([np.nan*np.ones(2),
+                                              -np.identity(2)]))
+        self.assertFalse(VB(X)._set_parameters([X], [[np.zeros(2),
+                                                     np.identity(2)]]))
+
+
+class TestAutosave(utils.TestCase):
+
+    def test_autosave(self):
+        """
+        Test the background auto-save
+        """
+        np.random.seed(1)
+        y = np.random.randn(4, 10)
+        (Y, W, X, tau, alpha) = pca_model(4, 10, 2)
+        Y.observe(y)
+        X.initialize_from_random()
+        directory = tempfile.mkdtemp()
+        filename = os.path.join(directory, 'autosave.hdf5')
+        try:
+            Q = VB(Y, W, X, tau, alpha,
+                   autosave_iterations=4,
+                   autosave_filename=filename)
+            with contextlib.redirect_stdout(io.StringIO()):
+                Q.update(repeat=4)
+                # The update waits for the auto-save
+                self.assertIsNone(Q._autosave_thread)
+                self.assertEqual(Q.checkpoint, (filename, 4))
+                # The snapshot is not affected by later updates
+                snapshot = Q._snapshot()
+                u = np.array(X.u[0])
+                g = np.array(X.g)
+                X.rotate(2*np.identity(2))
+                Q.update(repeat=1)
+            self.assertAllClose(snapshot['nodes']['X'][1]['u'][0], u)
+            self.assertAllClose(snapshot['nodes']['X'][1]['g'], g)
+            self.assertEqual(snapshot['iter'], 4)
+
+            # Load the checkpoint into a new model
+            (Y2, W2, X2, tau2, alpha2) = pca_model(4, 10, 2)
+            Y2.observe(y)
+            Q2 = VB(Y2, W2, X2, tau2, alpha2)
+            Q2.load(filename=filename)
+            self.assertAllClose(X2.u[0], u)
+            self.assertEqual(Q2.iter, 4)
+
+            # No temporary files are left
+            self.assertEqual(os.listdir(directory), ['autosave.hdf5'])
+        finally:
+            for name in os.listdir(directory):
+                os.remove(os.path.join(directory, name))
+            os.rmdir(directory)
+
+
+class TestUpdateObservations(utils.TestCase):
+
+    def model(self, y):
+        mu = GaussianArrayARD(0, 1e-3, shape=(), plates=(3,1), name='mu')
+        tau = Gamma(1e-3, 1e-3, plates=(3,1), name='tau')
+        Y = GaussianArrayARD(mu, tau, shape=(), plates=(3,20), name='Y')
+        Y.observe(y, cache=True)
+        return (Y, mu, tau)
+
+    def test_update_observations(self):
+        """
+        Test changing a few observations
+        """
+        np.random.seed(1)
+        y = np.random.randn(3, 20)
+        (Y, mu, tau) = self.model(y)
+        Q = VB(Y, mu, tau)
+        with contextlib.redirect_stdout(io.StringIO()):
+            Q.update(repeat=2)
+        self.assertTrue(len(Y._statistics) > 0)
+
+        index = (np.array([1, 1]), np.array([4, 9]))
+        y = y.copy()
+        y[index] = [5, -5]
+        Y.update_observations(y[index], index)
+        (Y2, mu2, tau2) = self.model(y)
+        self.assertAllClose(Y.u[0], Y2.u[0])
+        self.assertAllClose(Y.u[1], Y2.u[1])
+        for (key, plates) in Y._statistics:
+            x = Y._statistics[(key, plates)]
+            self.assertAllClose(x,
+                                np.broadcast_to(Y2._observed_sum(key, plates),
+                                                np.shape(x)))
+        dirty = np.zeros((3, 20), dtype=bool)
+        dirty[index] = True
+        np.testing.assert_array_equal(Y.dirty, dirty)
+
+        # Boolean index
+        mask = np.zeros((3, 20), dtype=bool)
+        mask[0,0] = True
+        y = y.copy()
+        y[mask] = 2
+        Y.update_observations([2], mask)
+        self.assertAllClose(Y.u[0], y)
+        self.assertTrue(Y.dirty[0,0])
+
+    def test_update(self):
+        """
+        Test updating the posterior after changing a few observations
+        """
+        np.random.seed(1)
+        y = np.random.randn(3, 20)
+        (Y, mu, tau) = self.model(y)
+        Q = VB(Y, mu, tau)
+        with contextlib.redirect_stdout(io.StringIO()):
+            Q.update(repeat=20)
+
+        index = (np.array([1, 1]), np.array([4, 9]))
+        y = y.copy()
+        y[index] = [5, -5]
+        Y.update_observations(y[index], index)
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter('always')
+            with contextlib.redirect_stdout(io.StringIO()):
+                Q.update(repeat=100)
+        self.assertFalse(any('Lower bound' in str(x.message) for x in w))
+        self.assertIsNone(Y.dirty)
+
+        # The result equals inference from scratch
+        (Y2, mu2, tau2) = self.model(y)
+        Q2 = VB(Y2, mu2, tau2)
+        with contextlib.redirect_stdout(io.StringIO()):
+            Q2.update(repeat=100)
+        self.assertAllClose(mu.u[0], mu2.u[0])
+        self.assertAllClose(Q.L[-1], Q2.L[-1])
+
+
+class TestFreeze(utils.TestCase):
+
+    def test_frozen_moments(self):
+        """
+        Test that the moments are updated only for the unfrozen plates
+        """
+        np.random.seed(1)
+        X = GaussianArrayARD(0, 1, shape=(2,), plates=(4,))
+        Y = GaussianArrayARD(X, 1, shape=(2,), plates=(4,))
+        Y.observe(np.random.randn(4, 2))
+        X.update()
+        u = [np.array(np.broadcast_to(u_i, X.get_shape(i)))
+             for (i, u_i) in enumerate(X.u)]
+        g = np.array(np.broadcast_to(X.g, (4,)))
+
+        # Change the data and update the unfrozen plates
+        Y.observe(np.random.randn(4, 2))
+        frozen = np.array([True, False, True, False])
+        X.freeze(frozen)
+        X.update()
+        for i in range(2):
+            self.assertAllClose(X.u[i][frozen], u[i][frozen])
+            self.assertFalse(np.allclose(X.u[i][~frozen], u[i][~frozen]))
+        self.assertAllClose(X.g[frozen], g[frozen])
+
+        # The unfrozen plates equal the full update
+        u_frozen = list(X.u)
+        X.unfreeze()
+        X.update()
+        for i in range(2):
+            self.assertAllClose(u_frozen[i][~frozen], X.u[i][~frozen])
@@ -28,10 +28,16 @@ import time
 import h5py
 import datetime
 import tempfile
+import threading
+import os
 
 from bayespy import utils
 
 from bayespy.inference.vmp.nodes.node import Node
+from bayespy.inference.vmp.nodes.stochastic import Stochastic
+from bayespy.inference.vmp.nodes.expfamily import ExponentialFamily
+from bayespy.inference.vmp.plan import ExecutionPlan
+from bayespy.inference.vmp.schedule import Schedule
 
 class VB():
 
@@ -40,7 +46,8 @@ class VB():
                  tol=1e-6, 
                  autosave_iterations=0, 
                  autosave_filename=None,
-                 callback=None):
+                 callback=None,
+                 threads=None):
 
         # Remove duplicate nodes
         self.model = utils.utils.unique(nodes)
@@ -49,9 +56,17 @@ class VB():
         
         self.iter = 0
         self.L = np.array(())
+        # Whether the accelerated step was accepted (nan for plain updates and
+        # for steps too short to extrapolate)
+        self.accepted = np.array(())
         self.l = dict(zip(self.model, 
                           len(self.model)*[np.array([])]))
         self.autosave_iterations = autosave_iterations
+        # The auto-saves are written by a background thread, at most one at a
+        # time.  The last successful checkpoint is (filename, iteration).
+        self.checkpoint = None
+        self._autosave_thread = None
+        self._autosave_error = None
         if not autosave_filename:
             date = datetime.datetime.today().strftime('%Y%m%d%H%M%S')
             prefix = 'vb_autosave_%s_' % date
@@ -71,78 +86,415 @@ class VB():
         self.callback = callback
         self.callback_output = None
 
+        # Default update schedule and compiled execution plan
+        self.schedule = Schedule(*self.model)
+        self.plan = None
+
+        # The number of threads for updating independent nodes concurrently
+        self.threads = threads
+
     def set_autosave(self, filename, iterations=None):
         self.autosave_filename = filename
         self.filename = filename
         if iterations is not None:
             self.autosave_iterations = iterations
 
+    def compile(self):
+        """
+        Compile a static execution plan for the model.
+
+        The shapes of the messages are validated once and the shape algebra
+        (plate multipliers, reduction axes, mask reshapes and einsum keys) is
+        cached in the nodes, so that the iterations do not need to recompute
+        it.
+
+        Returns
+        -------
+        plan : ExecutionPlan
+        """
+        if self.plan is not None:
+            self.plan.uncompile()
+        self.plan = ExecutionPlan(*self.model)
+        return self.plan
+
+    def uncompile(self):
+        """
+        Remove the compiled execution plan.
+        """
+        if self.plan is not None:
+            self.plan.uncompile()
+            self.plan = None
+
     def update(self, *nodes, repeat=1, plot=False):
 
-        # TODO/FIXME:
-        #
-        # If no nodes are given and thus everything is updated, the update order
-        # should be from down to bottom. Or something similar..
+        self._append_iterations(repeat)
+
+        # By default, update all nodes using the schedule, which sweeps from
+        # the observations towards the top-level nodes and updates nodes
+        # outside each other's Markov blankets concurrently (if threads are
+        # used). Explicitly given nodes are updated in the given order.
+        if len(nodes) == 0:
+            if self.plan is not None:
+                schedule = self.plan.schedule
+            else:
+                schedule = self.schedule
+        else:
+            schedule = Schedule(*[self[node] for node in nodes], sort=False)
+
+        if plot:
+            callback = self.plot
+        else:
+            callback = None
+
+        for i in range(repeat):
+            t = time.perf_counter()
+
+            # Update nodes
+            schedule.run(threads=self.threads, callback=callback)
+
+            self._end_iteration(t)
 
-        # Append the cost arrays
+        # Finish the auto-save, because the writer thread would be killed at
+        # the exit of the interpreter
+        self.wait_autosave()
+
+    def _append_iterations(self, repeat):
+        """
+        Append the cost arrays for the given number of iterations.
+        """
         self.L = np.append(self.L, utils.utils.nans(repeat))
+        self.accepted = np.append(self.accepted, utils.utils.nans(repeat))
         for (node, l) in self.l.items():
             self.l[node] = np.append(l, utils.utils.nans(repeat))
 
-        # By default, update all nodes
-        if len(nodes) == 0:
-            nodes = self.model
+    def _end_iteration(self, t):
+        """
+        Compute the lower bound and do the bookkeeping of an iteration.
+        """
+
+        # Call the custom function provided by the user
+        if callable(self.callback):
+            z = self.callback()
+            if z is not None:
+                z = np.array(z)[...,np.newaxis]
+                if self.callback_output is None:
+                    self.callback_output = z
+                else:
+                    self.callback_output = np.concatenate((self.callback_output,z),
+                                                          axis=-1)
+
+        # Compute lower bound
+        L = self.loglikelihood_lowerbound()
+        if np.isnan(self.accepted[self.iter]):
+            print("Iteration %d: loglike=%e (%.3f seconds)" 
+                  % (self.iter+1, L, time.perf_counter()-t))
+        else:
+            accepted = self.accepted[:self.iter+1]
+            accepted = accepted[~np.isnan(accepted)]
+            print("Iteration %d: loglike=%e (%.3f seconds, %d/%d steps "
+                  "accepted)"
+                  % (self.iter+1, L, time.perf_counter()-t,
+                     np.sum(accepted), len(accepted)))
+
+        # Check the progress of the iteration (the bound of the previous
+        # iteration is not comparable if observations have been changed with
+        # update_observations)
+        changed = [node for node in self.model
+                   if getattr(node, 'dirty', None) is not None]
+        if self.iter > 0 and len(changed) == 0:
+            # Check for errors
+            if self.L[self.iter-1] - L > 1e-6:
+                L_diff = (self.L[self.iter-1] - L)
+                warnings.warn("Lower bound decreased %e! Bug somewhere or "
+                              "numerical inaccuracy?" % L_diff)
+
+            # Check for convergence
+            if L - self.L[self.iter-1] < 1e-12:
+                print("Converged.")
+
+        self.L[self.iter] = L
+        self.iter += 1
+        for node in changed:
+            node.dirty = None
+
+        # Auto-save, if requested
+        if (self.autosave_iterations > 0 
+            and np.mod(self.iter, self.autosave_iterations) == 0):
+
+            self.autosave()
+
+    def optimize(self, *nodes, repeat=1, method='cg', momentum=0.5,
+                 max_step=16):
+        r"""
+        Update the nodes with accelerated (Riemannian) gradient steps.
+
+        The natural parameters of the given nodes are treated as one vector.
+        For conjugate-exponential models, the change of the natural parameters
+        in a VMP update is the natural gradient of the lower bound, thus each
+        iteration first runs a normal VMP sweep and then takes a step
+
+        .. math::
+
+           \boldsymbol{\phi} = \boldsymbol{\phi}_0 + \alpha \mathbf{d},
+           \qquad
+           \mathbf{d} = \mathbf{g} + \beta \mathbf{d}_{\mathrm{prev}},
+
+        where :math:`\mathbf{g}` is the change of the parameters in the VMP
+        sweep.  For the conjugate gradient method, :math:`\beta` is the
+        Fletcher-Reeves coefficient computed with the Riemannian inner product
+        approximated by :math:`\Delta\mathbf{u}^T\Delta\boldsymbol{\phi}`.
+        For the momentum method, :math:`\beta` is constant.  The step length
+        :math:`\alpha` is adapted and backtracked towards one until the lower
+        bound is larger than after the VMP sweep.  If no such step is found,
+        the result of the VMP sweep is used and the search direction is reset.
+
+        Parameters
+        ----------
+        nodes : nodes, optional
+           The exponential family nodes whose natural parameters are
+           optimized.  By default, all unobserved exponential family nodes of
+           the model.  The other nodes are updated by VMP.
+        repeat : int
+           The number of iterations.
+        method : 'cg' or 'momentum'
+           The method for combining the gradients.
+        momentum : float
+           The coefficient for the momentum method.
+        max_step : float
+           The largest step length, relative to the VMP step.
+        """
+
+        if method not in ('cg', 'momentum'):
+            raise ValueError("Unknown optimization method %s" % method)
+
+        nodes = self._exponential_family_nodes(*nodes)
+
+        self._append_iterations(repeat)
+
+        if self.plan is not None:
+            schedule = self.plan.schedule
+        else:
+            schedule = self.schedule
+
+        # The state of the search is kept between the calls
+        state = getattr(self, '_optimize_state', None)
+        if state is None or state['nodes'] != nodes:
+            state = dict(nodes=nodes, d=None, norm=None, step=2.0)
+            self._optimize_state = state
 
         for i in range(repeat):
-            t = time.clock()
+            t = time.perf_counter()
+
+            # VMP sweep gives the natural gradient
+            phi0 = self._get_parameters(nodes)
+            u0 = [[np.asarray(u) for u in node.u] for node in nodes]
+            schedule.run(threads=self.threads)
+            phi1 = self._get_parameters(nodes)
+            g = [[p1 - p0 for (p0, p1) in zip(node_phi0, node_phi1)]
+                 for (node_phi0, node_phi1) in zip(phi0, phi1)]
+            norm = sum(np.sum((np.asarray(u) - u_old) * dphi)
+                       for (node, node_u0, node_g) in zip(nodes, u0, g)
+                       for (u, u_old, dphi) in zip(node.u, node_u0, node_g))
+            L_vmp = self.compute_lowerbound()
+
+            # Search direction
+            if state['d'] is None:
+                beta = 0
+            elif method == 'cg':
+                beta = max(norm, 0) / state['norm']
+            else:
+                beta = momentum
+            if beta > 0:
+                d = [[gi + beta*di for (gi, di) in zip(node_g, node_d)]
+                     for (node_g, node_d) in zip(g, state['d'])]
+            else:
+                d = g
+
+            # Backtracking line search: the step lengths are halved
+            # towards the VMP step (or the plain search direction)
+            alphas = []
+            alpha = state['step']
+            while alpha > 1.1:
+                alphas.append(alpha)
+                alpha = 1 + (alpha - 1) / 2
+            if beta > 0:
+                alphas.append(1.0)
+            accepted = False
+            for alpha in alphas:
+                phi = [[p + alpha*di for (p, di) in zip(node_phi0, node_d)]
+                       for (node_phi0, node_d) in zip(phi0, d)]
+                if self._set_parameters(nodes, phi):
+                    with np.errstate(all='ignore'):
+                        L = self.compute_lowerbound()
+                    if np.isfinite(L) and L > L_vmp:
+                        accepted = True
+                        break
+
+            self.accepted[self.iter] = accepted
+            if accepted:
+                state['step'] = min(2*alpha, max_step)
+            else:
+                # Fall back to the VMP sweep and restart the search
+                self._set_parameters(nodes, phi1)
+                state['step'] = 2.0
+            if accepted and norm > 0:
+                state['d'] = d
+                state['norm'] = norm
+            else:
+                state['d'] = None
+                state['norm'] = None
+
+            self._end_iteration(t)
+
+        self.wait_autosave()
+
+    def squarem(self, *nodes, repeat=1, max_step=16):
+        r"""
+        Update the nodes with squared extrapolation (SQUAREM) of VMP sweeps.
+
+        Each iteration runs two VMP sweeps from the natural parameters
+        :math:`\boldsymbol{\phi}_0`, giving :math:`\boldsymbol{\phi}_1` and
+        :math:`\boldsymbol{\phi}_2`, and extrapolates
+
+        .. math::
+
+           \boldsymbol{\phi} = \boldsymbol{\phi}_0 - 2\alpha\mathbf{r}
+           + \alpha^2\mathbf{v},
+           \qquad
+           \mathbf{r} = \boldsymbol{\phi}_1 - \boldsymbol{\phi}_0,
+           \qquad
+           \mathbf{v} = \boldsymbol{\phi}_2 - 2\boldsymbol{\phi}_1
+           + \boldsymbol{\phi}_0,
+
+        with :math:`\alpha=-\|\mathbf{r}\|/\|\mathbf{v}\|`.  If the
+        extrapolated parameters are not valid (see `_check_parameters`) or the
+        bound is lower than after the second sweep, the step length is halved
+        towards :math:`\alpha=-1`, which corresponds to the second sweep.
+        Thus, the extrapolation is projected back to the valid domain along
+        the extrapolation path.  The other nodes are kept as they were after
+        the second sweep during the backtracking, thus a rejected step is
+        undone by restoring the parameters of the extrapolated nodes.  An
+        accepted step is stabilized with one more VMP sweep, which does not
+        decrease the bound.  No gradients are needed, thus the method works
+        for any exponential family nodes.  Whether the steps were accepted is
+        recorded in `accepted` (NaN if the step was too short to try the
+        extrapolation).
+
+        Parameters
+        ----------
+        nodes : nodes, optional
+           The exponential family nodes whose natural parameters are
+           extrapolated.  By default, all unobserved exponential family nodes
+           of the model.  The other nodes are updated by VMP.
+        repeat : int
+           The number of iterations, each consisting of two or three sweeps.
+        max_step : float
+           The largest absolute value of the step length :math:`\alpha`.
+        """
 
-            # Update nodes
-            for node in nodes:
-                X = self[node]
-                if hasattr(X, 'update') and callable(X.update):
-                    X.update()
-                    if plot:
-                        self.plot(X)
-
-            # Call the custom function provided by the user
-            if callable(self.callback):
-                z = self.callback()
-                if z is not None:
-                    z = np.array(z)[...,np.newaxis]
-                    if self.callback_output is None:
-                        self.callback_output = z
-                    else:
-                        self.callback_output = np.concatenate((self.callback_output,z),
-                                                              axis=-1)
-
-            # Compute lower bound
-            L = self.loglikelihood_lowerbound()
-            print("Iteration %d: loglike=%e (%.3f seconds)" 
-                  % (self.iter+1, L, time.clock()-t))
+        nodes = self._exponential_family_nodes(*nodes)
 
-            # Check the progress of the iteration
-            if self.iter > 0:
-                # Check for errors
-                if self.L[self.iter-1] - L > 1e-6:
-                    L_diff = (self.L[self.iter-1] - L)
-                    warnings.warn("Lower bound decreased %e! Bug somewhere or "
-                                  "numerical inaccuracy?" % L_diff)
+        self._append_iterations(repeat)
 
-                # Check for convergence
-                if L - self.L[self.iter-1] < 1e-12:
-                    print("Converged.")
+        if self.plan is not None:
+            schedule = self.plan.schedule
+        else:
+            schedule = self.schedule
 
-            self.L[self.iter] = L
-            self.iter += 1
+        for i in range(repeat):
+            t = time.perf_counter()
+
+            phi0 = self._get_parameters(nodes)
+            schedule.run(threads=self.threads)
+            phi1 = self._get_parameters(nodes)
+            schedule.run(threads=self.threads)
+            phi2 = self._get_parameters(nodes)
+            L2 = self.compute_lowerbound()
+
+            r = [[p1 - p0 for (p0, p1) in zip(node_phi0, node_phi1)]
+                 for (node_phi0, node_phi1) in zip(phi0, phi1)]
+            v = [[p2 - p1 - ri for (p1, p2, ri) in zip(node_phi1, node_phi2,
+                                                       node_r)]
+                 for (node_phi1, node_phi2, node_r) in zip(phi1, phi2, r)]
+            r2 = sum(np.sum(ri**2) for node_r in r for ri in node_r)
+            v2 = sum(np.sum(vi**2) for node_v in v for vi in node_v)
+            if v2 > 0:
+                alpha = max(-np.sqrt(r2 / v2), -max_step)
+            else:
+                alpha = -1
+
+            # Backtrack towards the second sweep (alpha=-1)
+            accepted = np.nan
+            while alpha < -1.1:
+                accepted = False
+                phi = [[p0 - 2*alpha*ri + alpha**2*vi
+                        for (p0, ri, vi) in zip(node_phi0, node_r, node_v)]
+                       for (node_phi0, node_r, node_v) in zip(phi0, r, v)]
+                if self._set_parameters(nodes, phi):
+                    try:
+                        with np.errstate(all='ignore'):
+                            L = self.compute_lowerbound()
+                    except Exception:
+                        L = np.nan
+                    if np.isfinite(L) and L >= L2:
+                        accepted = True
+                        break
+                alpha = (alpha - 1) / 2
+
+            self.accepted[self.iter] = accepted
+            if accepted is True:
+                schedule.run(threads=self.threads)
+            elif accepted is False:
+                self._set_parameters(nodes, phi2)
+
+            self._end_iteration(t)
+
+        self.wait_autosave()
+
+    def _exponential_family_nodes(self, *nodes):
+        """
+        Find the nodes for the accelerated updates.
 
-            # Auto-save, if requested
-            if (self.autosave_iterations > 0 
-                and np.mod(self.iter, self.autosave_iterations) == 0):
+        By default, all unobserved exponential family nodes of the model.
+        """
+        if len(nodes) == 0:
+            return [node for node in self.model
+                    if isinstance(node, ExponentialFamily)
+                    and not np.all(node.observed)]
+        nodes = [self[node] for node in nodes]
+        for node in nodes:
+            if not isinstance(node, ExponentialFamily):
+                raise ValueError("Node %s is not an exponential family "
+                                 "node" % node.name)
+        return nodes
 
-                self.save(self.autosave_filename)
-                print('Auto-saved to %s' % self.autosave_filename)
+    @staticmethod
+    def _get_parameters(nodes):
+        """
+        Get the natural parameters of the nodes as dense arrays.
+        """
+        return [[np.asarray(phi) for phi in node.phi] for node in nodes]
 
+    @staticmethod
+    def _set_parameters(nodes, phi):
+        """
+        Set the natural parameters and update the moments of the nodes.
 
+        Returns False if the parameters are not valid.
+        """
+        for (node, node_phi) in zip(nodes, phi):
+            if not node._check_parameters(node_phi):
+                return False
+        try:
+            with np.errstate(all='ignore'):
+                for (node, node_phi) in zip(nodes, phi):
+                    node.phi = list(node_phi)
+                    node._update_moments_and_cgf()
+        except Exception:
+            # For instance, the Cholesky decomposition of a precision matrix
+            # that is not positive definite raises a plain Exception
+            return False
+        return True
 
     def compute_lowerbound(self):
         L = 0
@@ -207,31 +559,116 @@ class VB():
             else:
                 raise Exception("Filename must be given.")
 
-        # Open HDF5 file
-        h5f = h5py.File(filename, 'w')
+        self._write_snapshot(filename, self._snapshot())
+
+    def autosave(self):
+        """
+        Save the state in the background to the auto-save file.
+
+        A snapshot of the state is taken and written by a background thread,
+        thus the iteration can continue during the writing.  The snapshot does
+        not copy the moment and parameter arrays (see `Stochastic.snapshot`).
+        At most one snapshot is written at a time: if the previous auto-save
+        is still in progress, this auto-save is skipped.  The file is written
+        atomically, thus the auto-save file always contains a complete
+        checkpoint.  The last successful checkpoint is in `checkpoint`.  The
+        update methods wait for the auto-save to finish before returning.
+        """
+        if self._autosave_thread is not None:
+            if self._autosave_thread.is_alive():
+                print('Previous auto-save still in progress, skipping')
+                return
+            self.wait_autosave()
+        filename = self.autosave_filename
+        snapshot = self._snapshot()
+        self._autosave_thread = threading.Thread(
+            target=self._write_checkpoint,
+            args=(filename, snapshot),
+            daemon=True)
+        self._autosave_thread.start()
+        print('Auto-saving to %s' % filename)
+
+    def wait_autosave(self):
+        """
+        Wait until the auto-save in progress has been written.
 
+        Returns the last successful checkpoint.  Warns if the auto-save
+        failed.
+        """
+        if self._autosave_thread is not None:
+            self._autosave_thread.join()
+            self._autosave_thread = None
+        if self._autosave_error is not None:
+            warnings.warn("Auto-save failed: %s" % self._autosave_error)
+            self._autosave_error = None
+        return self.checkpoint
+
+    def _write_checkpoint(self, filename, snapshot):
         try:
-            # Write each node
-            nodegroup = h5f.create_group('nodes')
-            for node in self.model:
-                if node.name == '':
-                    raise Exception("In order to save nodes, they must have "
-                                    "(unique) names.")
-                if hasattr(node, 'save') and callable(node.save):
-                    node.save(nodegroup.create_group(node.name))
-            # Write iteration statistics
-            utils.utils.write_to_hdf5(h5f, self.L, 'L')
-            utils.utils.write_to_hdf5(h5f, self.iter, 'iter')
-            if self.callback_output is not None:
-                utils.utils.write_to_hdf5(h5f, 
-                                          self.callback_output,
-                                          'callback_output')
-            boundgroup = h5f.create_group('boundterms')
-            for node in self.model:
-                utils.utils.write_to_hdf5(boundgroup, self.l[node], node.name)
-        finally:
-            # Close file
-            h5f.close()
+            self._write_snapshot(filename, snapshot)
+        except Exception as error:
+            self._autosave_error = error
+        else:
+            self.checkpoint = (filename, snapshot['iter'])
+
+    def _snapshot(self):
+        """
+        Take a snapshot of the state of the model and the iteration.
+        """
+        nodes = {}
+        for node in self.model:
+            if node.name == '':
+                raise Exception("In order to save nodes, they must have "
+                                "(unique) names.")
+            if hasattr(node, 'snapshot') and callable(node.snapshot):
+                nodes[node.name] = (node, node.snapshot())
+        return dict(nodes=nodes,
+                    L=self.L.copy(),
+                    iter=self.iter,
+                    callback_output=self.callback_output,
+                    l={node.name: self.l[node].copy() for node in self.model})
+
+    @staticmethod
+    def _write_snapshot(filename, snapshot):
+        """
+        Write a snapshot into a HDF5 file atomically.
+
+        The file is first written to a temporary file in the same directory,
+        which is then renamed.
+        """
+        directory = os.path.dirname(os.path.abspath(filename))
+        (fd, tmpname) = tempfile.mkstemp(prefix=os.path.basename(filename),
+                                         suffix='.tmp',
+                                         dir=directory)
+        os.close(fd)
+
+        try:
+            # Open HDF5 file
+            h5f = h5py.File(tmpname, 'w')
+
+            try:
+                # Write each node
+                nodegroup = h5f.create_group('nodes')
+                for (name, (node, state)) in snapshot['nodes'].items():
+                    node.write_snapshot(nodegroup.create_group(name), state)
+                # Write iteration statistics
+                utils.utils.write_to_hdf5(h5f, snapshot['L'], 'L')
+                utils.utils.write_to_hdf5(h5f, snapshot['iter'], 'iter')
+                if snapshot['callback_output'] is not None:
+                    utils.utils.write_to_hdf5(h5f, 
+                                              snapshot['callback_output'],
+                                              'callback_output')
+                boundgroup = h5f.create_group('boundterms')
+                for (name, l) in snapshot['l'].items():
+                    utils.utils.write_to_hdf5(boundgroup, l, name)
+            finally:
+                # Close file
+                h5f.close()
+
+            os.replace(tmpname, filename)
+        except BaseException:
+            os.remove(tmpname)
+            raise
 
     def load(self, *nodes, filename=None):
 
@@ -1,4 +1,6 @@
 from . import utils
+from . import jit
 from . import linalg
 from . import random
 from . import optimize
+from . import gp
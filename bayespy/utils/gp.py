@@ -0,0 +1,491 @@
+######################################################################
+# Copyright (C) 2013 Jaakko Luttinen
+#
+# This file is licensed under Version 3.0 of the GNU General Public
+# License. See LICENSE for a text of the license.
+######################################################################
+
+######################################################################
+# This file is part of BayesPy.
+#
+# BayesPy is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# BayesPy is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with BayesPy.  If not, see <http://www.gnu.org/licenses/>.
+######################################################################
+
+"""
+Gaussian process posterior computations.
+
+The functions use the protocol of the covariance function nodes: a prior mean
+function m(x) returns a list whose first element is the mean vector, and a
+covariance function k(x1, x2) returns a list whose first element is the
+covariance matrix.  With one argument, k(x) returns the variance vector.  The
+covariance matrices can be arrays, sparse matrices or low-rank matrices (see
+`utils.LowRankMatrix`).
+
+There is no importable Gaussian process node, thus the functions are used
+directly with mean and covariance functions that follow the protocol.
+"""
+
+import concurrent.futures
+
+import numpy as np
+import scipy.sparse as sp
+
+from . import utils
+from . import linalg
+
+
+def _standardize_input(x):
+    """
+    Reshape inputs to a two-dimensional array (inputs x dimensions).
+    """
+    if np.size(x) == 0:
+        return np.reshape(x, (0,0))
+    elif np.ndim(x) <= 1:
+        return np.reshape(x, (-1,1))
+    elif np.ndim(x) == 2:
+        return np.asarray(x)
+    raise ValueError("Standard GP inputs must be 2-dimensional")
+
+def _preprocess_inputs(x1, x2=None):
+    if x2 is None:
+        return _standardize_input(x1)
+    if x1 is x2:
+        x1 = _standardize_input(x1)
+        return (x1, x1)
+    return (_standardize_input(x1), _standardize_input(x2))
+
+
+def rff_features(amplitude, lengthscale, omega, phase, x, gradient=False):
+    """
+    Random Fourier features of the squared exponential kernel.
+
+    phi(x) = amplitude * sqrt(2/M) * cos(omega*x/lengthscale + phase)
+
+    where omega are standard normal frequencies (M x D) and phase are
+    uniform on [0, 2*pi].  If gradient is True, returns also the
+    gradients w.r.t. the amplitude and the lengthscale.
+    """
+    M = np.shape(omega)[0]
+    c = amplitude * np.sqrt(2/M)
+    # Projections of the inputs to the frequencies
+    xw = np.dot(x, omega.T)
+    arg = xw / lengthscale + phase
+    Phi = c * np.cos(arg)
+    if gradient:
+        dPhi_amplitude = Phi / amplitude
+        dPhi_lengthscale = c * np.sin(arg) * xw / lengthscale**2
+        return (Phi, (dPhi_amplitude, dPhi_lengthscale))
+    else:
+        return Phi
+
+def covfunc_se_rff(amplitude, lengthscale, omega, phase, x1, x2=None,
+                   gradient=False):
+    """
+    Squared exponential covariance function approximated with random
+    Fourier features.
+
+    The covariance matrix is returned as a low-rank matrix Phi1*Phi2'
+    (see `utils.LowRankMatrix`), thus the GP computations cost O(N*M^2)
+    instead of O(N^3), where M is the number of features.  The
+    frequencies `omega` and the phases `phase` are kept fixed so that
+    the covariance function is a deterministic function of the
+    hyperparameters.
+    """
+
+    # Make sure that hyperparameters are scalars, not an array objects
+    amplitude = utils.array_to_scalar(amplitude)
+    lengthscale = utils.array_to_scalar(lengthscale)
+
+    if x2 is None:
+        # Compute variance vector from the features in order to be
+        # consistent with the approximate covariance matrix
+        x1 = _preprocess_inputs(x1)
+        if gradient:
+            (Phi, (dPhi_a, dPhi_l)) = rff_features(amplitude, lengthscale,
+                                                   omega, phase, x1,
+                                                   gradient=True)
+            gradient_amplitude = 2 * np.sum(Phi*dPhi_a, axis=-1)
+            gradient_lengthscale = 2 * np.sum(Phi*dPhi_l, axis=-1)
+        else:
+            Phi = rff_features(amplitude, lengthscale, omega, phase, x1)
+        K = np.sum(Phi**2, axis=-1)
+    else:
+        symmetric = x1 is x2
+        (x1,x2) = _preprocess_inputs(x1,x2)
+        if gradient:
+            (Phi1, (dPhi1_a, dPhi1_l)) = rff_features(amplitude, lengthscale,
+                                                      omega, phase, x1,
+                                                      gradient=True)
+            if symmetric:
+                (Phi2, dPhi2_a, dPhi2_l) = (Phi1, dPhi1_a, dPhi1_l)
+            else:
+                (Phi2, (dPhi2_a, dPhi2_l)) = rff_features(amplitude,
+                                                          lengthscale,
+                                                          omega, phase, x2,
+                                                          gradient=True)
+            # d(Phi1*Phi2') = dPhi1*Phi2' + Phi1*dPhi2'
+            gradient_amplitude = utils.LowRankMatrix(2*dPhi1_a, Phi2)
+            gradient_lengthscale = utils.LowRankMatrix(
+                np.hstack([dPhi1_l, Phi1]),
+                np.hstack([Phi2, dPhi2_l]))
+        else:
+            Phi1 = rff_features(amplitude, lengthscale, omega, phase, x1)
+            if symmetric:
+                Phi2 = Phi1
+            else:
+                Phi2 = rff_features(amplitude, lengthscale, omega, phase, x2)
+        K = utils.LowRankMatrix(Phi1, Phi2)
+
+    if gradient:
+        return (K, (gradient_amplitude, gradient_lengthscale))
+    else:
+        return K
+
+
+def gp_posterior_moment_function(m, k, x, y, k_sparse=None, pseudoinputs=None,
+                                 noise=None, chol=None):
+    """
+    Construct the posterior moment function of a GP.
+
+    Parameters
+    ----------
+    m : function
+        Prior mean function
+    k : function
+        Prior covariance function
+    x : array
+        Data inputs
+    y : array
+        Data outputs
+    k_sparse : function
+        Sparse covariance function added to the data covariance
+    pseudoinputs : array
+        Pseudo-inputs for the sparse approximation
+    noise : array
+        Covariance matrix of the noise
+    chol : array
+        The Cholesky factor of the data covariance matrix if it is already
+        known (e.g., it has been updated incrementally), in order to avoid
+        forming and decomposing the covariance matrix.
+
+    Returns
+    -------
+    get_moments : function
+        get_moments(h, covariance=1, mean=True) returns the posterior mean
+        and the variance vector (covariance=1) or the covariance matrix
+        (covariance=2) of the inputs h.
+    """
+
+    # Prior
+    # FIXME: We are ignoring the covariance of mu now..
+    mu = m(x)[0]
+
+    K_noise = noise
+
+    if k_sparse is not None:
+        if K_noise is None:
+            K_noise = k_sparse(x,x)[0]
+        else:
+            K_noise = K_noise + k_sparse(x,x)[0]
+
+    # Feature-space statistics for low-rank covariance functions
+    S = None
+
+    if pseudoinputs is not None:
+        p = pseudoinputs
+        K_pp = k(p,p)[0]
+        K_xp = k(x,p)[0]
+        U = utils.chol(K_noise)
+
+        # Compute Lambda
+        Lambda = K_pp + np.dot(K_xp.T, utils.chol_solve(U, K_xp))
+        U_lambda = utils.chol(Lambda)
+
+        # Compute statistics for posterior predictions
+        z = utils.chol_solve(U_lambda,
+                             np.dot(K_xp.T,
+                                    utils.chol_solve(U, y - mu)))
+        U = utils.chol(K_pp)
+
+        # Now we can forget the location of the observations and
+        # consider only the pseudoinputs when predicting.
+        x = p
+
+    elif chol is not None:
+        U = chol
+        z = utils.chol_solve(U, y-mu) if len(y) > 0 else None
+
+    else:
+        K = k(x,x)[0]
+        if K_noise is not None:
+            K = K_noise + K
+
+        # Compute posterior GP
+        N = len(y)
+        U = None
+        z = None
+        if N > 0:
+            if isinstance(K, utils.LowRankMatrix):
+                # Low-rank covariance (plus diagonal noise), use the
+                # Woodbury identity in O(N*M^2)
+                U = utils.cholesky(K)
+                z = U.solve(y-mu)
+                # Projected posterior precision of the features:
+                # S = Phi' * inv(K) * Phi
+                S = np.dot(K.U.T, U.solve(K.U))
+            else:
+                U = utils.chol(K)
+                z = utils.chol_solve(U, y-mu)
+
+    def get_moments(h, covariance=1, mean=True):
+
+        K_xh = k(x, h)[0]
+        if k_sparse is not None:
+            K_xh = K_xh + k_sparse(x, h)[0]
+
+        # NumPy has problems when mixing matrices and arrays.
+        # Matrices may appear, for instance, when you sum an array and
+        # a sparse matrix.  Make sure the result is either an array or
+        # a sparse matrix (not dense matrix!), because matrix objects
+        # cause lots of problems:
+        #
+        # array.dot(array) = array
+        # matrix.dot(array) = matrix
+        # sparse.dot(array) = array
+        if not sp.issparse(K_xh) and not isinstance(K_xh, utils.LowRankMatrix):
+            K_xh = np.asarray(K_xh)
+
+        # Function for computing posterior moments
+        if mean:
+            # Mean vector
+            # FIXME: Ignoring the covariance of prior mu
+            m_h = m(h)[0]
+            if z is not None:
+                m_h = m_h + K_xh.T.dot(z)
+        else:
+            m_h = None
+
+        # Compute (co)variance matrix/vector
+        if covariance:
+            if covariance == 1:
+                ## Compute variance vector
+                k_h = np.array(k(h)[0], dtype=np.float64)
+                if k_sparse is not None:
+                    k_h += k_sparse(h)[0]
+                if S is not None:
+                    # K_xh = Phi_x * Phi_h', thus the variance reduction
+                    # is diag(Phi_h * S * Phi_h')
+                    k_h -= np.einsum('ij,ij->i', K_xh.V.dot(S), K_xh.V)
+                elif U is not None:
+                    if isinstance(K_xh, np.ndarray):
+                        k_h -= np.einsum('i...,i...',
+                                         K_xh,
+                                         utils.chol_solve(U, K_xh))
+                    else:
+                        # TODO: This isn't very efficient way, but
+                        # einsum doesn't work for sparse matrices..
+                        # This may consume A LOT of memory for sparse
+                        # matrices.
+                        k_h -= np.asarray(
+                            K_xh.multiply(utils.chol_solve(U, K_xh))
+                        ).sum(axis=0)
+                if pseudoinputs is not None:
+                    if isinstance(K_xh, np.ndarray):
+                        k_h += np.einsum('i...,i...',
+                                         K_xh,
+                                         utils.chol_solve(U_lambda, K_xh))
+                    else:
+                        k_h += np.asarray(
+                            K_xh.multiply(utils.chol_solve(U_lambda, K_xh))
+                        ).sum(axis=0)
+                # Ensure non-negative variances
+                k_h[k_h<0] = 0
+
+                return (m_h, k_h)
+
+            elif covariance == 2:
+                ## Compute full covariance matrix
+                K_hh = k(h,h)[0]
+                if k_sparse is not None:
+                    K_hh = K_hh + k_sparse(h)[0]
+                if S is not None:
+                    K_hh = K_hh + utils.LowRankMatrix(-K_xh.V.dot(S), K_xh.V)
+                elif U is not None:
+                    K_hh = K_hh - K_xh.T.dot(utils.chol_solve(U,K_xh))
+                if pseudoinputs is not None:
+                    K_hh = K_hh + K_xh.T.dot(utils.chol_solve(U_lambda, K_xh))
+                return (m_h, K_hh)
+        else:
+            return (m_h, None)
+
+    return get_moments
+
+
+def gp_predict(get_moments, h, chunksize=10000, variance=True, out=None,
+               threads=None):
+    """
+    Evaluate posterior mean and variance in chunks of test inputs.
+
+    The moment function returned by `gp_posterior_moment_function`
+    forms the cross-covariance matrix between the observations and all
+    the test inputs at once, thus the memory usage grows linearly with
+    the number of test inputs.  This function evaluates the moments in
+    chunks of rows of `h` so that only an N x `chunksize` block is in
+    memory at a time, and writes the results to the given output
+    arrays.
+
+    Parameters
+    ----------
+    get_moments : function
+        Posterior moment function, for instance, from
+        `gp_posterior_moment_function`.
+    h : array
+        Test inputs.  The chunks are taken along the first axis.
+    chunksize : int
+        Maximum number of test inputs processed at a time.
+    variance : bool
+        Whether to compute the variances.
+    out : tuple of arrays
+        Preallocated output arrays (mean, variance) of length len(h).
+        These can be memory-mapped arrays (e.g., `numpy.memmap` or
+        `numpy.lib.format.open_memmap`), thus the results do not need
+        to fit in memory.  If the variance is not computed, the second
+        element is ignored.  If not given, the arrays are allocated.
+    threads : int
+        If given, the chunks are processed in a thread pool of this
+        size.  Each chunk writes to a separate part of the output, and
+        the heavy computations (Cholesky solves, matrix products)
+        release the GIL.
+
+    Returns
+    -------
+    (mean, variance) : tuple of arrays
+        The output arrays.  The variance is None if it was not
+        computed.
+    """
+
+    H = np.shape(h)[0]
+    if chunksize < 1:
+        raise ValueError("Chunk size must be positive")
+
+    if out is None:
+        m_out = np.empty(H)
+        v_out = np.empty(H) if variance else None
+    else:
+        (m_out, v_out) = out
+        if np.shape(m_out)[0] != H:
+            raise ValueError("Output array for the mean has wrong length")
+        if variance and np.shape(v_out)[0] != H:
+            raise ValueError("Output array for the variance has wrong "
+                             "length")
+        if not variance:
+            v_out = None
+
+    covariance = 1 if variance else False
+
+    def process(start):
+        end = min(start + chunksize, H)
+        (m_h, k_h) = get_moments(h[start:end], covariance=covariance)
+        m_out[start:end] = m_h
+        if variance:
+            v_out[start:end] = k_h
+
+    starts = range(0, H, chunksize)
+    if threads is None or threads <= 1:
+        for start in starts:
+            process(start)
+    else:
+        with concurrent.futures.ThreadPoolExecutor(threads) as executor:
+            # Consume the results in order to raise possible errors
+            for result in executor.map(process, starts):
+                pass
+
+    return (m_out, v_out)
+
+
+def parameter_key(*params):
+    """
+    Copy parameter values for detecting changes of a covariance function.
+
+    The nested lists and tuples of the values are flattened to a tuple of
+    arrays.
+    """
+    key = []
+    for p in params:
+        if isinstance(p, (list, tuple)):
+            key.extend(parameter_key(*p))
+        elif p is not None:
+            key.append(np.array(p, copy=True))
+    return tuple(key)
+
+
+class IncrementalCholesky():
+    """
+    Cholesky factor of a GP data covariance matrix with incremental updates.
+
+    The factor can be extended with new inputs in O(N^2*k) and the oldest
+    inputs can be removed in O(N^2*k) (e.g., for a sliding window), where k
+    is the number of added or removed inputs.  The factor is valid only for
+    the covariance function it was computed with, thus the covariance
+    function is identified by a key (see `parameter_key`), for instance, the
+    values of its hyperparameters.  Whenever the key changes, the factor is
+    computed from scratch.
+
+    Parameters
+    ----------
+    covariance : function
+        covariance(x1, x2) returns the dense data covariance matrix
+        (including the noise) of the inputs.
+    x : array
+        Data inputs
+    key : tuple
+        The parameters of the covariance function
+    """
+
+    def __init__(self, covariance, x, key):
+        self.x = np.asarray(x)
+        self.key = parameter_key(key)
+        if len(self.x) == 0:
+            self.U = np.zeros((0, 0))
+        else:
+            self.U = np.triu(utils.chol(covariance(self.x, self.x)))
+
+    def is_valid(self, key):
+        """
+        Check whether the factor was computed with the given parameters.
+        """
+        key = parameter_key(key)
+        return (len(key) == len(self.key) and
+                all(np.shape(k1) == np.shape(k2) and np.all(k1 == k2)
+                    for (k1, k2) in zip(key, self.key)))
+
+    def append(self, covariance, x, key, window=None):
+        """
+        Add inputs and remove the oldest ones beyond the window size.
+        """
+        x = np.asarray(x)
+        x_all = np.concatenate([self.x, x], axis=0)
+        if self.is_valid(key) and len(self.x) > 0:
+            # Block update of the factor
+            self.U = linalg.chol_append(self.U,
+                                        covariance(self.x, x),
+                                        covariance(x, x))
+            self.x = x_all
+        else:
+            # The covariance function has changed
+            self.__init__(covariance, x_all, key)
+
+        if window is not None and len(self.x) > window:
+            n = len(self.x) - window
+            self.U = linalg.chol_remove(self.U, n)
+            self.x = self.x[n:]
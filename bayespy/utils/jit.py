@@ -0,0 +1,365 @@
+######################################################################
+# Copyright (C) 2013 Jaakko Luttinen
+#
+# This file is licensed under Version 3.0 of the GNU General Public
+# License. See LICENSE for a text of the license.
+######################################################################
+
+######################################################################
+# This file is part of BayesPy.
+#
+# BayesPy is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# BayesPy is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with BayesPy.  If not, see <http://www.gnu.org/licenses/>.
+######################################################################
+
+"""
+Batched linear algebra kernels for small matrices.
+
+The nodes often need Cholesky decompositions, solves and inverses for
+huge collections of small (e.g., 2x2 to 20x20) matrices.  Looping over
+the matrices in Python is slow, thus this module provides batched
+kernels.  If Numba is available, the kernels are JIT-compiled loops
+over the matrices.  Otherwise, the kernels fall back to the stacked
+linear algebra routines of NumPy.  The backend is selected
+automatically and can be switched off by setting `use_numba` to False.
+
+The Cholesky factors are upper triangular, U'*U = C, with zeros in the
+lower triangle, as in `scipy.linalg.cho_factor(C, lower=False)`.  All
+the functions operate on arrays with shape (..., D, D) and (..., D) and
+the leading axes must be equal (no broadcasting).
+"""
+
+import numpy as np
+import scipy.linalg
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# Use the JIT-compiled kernels if Numba is available
+use_numba = numba is not None
+
+
+def _flatten(X, ndim):
+    """
+    Reshape the leading axes of an array to one axis.
+    """
+    X = np.ascontiguousarray(X, dtype=np.float64)
+    return np.reshape(X, (-1,) + np.shape(X)[-ndim:])
+
+
+def _use_numba():
+    return use_numba and numba is not None
+
+
+#
+# NumPy implementations
+#
+
+def _np_chol(C):
+    try:
+        L = np.linalg.cholesky(C)
+    except np.linalg.LinAlgError:
+        raise np.linalg.LinAlgError("Matrix not positive definite")
+    return np.swapaxes(L, -1, -2)
+
+def _np_chol_solve(U, B):
+    # Solve U'*y = b and U*x = y.  NumPy does not have a stacked
+    # triangular solver.  For a few large matrices, loop over the
+    # matrices with the triangular solver of SciPy.  For many small
+    # matrices, loop over the rows instead and substitute all the
+    # matrices at once.
+    D = np.shape(U)[-1]
+    if np.prod(np.shape(U)[:-2], dtype=int) <= D:
+        X = np.empty(np.shape(B))
+        for i in np.ndindex(*np.shape(U)[:-2]):
+            X[i] = scipy.linalg.cho_solve((U[i], False), B[i],
+                                          check_finite=False)
+        return X
+    X = np.array(B, dtype=np.float64)
+    # Forward substitution U'*y = b
+    for i in range(D):
+        X[...,i,:] -= np.einsum('...k,...kr->...r', U[...,:i,i], X[...,:i,:])
+        X[...,i,:] /= U[...,i,i,np.newaxis]
+    # Backward substitution U*x = y
+    for i in range(D-1, -1, -1):
+        X[...,i,:] -= np.einsum('...k,...kr->...r',
+                                U[...,i,i+1:],
+                                X[...,i+1:,:])
+        X[...,i,:] /= U[...,i,i,np.newaxis]
+    return X
+
+def _np_chol_inv(U):
+    V = np.linalg.inv(U)
+    return np.einsum('...ik,...jk->...ij', V, V)
+
+
+#
+# Numba implementations
+#
+
+if numba is not None:
+
+    @numba.njit
+    def _nb_chol2(C, U):
+        # Cholesky decomposition of one matrix, returns False if the
+        # matrix is not positive definite
+        D = C.shape[0]
+        for i in range(D):
+            for j in range(i):
+                U[i,j] = 0
+        for j in range(D):
+            s = C[j,j]
+            for k in range(j):
+                s -= U[k,j] * U[k,j]
+            if not s > 0:
+                return False
+            u = np.sqrt(s)
+            U[j,j] = u
+            for i in range(j+1, D):
+                s = C[j,i]
+                for k in range(j):
+                    s -= U[k,j] * U[k,i]
+                U[j,i] = s / u
+        return True
+
+    @numba.njit
+    def _nb_solve2(U, B, X):
+        # Solve U'*U*X = B for one matrix (B and X are D x R)
+        D = U.shape[0]
+        R = B.shape[1]
+        for r in range(R):
+            # Forward substitution U'*y = b
+            for i in range(D):
+                s = B[i,r]
+                for k in range(i):
+                    s -= U[k,i] * X[k,r]
+                X[i,r] = s / U[i,i]
+            # Backward substitution U*x = y
+            for i in range(D-1, -1, -1):
+                s = X[i,r]
+                for k in range(i+1, D):
+                    s -= U[i,k] * X[k,r]
+                X[i,r] = s / U[i,i]
+
+    @numba.njit
+    def _nb_inv2(U, V):
+        # Compute inv(U'*U) for one matrix
+        D = U.shape[0]
+        for i in range(D):
+            for j in range(D):
+                V[i,j] = 0
+            V[i,i] = 1
+        _nb_solve2(U, V.copy(), V)
+
+    @numba.njit
+    def _nb_chol(C, U):
+        for n in range(C.shape[0]):
+            if not _nb_chol2(C[n], U[n]):
+                return n
+        return -1
+
+    @numba.njit
+    def _nb_chol_solve(U, B, X):
+        for n in range(U.shape[0]):
+            _nb_solve2(U[n], B[n], X[n])
+
+    @numba.njit
+    def _nb_chol_inv(U, V):
+        for n in range(U.shape[0]):
+            _nb_inv2(U[n], V[n])
+
+    @numba.njit
+    def _nb_block_banded_solve(A, B, y, V, C, x, ldet):
+        # Forward-backward recursion for block-tridiagonal systems, see
+        # bayespy.utils.linalg.block_banded_solve for details.  Returns
+        # the index of a failing plate or -1.
+        P = A.shape[0]
+        N = A.shape[1]
+        D = A.shape[2]
+        S = np.empty((D,D))
+        W = np.empty((D,D))
+        b = np.empty((D,1))
+        z = np.empty((D,1))
+        for p in range(P):
+
+            # Forward recursion (store Cholesky factors in V)
+            for i in range(D):
+                x[p,0,i] = y[p,0,i]
+            if not _nb_chol2(A[p,0], V[p,0]):
+                return p
+            ldet[p] = 0
+            for i in range(D):
+                ldet[p] += 2 * np.log(V[p,0,i,i])
+            for n in range(N-1):
+                # x[n+1] = y[n+1] - B[n]' * inv(V[n]) * x[n]
+                for i in range(D):
+                    b[i,0] = x[p,n,i]
+                _nb_solve2(V[p,n], b, z)
+                for i in range(D):
+                    s = y[p,n+1,i]
+                    for k in range(D):
+                        s -= B[p,n,k,i] * z[k,0]
+                    x[p,n+1,i] = s
+                # C[n] = inv(V[n]) * B[n]
+                _nb_solve2(V[p,n], B[p,n], C[p,n])
+                # V[n+1] = A[n+1] - B[n]' * C[n]
+                for i in range(D):
+                    for j in range(D):
+                        s = A[p,n+1,i,j]
+                        for k in range(D):
+                            s -= B[p,n,k,i] * C[p,n,k,j]
+                        S[i,j] = s
+                # Ensure symmetry
+                for i in range(D):
+                    for j in range(i):
+                        s = 0.5 * (S[i,j] + S[j,i])
+                        S[i,j] = s
+                        S[j,i] = s
+                if not _nb_chol2(S, V[p,n+1]):
+                    return p
+                for i in range(D):
+                    ldet[p] += 2 * np.log(V[p,n+1,i,i])
+
+            # Backward recursion
+            for i in range(D):
+                b[i,0] = x[p,N-1,i]
+            _nb_solve2(V[p,N-1], b, z)
+            for i in range(D):
+                x[p,N-1,i] = z[i,0]
+            _nb_inv2(V[p,N-1].copy(), V[p,N-1])
+            for n in range(N-2, -1, -1):
+                # x[n] = inv(V[n]) * (x[n] - B[n]*x[n+1])
+                for i in range(D):
+                    s = x[p,n,i]
+                    for k in range(D):
+                        s -= B[p,n,i,k] * x[p,n+1,k]
+                    b[i,0] = s
+                _nb_solve2(V[p,n], b, z)
+                for i in range(D):
+                    x[p,n,i] = z[i,0]
+                # V[n] = inv(V[n]) + C[n]*V[n+1]*C[n]'
+                _nb_inv2(V[p,n].copy(), S)
+                for i in range(D):
+                    for j in range(D):
+                        s = 0
+                        for k in range(D):
+                            s += C[p,n,i,k] * V[p,n+1,k,j]
+                        W[i,j] = s
+                for i in range(D):
+                    for j in range(D):
+                        s = S[i,j]
+                        for k in range(D):
+                            s += W[i,k] * C[p,n,j,k]
+                        V[p,n,i,j] = s
+                # C[n] = -C[n]*V[n+1]
+                for i in range(D):
+                    for j in range(D):
+                        C[p,n,i,j] = -W[i,j]
+                # Ensure symmetry
+                for i in range(D):
+                    for j in range(i):
+                        s = 0.5 * (V[p,n,i,j] + V[p,n,j,i])
+                        V[p,n,i,j] = s
+                        V[p,n,j,i] = s
+        return -1
+
+
+#
+# Public functions
+#
+
+def chol(C):
+    """
+    Cholesky decomposition of a stack of matrices.
+
+    Returns upper triangular matrices U such that U'*U = C.
+    """
+    C = np.asarray(C, dtype=np.float64)
+    if not _use_numba():
+        return _np_chol(C)
+    sh = np.shape(C)
+    C = _flatten(C, 2)
+    U = np.empty(np.shape(C))
+    n = _nb_chol(C, U)
+    if n >= 0:
+        raise np.linalg.LinAlgError("Matrix not positive definite")
+    return np.reshape(U, sh)
+
+def chol_solve(U, B, matrix=False):
+    """
+    Solve (U'*U)*x = b for stacks of Cholesky factors U.
+
+    If matrix is True, B has shape (..., D, R), otherwise (..., D).
+    """
+    U = np.asarray(U, dtype=np.float64)
+    B = np.asarray(B, dtype=np.float64)
+    if not matrix:
+        B = B[...,np.newaxis]
+    if not _use_numba():
+        X = _np_chol_solve(U, B)
+    else:
+        sh = np.shape(B)
+        X = np.empty(sh)
+        _nb_chol_solve(_flatten(U, 2),
+                       _flatten(B, 2),
+                       np.reshape(X, (-1,) + sh[-2:]))
+    if not matrix:
+        X = X[...,0]
+    return X
+
+def chol_inv(U):
+    """
+    Compute inv(U'*U) for stacks of Cholesky factors U.
+    """
+    U = np.asarray(U, dtype=np.float64)
+    if not _use_numba():
+        return _np_chol_inv(U)
+    sh = np.shape(U)
+    V = np.empty(sh)
+    _nb_chol_inv(_flatten(U, 2), np.reshape(V, (-1,) + sh[-2:]))
+    return V
+
+def chol_logdet(U):
+    """
+    Compute log-determinant of U'*U for stacks of Cholesky factors U.
+    """
+    return 2*np.sum(np.log(np.einsum('...ii->...i', U)), axis=-1)
+
+def block_banded_solve(A, B, y):
+    """
+    JIT-compiled version of `bayespy.utils.linalg.block_banded_solve`.
+
+    The plate axes of A, B and y must be equal.  Returns None if Numba
+    is not available so that the caller can use the NumPy version.
+    """
+    if not _use_numba():
+        return None
+    A = np.asarray(A, dtype=np.float64)
+    plates = np.shape(A)[:-3]
+    (N, D) = np.shape(A)[-3:-1]
+    A = _flatten(A, 3)
+    B = _flatten(B, 3)
+    y = _flatten(y, 2)
+    P = np.shape(A)[0]
+    V = np.empty((P,N,D,D))
+    C = np.empty((P,N-1,D,D))
+    x = np.empty((P,N,D))
+    ldet = np.empty(P)
+    p = _nb_block_banded_solve(A, B, y, V, C, x, ldet)
+    if p >= 0:
+        raise np.linalg.LinAlgError("Matrix not positive definite")
+    return (np.reshape(V, plates+(N,D,D)),
+            np.reshape(C, plates+(N-1,D,D)),
+            np.reshape(x, plates+(N,D)),
+            np.reshape(ldet, plates))
@@ -34,6 +34,7 @@ import scipy.linalg as linalg
 import scipy.special as special
 import scipy.optimize as optimize
 import scipy.sparse as sparse
+import scipy.sparse.linalg
 #import scikits.sparse.cholmod as cholmod
 
 # THIS IS SOME NEW GENERALIZED UFUNC FOR LINALG FEATURE, NOT IN OFFICIAL NUMPY
@@ -43,6 +44,7 @@ import scipy.sparse as sparse
 
 #from .utils import nested_iterator
 from . import utils
+from . import jit
 
 def chol(C):
     if sparse.issparse(C):
@@ -52,14 +54,10 @@ def chol(C):
         # Computes Cholesky decomposition for a collection of matrices.
         # The last two axes of C are considered as the matrix.
         C = np.atleast_2d(C)
-        U = np.empty(np.shape(C))
-        for i in utils.nested_iterator(np.shape(U)[:-2]):
-            try:
-                U[i] = linalg.cho_factor(C[i])[0]
-            except np.linalg.linalg.LinAlgError:
-                print(C[i])
-                raise Exception("Matrix not positive definite")
-        return U
+        try:
+            return jit.chol(C)
+        except np.linalg.linalg.LinAlgError:
+            raise Exception("Matrix not positive definite")
 
 def chol_solve(U, b, out=None, matrix=False):
     if isinstance(U, np.ndarray):
@@ -69,8 +67,25 @@ def chol_solve(U, b, out=None, matrix=False):
         if matrix:
             if np.ndim(b) < 2:
                 raise ValueError("b is not a matrix")
+            sh_u = np.shape(U)[:-2]
+            if sh_u == utils.broadcasted_shape(sh_u, np.shape(b)[:-2]):
+                # Use the batched kernel
+                b = np.broadcast_to(b, sh_u + np.shape(b)[-2:])
+                return jit.chol_solve(U, b, matrix=True)
             b = np.swapaxes(b, -1, -2)
             U = U[...,None,:,:]
+        else:
+            U = np.atleast_2d(U)
+            sh_u = np.shape(U)[:-2]
+            if (np.ndim(b) >= 1 and
+                sh_u == utils.broadcasted_shape(sh_u, np.shape(b)[:-1])):
+                # Use the batched kernel
+                b = np.broadcast_to(b, sh_u + np.shape(b)[-1:])
+                x = jit.chol_solve(U, b)
+                if out is None:
+                    return x
+                out[...] = x
+                return out
             
             
         # Allocate memory
@@ -138,14 +153,7 @@ def chol_solve(U, b, out=None, matrix=False):
 
 def chol_inv(U):
     if isinstance(U, np.ndarray):
-        # Allocate memory
-        V = np.tile(np.identity(np.shape(U)[-1]), np.shape(U)[:-2]+(1,1))
-        for i in utils.nested_iterator(np.shape(U)[:-2]):
-            V[i] = linalg.cho_solve((U[i], False),
-                                    V[i],
-                                    overwrite_b=True) # This would need Fortran order
-
-        return V
+        return jit.chol_inv(U)
     elif isinstance(U, cholmod.Factor):
         raise NotImplementedError
         ## if sparse.issparse(b):
@@ -169,6 +177,67 @@ def logdet_chol(U):
     elif isinstance(U, cholmod.Factor):
         return np.sum(np.log(U.D()))
     
+def chol_append(U, B, C):
+    """
+    Extend a Cholesky factor with new rows and columns.
+
+    Given the upper triangular factor U of K (K = U'*U), computes the
+    factor of the extended matrix [[K, B], [B', C]] in O(N^2*k) instead
+    of O((N+k)^3), where N is the size of K and k is the number of new
+    rows.  Only the upper triangle of U is used.
+    """
+    U = np.atleast_2d(U)
+    B = np.reshape(B, (np.shape(U)[0], -1))
+    C = np.atleast_2d(C)
+    (N, k) = np.shape(B)
+    # Solve U' * U_12 = B
+    U_12 = linalg.solve_triangular(U, B, trans='T', lower=False)
+    # Factor the Schur complement C - U_12' * U_12
+    U_22 = linalg.cho_factor(C - np.dot(U_12.T, U_12))[0]
+    U_new = np.zeros((N+k, N+k))
+    U_new[:N,:N] = np.triu(U)
+    U_new[:N,N:] = U_12
+    U_new[N:,N:] = np.triu(U_22)
+    return U_new
+
+def chol_update(U, x, overwrite=False):
+    """
+    Rank-one update of a Cholesky factor.
+
+    Given the upper triangular factor U of K (K = U'*U), computes the
+    factor of K + x*x' in O(N^2).
+    """
+    if not overwrite:
+        U = np.array(U, copy=True)
+    x = np.array(x, dtype=np.float64, copy=True)
+    N = np.shape(U)[0]
+    for j in range(N):
+        r = np.hypot(U[j,j], x[j])
+        c = r / U[j,j]
+        s = x[j] / U[j,j]
+        U[j,j] = r
+        if j < N - 1:
+            U[j,j+1:] += s * x[j+1:]
+            U[j,j+1:] /= c
+            x[j+1:] *= c
+            x[j+1:] -= s * U[j,j+1:]
+    return U
+
+def chol_remove(U, k):
+    """
+    Remove the first k rows and columns from a Cholesky factor.
+
+    If K = U'*U with U = [[U_11, U_12], [0, U_22]], the factor of the
+    trailing block K_22 = U_12'*U_12 + U_22'*U_22 is obtained with k
+    rank-one updates of U_22 in O(N^2*k).  This is useful, for
+    instance, for sliding windows of observations.
+    """
+    U = np.atleast_2d(U)
+    U_22 = np.triu(U[k:,k:])
+    for x in U[:k,k:]:
+        chol_update(U_22, x, overwrite=True)
+    return U_22
+
 def logdet_tri(R):
     """
     Logarithm of the absolute value of the determinant of a triangular matrix.
@@ -287,6 +356,329 @@ def tracedot(A, B):
     """
     return np.einsum('...ij,...ji->...', A, B)
 
+class PackedSymmetric():
+    """
+    Symmetric matrices stored as the packed upper triangles.
+
+    A stack of symmetric D x D matrices is stored as an array of shape
+    (..., D*(D+1)/2) containing the upper triangular elements in row-major
+    order.  Broadcasted leading axes of the matrices are not expanded.  The
+    matrices can be converted to a dense array with `toarray` or
+    `numpy.asarray`, thus the object can be used in place of the dense
+    array.  Arithmetic operations return dense arrays, that is, each use
+    converts the matrices to the dense form.  Functions such as
+    `symmetric_inner` use the packed elements directly.
+
+    Parameters
+    ----------
+    packed : ndarray
+       The packed upper triangles, shape (..., D*(D+1)/2)
+    shape : tuple
+       The shape of the dense array, (..., D, D)
+    """
+
+    def __init__(self, packed, shape):
+        self.packed = packed
+        self.shape = tuple(shape)
+        self.ndim = len(self.shape)
+        self.dtype = packed.dtype
+
+    def toarray(self):
+        D = self.shape[-1]
+        (i, j) = np.triu_indices(D)
+        A = np.empty(np.shape(self.packed)[:-1] + (D, D), dtype=self.dtype)
+        A[...,i,j] = self.packed
+        A[...,j,i] = self.packed
+        return utils.broadcast_to_shape(A, self.shape)
+
+    def __array__(self, dtype=None):
+        A = self.toarray()
+        if dtype is not None:
+            A = A.astype(dtype)
+        return A
+
+    def __getitem__(self, index):
+        return self.toarray()[index]
+
+    def copy(self):
+        return np.array(self.toarray())
+
+    def __neg__(self):
+        return PackedSymmetric(-self.packed, self.shape)
+
+    def __add__(self, other):
+        return self.toarray() + other
+
+    def __radd__(self, other):
+        return other + self.toarray()
+
+    def __sub__(self, other):
+        return self.toarray() - other
+
+    def __rsub__(self, other):
+        return other - self.toarray()
+
+    def __mul__(self, other):
+        if np.isscalar(other):
+            return PackedSymmetric(self.packed * other, self.shape)
+        return self.toarray() * other
+
+    def __rmul__(self, other):
+        if np.isscalar(other):
+            return PackedSymmetric(other * self.packed, self.shape)
+        return other * self.toarray()
+
+    def __truediv__(self, other):
+        return self.toarray() / other
+
+    def __rtruediv__(self, other):
+        return other / self.toarray()
+
+
+def packed_size(D):
+    """
+    Number of elements in the packed triangle of a D x D matrix.
+    """
+    return D*(D+1)//2
+
+def pack_symmetric(A):
+    """
+    Pack symmetric matrices to `PackedSymmetric`.
+
+    Only the upper triangles of A are read.  Broadcasted (zero-stride)
+    leading axes of A are kept broadcasted.
+    """
+    if isinstance(A, PackedSymmetric):
+        return A
+    A = np.asanyarray(A)
+    if np.ndim(A) < 2 or np.shape(A)[-1] != np.shape(A)[-2]:
+        raise ValueError("The matrices must be square")
+    (i, j) = np.triu_indices(np.shape(A)[-1])
+    C = utils.compact_broadcast(A)
+    C = utils.broadcast_to_shape(C, np.shape(C)[:-2] + np.shape(A)[-2:])
+    return PackedSymmetric(C[...,i,j], np.shape(A))
+
+def unpack_symmetric(A):
+    """
+    Return the dense array of symmetric matrices (packed or not).
+    """
+    if isinstance(A, PackedSymmetric):
+        return A.toarray()
+    return A
+
+def symmetric_inner(A, B):
+    """
+    Compute sum(A*B) over the last two axes for symmetric matrices A and B.
+
+    If both matrices are `PackedSymmetric`, the sum is computed from the
+    packed elements, thus only about half of the elements are read.
+    Otherwise, the matrices are used as dense arrays.
+    """
+    if isinstance(A, PackedSymmetric) and isinstance(B, PackedSymmetric):
+        D = A.shape[-1]
+        (i, j) = np.triu_indices(D)
+        w = np.where(i == j, 1.0, 2.0)
+        return np.einsum('...k,...k,k->...', A.packed, B.packed, w)
+    return np.einsum('...ij,...ij', 
+                     unpack_symmetric(A),
+                     unpack_symmetric(B))
+
+class SparseCholesky():
+    """
+    Sparse LDL' decomposition of a symmetric positive-definite matrix.
+
+    The decomposition is computed with the SuperLU solver of SciPy using a
+    symmetric fill-reducing ordering without pivoting, thus P*A*P' = L*D*L'
+    with unit lower triangular L.  The decomposition provides solves, the
+    log-determinant and selected elements of the inverse.
+
+    Parameters
+    ----------
+    A : sparse matrix
+       Symmetric positive-definite matrix
+    """
+
+    def __init__(self, A):
+        A = sparse.csc_matrix(A)
+        self.shape = A.shape
+        lu = sparse.linalg.splu(A,
+                                permc_spec='MMD_AT_PLUS_A',
+                                diag_pivot_thresh=0,
+                                options=dict(SymmetricMode=True))
+        d = lu.U.diagonal()
+        if np.any(lu.perm_r != lu.perm_c) or np.any(d <= 0):
+            raise np.linalg.LinAlgError("Matrix not positive definite")
+        self.lu = lu
+        self.d = d
+        self.perm = lu.perm_c
+        self.L = lu.L.tocsc()
+
+    def solve(self, b):
+        """
+        Solve A*x = b for a dense vector or matrix b.
+        """
+        if sparse.issparse(b):
+            b = b.toarray()
+        return self.lu.solve(np.asarray(b, dtype=np.float64))
+
+    def logdet(self):
+        return np.sum(np.log(self.d))
+
+    def _pattern(self):
+        """
+        Compute the symbolic pattern of the strictly lower triangular part
+        of L.
+
+        The numerically zero elements may be missing from the factor, thus
+        the symbolic pattern is restored by using the property that the
+        pattern of a column, without the parent, is included in the pattern
+        of its parent in the elimination tree.  The missing elements are
+        added for all the columns at once until the pattern is closed, which
+        usually needs no rounds at all.
+
+        Returns the column pointers, the sorted row indices and the values
+        of L in the pattern (zero for the restored elements).
+        """
+        n = self.shape[0]
+        L = sparse.tril(self.L, k=-1).tocoo()
+        keys = L.col.astype(np.int64)*n + L.row
+        order = np.argsort(keys)
+        (keys, values) = (keys[order], L.data[order])
+        while True:
+            (cols, rows) = (keys // n, keys % n)
+            first = np.ones(len(keys), dtype=bool)
+            first[1:] = cols[1:] != cols[:-1]
+            # The parent of each column is the first row in the column
+            parent = np.full(n, -1, dtype=np.int64)
+            parent[cols[first]] = rows[first]
+            # The other rows must be in the column of the parent
+            query = parent[cols[~first]]*n + rows[~first]
+            if len(query) == 0:
+                break
+            ind = np.minimum(np.searchsorted(keys, query), len(keys)-1)
+            missing = np.unique(query[keys[ind] != query])
+            if len(missing) == 0:
+                break
+            keys = np.concatenate([keys, missing])
+            values = np.concatenate([values, np.zeros(len(missing))])
+            order = np.argsort(keys, kind='mergesort')
+            (keys, values) = (keys[order], values[order])
+        indptr = np.searchsorted(cols, np.arange(n+1))
+        return (indptr, rows, values)
+
+    def selected_inverse(self):
+        """
+        Compute the elements of inv(A) in the sparsity pattern of the factor.
+
+        The pattern contains the pattern of A.  The elements are computed
+        with the Takahashi recursion from the root of the elimination tree
+        to the leaves, thus the dense inverse is never formed.  The columns
+        are processed in supernodes, that is, groups of consecutive columns
+        which have a dense diagonal block and the same rows below it, using
+        dense matrix products.  The single columns at the same depth of the
+        elimination tree do not depend on each other, thus they are
+        processed together.  Returns a symmetric sparse matrix.
+        """
+        n = self.shape[0]
+        (indptr, rows, l) = self._pattern()
+        counts = np.diff(indptr)
+        keys = np.repeat(np.arange(n, dtype=np.int64), counts)*n + rows
+
+        # The elimination tree and the depths of the columns in it
+        parent = np.where(counts > 0, np.append(rows, -1)[indptr[:-1]], -1)
+        depth = (parent >= 0).astype(int)
+        ancestor = parent
+        while np.any(ancestor >= 0):
+            has = ancestor >= 0
+            depth = depth + np.where(has, depth[ancestor], 0)
+            ancestor = np.where(has, ancestor[ancestor], -1)
+
+        # Column j+1 continues the supernode of column j if it is the parent
+        # of j and the pattern of j is the parent and the pattern of j+1
+        joined = np.logical_and(parent[:-1] == np.arange(1, n),
+                                counts[:-1] == counts[1:] + 1)
+        starts = np.flatnonzero(np.concatenate([[True], ~joined]))
+        ends = np.concatenate([starts[1:], [n]])
+        # A supernode depends only on the supernodes above its last column
+        levels = depth[ends-1]
+        single = (ends - starts == 1)
+
+        z = np.zeros(len(rows))
+        z_diag = np.zeros(n)
+
+        def gather(i, j):
+            # The computed elements of Z
+            (i, j) = (np.minimum(i, j), np.maximum(i, j))
+            v = z_diag[i]
+            off = (i != j)
+            v[off] = z[np.searchsorted(keys, i[off]*n + j[off])]
+            return v
+
+        def ranges(first, lengths):
+            # The concatenated ranges and the index of the range of each
+            # element
+            index = np.repeat(np.arange(len(first)), lengths)
+            offset = np.cumsum(lengths) - lengths
+            return (first[index] + np.arange(np.sum(lengths))
+                    - offset[index],
+                    index)
+
+        # Takahashi recursion Z = inv(L*D*L') from the root
+        for level in range(np.max(levels)+1 if n > 0 else 0):
+
+            # The single columns as a batch: z_j = -Z_SS * l_j
+            C = starts[np.logical_and(single, levels == level)]
+            m = counts[C]
+            (E, E_col) = ranges(indptr[C], m)
+            if len(E) > 0:
+                (P, P_col) = ranges(np.zeros(len(C), dtype=int), m**2)
+                a = np.cumsum(m)[P_col] - m[P_col] + P // m[P_col]
+                b = E[a] - P // m[P_col] + P % m[P_col]
+                v = gather(rows[E[a]], rows[b]) * l[b]
+                z[E] = -np.bincount(a, weights=v, minlength=len(E))
+            if len(C) > 0:
+                z_diag[C] = 1/self.d[C] - np.bincount(E_col,
+                                                      weights=l[E]*z[E],
+                                                      minlength=len(C))
+
+            # The supernodes
+            for (j0, j1) in zip(starts[~single & (levels == level)],
+                                ends[~single & (levels == level)]):
+                # The rows S below the diagonal block and the positions of
+                # the elements of the diagonal block and of the rows S in
+                # the columns J
+                J = np.arange(j0, j1)
+                S = rows[indptr[j1-1]:indptr[j1]]
+                (a, b) = np.tril_indices(len(J), k=-1)
+                pos_JJ = indptr[J[b]] + a - b - 1
+                pos_SJ = (indptr[J] + (j1-1-J)
+                          + np.arange(len(S))[:,np.newaxis])
+                L_JJ = np.identity(len(J))
+                L_JJ[a,b] = l[pos_JJ]
+                Z_SS = np.reshape(gather(np.repeat(S, len(S)),
+                                         np.tile(S, len(S))),
+                                  (len(S), len(S)))
+                # X = inv(L_JJ)' * L_SJ'
+                X = linalg.solve_triangular(L_JJ, l[pos_SJ].T, trans='T',
+                                            lower=True, unit_diagonal=True,
+                                            check_finite=False)
+                invL_JJ = linalg.solve_triangular(L_JJ, np.identity(len(J)),
+                                                  lower=True,
+                                                  unit_diagonal=True,
+                                                  check_finite=False)
+                Z_SJ = -np.dot(Z_SS, X.T)
+                Z_JJ = (np.dot(invL_JJ.T / self.d[J], invL_JJ)
+                        - np.dot(X, Z_SJ))
+                z_diag[J] = np.diag(Z_JJ)
+                z[pos_JJ] = Z_JJ[a,b]
+                z[pos_SJ] = Z_SJ
+
+        # Assemble and undo the permutation
+        Z = sparse.csc_matrix((z, rows, indptr), shape=self.shape)
+        Z = Z + Z.T + sparse.diags(z_diag, 0)
+        return Z.tocsr()[self.perm][:,self.perm].tocsc()
+
+
 def inv(A):
     if np.ndim(A) == 2:
         return np.linalg.inv(A)
@@ -377,7 +769,16 @@ def block_banded_solve(A, B, y):
                                         np.shape(B)[:-3])
     plates_y = utils.broadcasted_shape(plates_VC,
                                        np.shape(y)[:-2])
-                      
+
+    if plates_y == plates_VC:
+        # Use the compiled recursion if available
+        A = np.broadcast_to(A, plates_VC+(N,D,D))
+        B = np.broadcast_to(B, plates_VC+(N-1,D,D))
+        y = np.broadcast_to(y, plates_VC+(N,D))
+        result = jit.block_banded_solve(A, B, y)
+        if result is not None:
+            return result
+
     V = np.empty(plates_VC+(N,D,D))
     C = np.empty(plates_VC+(N-1,D,D))
     x = np.empty(plates_y+(N,D))
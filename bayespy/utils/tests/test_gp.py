@@ -0,0 +1,235 @@
+######################################################################
+# Copyright (C) 2013 Jaakko Luttinen
+#
+# This file is licensed under Version 3.0 of the GNU General Public
+# License. See LICENSE for a text of the license.
+######################################################################
+
+######################################################################
+# This file is part of BayesPy.
+#
+# BayesPy is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# BayesPy is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with BayesPy.  If not, see <http://www.gnu.org/licenses/>.
+######################################################################
+
+"""
+Unit tests for bayespy.utils.gp module.
+"""
+
+import numpy as np
+
+from ..utils import TestCase
+
+from .. import gp
+
+
+def zero_mean(x):
+    return [np.zeros(len(x))]
+
+def se_covariance(x1, x2=None):
+    """
+    Squared exponential covariance function of one-dimensional inputs.
+    """
+    if x2 is None:
+        return [np.ones(len(x1))]
+    return [np.exp(-0.5*(np.asarray(x1)[:,None]-np.asarray(x2)[None,:])**2)]
+
+
+class TestPredict(TestCase):
+
+    def setUp(self):
+        np.random.seed(1)
+        x = np.random.uniform(0, 10, size=30)
+        y = np.sin(x) + 0.1*np.random.randn(30)
+        self.get_moments = gp.gp_posterior_moment_function(
+            zero_mean,
+            se_covariance,
+            x,
+            y,
+            noise=0.01*np.identity(30))
+        self.h = np.linspace(-1, 11, 101)
+
+    def test_chunks(self):
+        """
+        Test that chunked predictions equal single-shot predictions
+        """
+        (m, v) = self.get_moments(self.h, covariance=1)
+        for (chunksize, threads) in [(7, None), (7, 3), (200, 2)]:
+            (m_h, v_h) = gp.gp_predict(self.get_moments,
+                                       self.h,
+                                       chunksize=chunksize,
+                                       threads=threads)
+            self.assertAllClose(m_h, m)
+            self.assertAllClose(v_h, v)
+
+        (m_h, v_h) = gp.gp_predict(self.get_moments, self.h, chunksize=10,
+                                   variance=False)
+        self.assertAllClose(m_h, m)
+        self.assertIsNone(v_h)
+
+    def test_out(self):
+        """
+        Test writing the predictions to given arrays
+        """
+        (m, v) = self.get_moments(self.h, covariance=1)
+        out = (np.zeros(101), np.zeros(101))
+        (m_h, v_h) = gp.gp_predict(self.get_moments, self.h, chunksize=10,
+                                   variance=True, out=out, threads=2)
+        self.assertIs(m_h, out[0])
+        self.assertIs(v_h, out[1])
+        self.assertAllClose(out[0], m)
+        self.assertAllClose(out[1], v)
+
+        self.assertRaises(ValueError,
+                          gp.gp_predict,
+                          self.get_moments,
+                          self.h,
+                          out=(np.zeros(101), np.zeros(100)))
+
+
+class TestRandomFourierFeatures(TestCase):
+
+    def setUp(self):
+        np.random.seed(1)
+        self.omega = np.random.randn(500, 1)
+        self.phase = np.random.uniform(0, 2*np.pi, size=500)
+
+    def covariance(self, dense=False):
+        def k(x1, x2=None):
+            K = gp.covfunc_se_rff(2.0, 1.5, self.omega, self.phase, x1, x2)
+            if dense and x2 is not None:
+                K = K.toarray()
+            return [K]
+        return k
+
+    def test_covariance(self):
+        """
+        Test that the features approximate the squared exponential kernel
+        """
+        x = np.linspace(0, 3, 10)
+        K = gp.covfunc_se_rff(2.0, 1.5, self.omega, self.phase, x, x)
+        self.assertIsInstance(K, gp.utils.LowRankMatrix)
+        K_se = 4.0 * np.exp(-0.5*(x[:,None]-x[None,:])**2/1.5**2)
+        self.assertTrue(np.max(np.abs(K.toarray() - K_se)) < 0.5)
+        self.assertAllClose(gp.covfunc_se_rff(2.0, 1.5, self.omega,
+                                              self.phase, x),
+                            np.diag(K.toarray()))
+
+    def test_posterior(self):
+        """
+        Test that the feature-space posterior equals the dense posterior
+        """
+        x = np.random.uniform(0, 10, size=40)
+        y = np.sin(x) + 0.1*np.random.randn(40)
+        h = np.linspace(-1, 11, 23)
+        noise = 0.01*np.identity(40)
+        low_rank = gp.gp_posterior_moment_function(zero_mean,
+                                                   self.covariance(),
+                                                   x,
+                                                   y,
+                                                   noise=noise)
+        dense = gp.gp_posterior_moment_function(zero_mean,
+                                                self.covariance(dense=True),
+                                                x,
+                                                y,
+                                                noise=noise)
+        (m1, v1) = low_rank(h, covariance=1)
+        (m2, v2) = dense(h, covariance=1)
+        self.assertAllClose(m1, m2)
+        self.assertAllClose(v1, v2, atol=1e-10)
+        (m1, K1) = low_rank(h, covariance=2)
+        (m2, K2) = dense(h, covariance=2)
+        self.assertIsInstance(K1, gp.utils.LowRankMatrix)
+        self.assertAllClose(K1.toarray(), K2, atol=1e-10)
+
+
+class TestIncrementalCholesky(TestCase):
+
+    def covariance(self, lengthscale):
+        def k(x1, x2):
+            K = se_covariance(x1/lengthscale, x2/lengthscale)[0]
+            if x1 is x2:
+                # Noise of the observations
+                K = K + 0.1*np.identity(len(x1))
+            return K
+        return k
+
+    def assertFactor(self, U, k, x):
+        self.assertAllClose(np.dot(U.T, U), k(x, x), atol=1e-12)
+
+    def test_append(self):
+        """
+        Test extending and windowing the factor
+        """
+        np.random.seed(1)
+        x = np.random.uniform(0, 10, size=20)
+        k = self.covariance(1.0)
+        key = gp.parameter_key([np.array(1.0)])
+        L = gp.IncrementalCholesky(k, x[:5], key)
+        L.append(k, x[5:12], key)
+        self.assertAllClose(L.x, x[:12])
+        self.assertFactor(L.U, k, x[:12])
+        L.append(k, x[12:], key, window=10)
+        self.assertAllClose(L.x, x[10:])
+        self.assertFactor(L.U, k, x[10:])
+
+        # Start from no inputs
+        L = gp.IncrementalCholesky(k, x[:0], key)
+        L.append(k, x[:3], key)
+        self.assertFactor(L.U, k, x[:3])
+
+    def test_invalidate(self):
+        """
+        Test that changed parameters invalidate the factor
+        """
+        np.random.seed(1)
+        x = np.random.uniform(0, 10, size=8)
+        L = gp.IncrementalCholesky(self.covariance(1.0), x[:5],
+                                   gp.parameter_key([np.array(1.0)]))
+        self.assertTrue(L.is_valid([np.array(1.0)]))
+        # Tiny changes are detected too
+        self.assertFalse(L.is_valid([np.array(1.0 + 1e-12)]))
+        self.assertFalse(L.is_valid([np.array(1.0), np.array(2.0)]))
+
+        # The factor is recomputed for the new parameters
+        k = self.covariance(2.0)
+        L.append(k, x[5:], gp.parameter_key([np.array(2.0)]))
+        self.assertTrue(L.is_valid([np.array(2.0)]))
+        self.assertFactor(L.U, k, x)
+
+    def test_posterior(self):
+        """
+        Test the posterior using a given Cholesky factor
+        """
+        np.random.seed(1)
+        x = np.random.uniform(0, 10, size=20)
+        y = np.sin(x) + 0.3*np.random.randn(20)
+        h = np.linspace(0, 10, 11)
+        k = self.covariance(1.0)
+        key = gp.parameter_key([np.array(1.0)])
+        L = gp.IncrementalCholesky(k, x[:10], key)
+        L.append(k, x[10:], key)
+        get_moments = gp.gp_posterior_moment_function(zero_mean,
+                                                      se_covariance,
+                                                      x,
+                                                      y,
+                                                      chol=L.U)
+        (m1, v1) = get_moments(h, covariance=1)
+        get_moments = gp.gp_posterior_moment_function(
+            zero_mean,
+            se_covariance,
+            x,
+            y,
+            noise=0.1*np.identity(20))
+        (m2, v2) = get_moments(h, covariance=1)
+        self.assertAllClose(m1, m2)
+        self.assertAllClose(v1, v2)
@@ -0,0 +1,119 @@
+######################################################################
+# Copyright (C) 2013 Jaakko Luttinen
+#
+# This file is licensed under Version 3.0 of the GNU General Public
+# License. See LICENSE for a text of the license.
+######################################################################
+
+######################################################################
+# This file is part of BayesPy.
+#
+# BayesPy is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# BayesPy is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with BayesPy.  If not, see <http://www.gnu.org/licenses/>.
+######################################################################
+
+"""
+Unit tests for bayespy.utils.jit module.
+"""
+
+import unittest
+
+import numpy as np
+import scipy.linalg
+
+from ..utils import TestCase
+
+from .. import utils
+from .. import jit
+
+class TestKernels(TestCase):
+
+    def setUp(self):
+        self.use_numba = jit.use_numba
+
+    def tearDown(self):
+        jit.use_numba = self.use_numba
+
+    def random_covariances(self, plates, D):
+        W = np.random.randn(*(plates + (D, 2*D)))
+        return np.einsum('...ik,...jk->...ij', W, W)
+
+    def check_kernels(self):
+        C = self.random_covariances((4,3), 3)
+        b = np.random.randn(4,3,3)
+        B = np.random.randn(4,3,3,2)
+
+        U = jit.chol(C)
+        for ind in np.ndindex(4,3):
+            self.assertAllClose(U[ind],
+                                scipy.linalg.cholesky(C[ind], lower=False))
+
+        x = jit.chol_solve(U, b)
+        self.assertAllClose(x, np.linalg.solve(C, b[...,None])[...,0])
+
+        X = jit.chol_solve(U, B, matrix=True)
+        self.assertAllClose(X, np.linalg.solve(C, B))
+
+        # Fewer matrices than the dimensionality
+        C2 = self.random_covariances((2,), 5)
+        b2 = np.random.randn(2,5)
+        x2 = jit.chol_solve(jit.chol(C2), b2)
+        self.assertAllClose(x2, np.linalg.solve(C2, b2[...,None])[...,0])
+
+        self.assertAllClose(jit.chol_inv(U), np.linalg.inv(C))
+        self.assertAllClose(jit.chol_logdet(U), np.linalg.slogdet(C)[1])
+
+        C[2,1] = -np.identity(3)
+        self.assertRaises(np.linalg.LinAlgError,
+                          jit.chol,
+                          C)
+
+    def test_numpy_kernels(self):
+        """
+        Test the NumPy implementations of the batched kernels
+        """
+        jit.use_numba = False
+        self.check_kernels()
+
+    @unittest.skipIf(jit.numba is None, "Numba not available")
+    def test_numba_kernels(self):
+        """
+        Test the parity of the JIT-compiled batched kernels
+        """
+        jit.use_numba = True
+        self.check_kernels()
+
+    @unittest.skipIf(jit.numba is None, "Numba not available")
+    def test_block_banded_solve(self):
+        """
+        Test the parity of the JIT-compiled block-tridiagonal solver
+        """
+        (N, D) = (6, 2)
+        A = self.random_covariances((3,N), D)
+        A = A + 10*np.identity(D)
+        B = np.random.randn(3,N-1,D,D)
+        y = np.random.randn(3,N,D)
+
+        jit.use_numba = True
+        (V, C, x, ldet) = jit.block_banded_solve(A, B, y)
+
+        for p in range(3):
+            M = utils.block_banded(list(A[p]), list(B[p]))
+            invM = np.linalg.inv(M)
+            self.assertAllClose(x[p].ravel(), np.linalg.solve(M, y[p].ravel()))
+            self.assertAllClose(ldet[p], np.linalg.slogdet(M)[1])
+            for n in range(N):
+                self.assertAllClose(V[p,n],
+                                    invM[n*D:(n+1)*D,n*D:(n+1)*D])
+            for n in range(N-1):
+                self.assertAllClose(C[p,n],
+                                    invM[n*D:(n+1)*D,(n+1)*D:(n+2)*D])
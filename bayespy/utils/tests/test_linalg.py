@@ -26,6 +26,7 @@ Unit tests for bayespy.utils.utils module.
 """
 
 import numpy as np
+import scipy.sparse as sparse
 
 from ..utils import TestCase
 
@@ -198,3 +199,133 @@ class TestBandedSolve(TestCase):
         # Check the log determinant
         self.assertAlmostEqual(ldet/np.linalg.slogdet(C)[1], 1)
 
+
+
+class TestCholeskyModifications(TestCase):
+
+    def test_chol_append(self):
+        """
+        Test extending a Cholesky factor with new rows and columns.
+        """
+        W = np.random.randn(7, 10)
+        K = np.dot(W, W.T)
+        U = linalg.chol(K[:4,:4])
+        U = linalg.chol_append(U, K[:4,4:], K[4:,4:])
+        self.assertAllClose(np.triu(U), np.triu(linalg.chol(K)))
+        self.assertAllClose(np.dot(U.T, U), K)
+
+    def test_chol_update(self):
+        """
+        Test rank-one update of a Cholesky factor.
+        """
+        W = np.random.randn(5, 10)
+        K = np.dot(W, W.T)
+        x = np.random.randn(5)
+        U = np.triu(linalg.chol(K))
+        U = linalg.chol_update(U, x)
+        self.assertAllClose(np.dot(U.T, U), K + np.outer(x, x))
+
+    def test_chol_remove(self):
+        """
+        Test removing leading rows and columns from a Cholesky factor.
+        """
+        W = np.random.randn(7, 10)
+        K = np.dot(W, W.T)
+        U = linalg.chol_remove(linalg.chol(K), 3)
+        self.assertAllClose(np.dot(U.T, U), K[3:,3:])
+        self.assertAllClose(U, np.triu(linalg.chol(K[3:,3:])))
+
+
+class TestPackedSymmetric(TestCase):
+
+    def test_pack_symmetric(self):
+        """
+        Test packing and unpacking symmetric matrices.
+        """
+        W = np.random.randn(4, 3, 5)
+        A = np.einsum('...ik,...jk->...ij', W, W)
+        P = linalg.pack_symmetric(A)
+        self.assertEqual(np.shape(P.packed), (4, 6))
+        self.assertEqual(np.shape(P), (4, 3, 3))
+        self.assertAllClose(np.asarray(P), A)
+        self.assertAllClose(2*P - A, A)
+        self.assertAllClose((-P)[1], -A[1])
+
+        # Broadcasted axes are not expanded
+        P = linalg.pack_symmetric(np.broadcast_to(A[0], (100, 3, 3)))
+        self.assertEqual(np.shape(P.packed), (1, 6))
+        self.assertAllClose(np.asarray(P), np.broadcast_to(A[0], (100,3,3)))
+
+    def test_symmetric_inner(self):
+        """
+        Test the inner product of packed symmetric matrices.
+        """
+        W = np.random.randn(2, 4, 3, 5)
+        A = np.einsum('...ik,...jk->...ij', W, W)
+        self.assertAllClose(linalg.symmetric_inner(linalg.pack_symmetric(A[0]),
+                                                   linalg.pack_symmetric(A[1])),
+                            np.einsum('...ij,...ij', A[0], A[1]))
+        self.assertAllClose(linalg.symmetric_inner(A[0],
+                                                   linalg.pack_symmetric(A[1])),
+                            np.einsum('...ij,...ij', A[0], A[1]))
+
+
+class TestSparseCholesky(TestCase):
+
+    def test_decomposition(self):
+        """
+        Test the solve, log-determinant and selected inverse.
+        """
+        # A random sparse positive-definite matrix
+        D = 30
+        W = sparse.random(D, D, density=0.05, random_state=1)
+        A = (W.dot(W.T) + sparse.identity(D)).tocsc()
+        Ad = A.toarray()
+        invA = np.linalg.inv(Ad)
+
+        U = linalg.SparseCholesky(A)
+        b = np.random.randn(D)
+        self.assertAllClose(U.solve(b), np.linalg.solve(Ad, b))
+        self.assertAllClose(U.logdet(), np.linalg.slogdet(Ad)[1])
+
+        # The selected inverse contains at least the pattern of A
+        Z = U.selected_inverse()
+        (i, j) = A.nonzero()
+        self.assertAllClose(np.asarray(Z[i,j]).ravel(), invA[i,j])
+        (i, j) = Z.nonzero()
+        self.assertAllClose(np.asarray(Z[i,j]).ravel(), invA[i,j])
+
+        # Not positive definite
+        self.assertRaises(np.linalg.LinAlgError,
+                          linalg.SparseCholesky,
+                          A - 10*sparse.identity(D))
+
+    def test_selected_inverse(self):
+        """
+        Test the selected inverse with supernodes and a diagonal matrix.
+        """
+        # A grid has large supernodes in the separators
+        n = 12
+        T = sparse.diags([-np.ones(n-1), 2.1*np.ones(n), -np.ones(n-1)],
+                         [-1, 0, 1])
+        A = (sparse.kron(T, sparse.identity(n))
+             + sparse.kron(sparse.identity(n), T)).tocsc()
+        invA = np.linalg.inv(A.toarray())
+        U = linalg.SparseCholesky(A)
+        Z = U.selected_inverse()
+        (i, j) = Z.nonzero()
+        self.assertAllClose(np.asarray(Z[i,j]).ravel(), invA[i,j])
+        (i, j) = A.nonzero()
+        self.assertAllClose(np.asarray(Z[i,j]).ravel(), invA[i,j])
+
+        # The pattern is closed in the elimination tree
+        (indptr, rows, l) = U._pattern()
+        for k in range(n*n):
+            r = rows[indptr[k]:indptr[k+1]]
+            if len(r) > 1:
+                p = rows[indptr[r[0]]:indptr[r[0]+1]]
+                self.assertTrue(np.all(np.in1d(r[1:], p)))
+
+        d = np.random.rand(5) + 1
+        Z = linalg.SparseCholesky(sparse.diags(d, 0)).selected_inverse()
+        self.assertAllClose(Z.toarray(), np.diag(1/d))
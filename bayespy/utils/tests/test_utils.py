@@ -136,6 +136,24 @@ class TestBroadcasting(unittest.TestCase):
         self.assertFalse(f( (4,3,), (1,3,) ))
         self.assertFalse(f( (6,1,4,3,), (6,1,1,3,) ))
 
+    def test_broadcast_to_shape(self):
+        x = np.arange(3)
+        y = utils.broadcast_to_shape(x, (4,3))
+        self.assertEqual(np.shape(y), (4,3))
+        self.assertEqual(y.strides[0], 0)
+        self.assertFalse(y.flags.writeable)
+        self.assertIs(utils.broadcast_to_shape(x, (3,)), x)
+        self.assertRaises(Exception,
+                          utils.broadcast_to_shape,
+                          np.ones((2,3)),
+                          (3,))
+
+    def test_compact_broadcast(self):
+        x = np.broadcast_to(np.arange(3), (2,4,3))
+        self.assertEqual(np.shape(utils.compact_broadcast(x)), (1,1,3))
+        x = np.ones((2,3))
+        self.assertEqual(np.shape(utils.compact_broadcast(x)), (2,3))
+
 class TestMultiplyShapes(unittest.TestCase):
 
     def test_multiply_shapes(self):
@@ -348,3 +366,105 @@ class TestSumMultiply(unittest.TestCase):
                           sumaxis=False,
                           axis=(1,-1))
 
+    def test_sum_multiply_out(self):
+        """
+        Test utils.sum_multiply with a preallocated output array.
+        """
+        x = np.random.randn(3,1,5)
+        y = np.random.randn(4,5)
+        out = np.empty((3,1,1))
+        z = utils.sum_multiply(x, y, axis=(1,2), keepdims=True, out=out)
+        self.assertIs(z, out)
+        testing.assert_allclose(out,
+                                np.sum(x*y, axis=(1,2), keepdims=True))
+        # Scalars
+        out = np.empty(())
+        utils.sum_multiply(np.array(2.0), np.array(3.0), out=out)
+        testing.assert_allclose(out, 6.0)
+        # The output array must be contiguous
+        self.assertRaises(ValueError,
+                          utils.sum_multiply,
+                          x, y,
+                          axis=(1,),
+                          out=np.empty((5,3)).T)
+
+
+class TestLowRankMatrix(utils.TestCase):
+
+    def test_low_rank_matrix(self):
+        """
+        Test the low-rank matrix operations
+        """
+
+        U = np.random.randn(5,2)
+        V = np.random.randn(5,2)
+        d = np.random.rand(5)
+        K = utils.LowRankMatrix(U, V, diagonal=d)
+        A = np.dot(U, V.T) + np.diag(d)
+        self.assertAllClose(K.toarray(), A)
+        self.assertAllClose(K.T.toarray(), A.T)
+        self.assertAllClose(K.diagonal(), np.diag(A))
+        b = np.random.randn(5)
+        self.assertAllClose(K.dot(b), np.dot(A, b))
+        B = np.random.randn(5,3)
+        self.assertAllClose(K.dot(B), np.dot(A, B))
+        self.assertAllClose((2*K).toarray(), 2*A)
+
+        # Sum of low-rank matrices is low-rank
+        S = K + K
+        self.assertIsInstance(S, utils.LowRankMatrix)
+        self.assertAllClose(S.toarray(), 2*A)
+
+        # Diagonal sparse matrices are kept in the structure
+        from scipy import sparse
+        S = K + sparse.identity(5)
+        self.assertIsInstance(S, utils.LowRankMatrix)
+        self.assertAllClose(S.toarray(), A + np.identity(5))
+
+        # Diagonal dense matrices are kept in the structure
+        S = 2*np.identity(5) + K
+        self.assertIsInstance(S, utils.LowRankMatrix)
+        self.assertAllClose(S.toarray(), A + 2*np.identity(5))
+
+        # Other matrices are summed as dense arrays
+        C = np.random.randn(5,5)
+        with self.assertWarns(UserWarning):
+            self.assertAllClose(K + C, A + C)
+        with self.assertWarns(UserWarning):
+            self.assertAllClose(C + K, A + C)
+
+        pass
+
+
+class TestCholeskyLowRank(utils.TestCase):
+
+    def test_cholesky_low_rank(self):
+        """
+        Test the Woodbury decomposition of low-rank matrices
+        """
+
+        U = np.random.randn(6,2)
+        d = 0.5 + np.random.rand(6)
+        K = utils.LowRankMatrix(U, diagonal=d)
+        A = np.dot(U, U.T) + np.diag(d)
+        L = utils.cholesky(K)
+
+        b = np.random.randn(6)
+        self.assertAllClose(L.solve(b), np.linalg.solve(A, b))
+        B = np.random.randn(6,3)
+        self.assertAllClose(L.solve(B), np.linalg.solve(A, B))
+        self.assertAllClose(L.logdet(), np.linalg.slogdet(A)[1])
+
+        # Trace of inv(K)*dK for low-rank dK
+        dK = utils.LowRankMatrix(np.random.randn(6,2),
+                                 np.random.randn(6,2),
+                                 diagonal=np.random.randn(6))
+        self.assertAllClose(L.trace_solve_gradient(dK),
+                            np.trace(np.linalg.solve(A, dK.toarray())))
+
+        # Singular matrix
+        self.assertRaises(np.linalg.LinAlgError,
+                          utils.cholesky,
+                          utils.LowRankMatrix(U))
+
+        pass
@@ -27,6 +27,7 @@ General numerical functions and methods.
 """
 import functools
 import itertools
+import warnings
 
 import numpy as np
 import scipy as sp
@@ -39,6 +40,8 @@ import scipy.sparse as sparse
 
 import tempfile as tmp
 
+from . import jit
+
 import unittest
 from numpy import testing
 
@@ -203,13 +206,178 @@ class CholeskySparse():
         #return (2*np.multiply(iK, dK).sum()
         #        - iK.diagonal().dot(dK.diagonal())) # THIS NOT WORK!!
         #return np.trace(self.solve(dK))
-    
-    
+
+
+class LowRankMatrix():
+    """
+    Matrix of the form U*V' + diag(d).
+
+    The matrix is not formed explicitly, thus U and V can be tall
+    (N x M with M << N).  Low-rank covariance functions (e.g., random
+    Fourier features) return these matrices.
+    """
+
+    # Make NumPy arrays use the reflected operators of this class
+    __array_priority__ = 20
+
+    def __init__(self, U, V=None, diagonal=None):
+        self.U = np.atleast_2d(U)
+        if V is None:
+            V = self.U
+        self.V = np.atleast_2d(V)
+        if np.shape(self.U)[1] != np.shape(self.V)[1]:
+            raise ValueError("The factors must have the same number of "
+                             "columns")
+        self.d = diagonal
+        if self.d is not None and np.shape(self.U)[0] != np.shape(self.V)[0]:
+            raise ValueError("Only square matrices can have a diagonal "
+                             "term")
+        self.shape = (np.shape(self.U)[0], np.shape(self.V)[0])
+
+    @property
+    def T(self):
+        return LowRankMatrix(self.V, self.U, diagonal=self.d)
+
+    def dot(self, b):
+        if sparse.issparse(b):
+            b = b.toarray()
+        y = np.dot(self.U, np.dot(self.V.T, b))
+        if self.d is not None:
+            if np.ndim(b) == 1:
+                y += self.d * b
+            else:
+                y += self.d[:,np.newaxis] * b
+        return y
+
+    def diagonal(self):
+        d = np.einsum('ij,ij->i', self.U, self.V)
+        if self.d is not None:
+            d += self.d
+        return d
+
+    def toarray(self):
+        K = np.dot(self.U, self.V.T)
+        if self.d is not None:
+            K[np.diag_indices_from(K)] += self.d
+        return K
+
+    def __mul__(self, c):
+        if np.ndim(c) != 0:
+            raise ValueError("Low-rank matrices support only scalar "
+                             "multiplication")
+        d = self.d * c if self.d is not None else None
+        return LowRankMatrix(c*self.U, self.V, diagonal=d)
+
+    __rmul__ = __mul__
+    multiply = __mul__
+
+    def __add__(self, other):
+        if isinstance(other, LowRankMatrix):
+            if other.shape != self.shape:
+                raise ValueError("Matrix shapes do not match")
+            if self.d is None:
+                d = other.d
+            elif other.d is None:
+                d = self.d
+            else:
+                d = self.d + other.d
+            return LowRankMatrix(np.hstack([self.U, other.U]),
+                                 np.hstack([self.V, other.V]),
+                                 diagonal=d)
+        elif sparse.issparse(other):
+            if other.nnz == 0:
+                return self
+            if (self.shape[0] == self.shape[1]
+                and sparse.triu(other, k=1).nnz == 0
+                and sparse.tril(other, k=-1).nnz == 0):
+                # Diagonal noise can be kept in the structure
+                d = other.diagonal()
+                if self.d is not None:
+                    d = d + self.d
+                return LowRankMatrix(self.U, self.V, diagonal=d)
+            other = other.toarray()
+        elif (np.ndim(other) == 2 and self.shape[0] == self.shape[1]
+              and np.shape(other) == self.shape
+              and not np.any(other[~np.eye(self.shape[0], dtype=bool)])):
+            # Diagonal noise given as a dense matrix
+            d = np.diag(other)
+            if self.d is not None:
+                d = d + self.d
+            return LowRankMatrix(self.U, self.V, diagonal=d)
+        # Fall back to dense matrices
+        warnings.warn("Adding a non-diagonal matrix to a low-rank matrix "
+                      "forms the dense matrix")
+        return self.toarray() + other
+
+    __radd__ = __add__
+
+
+class CholeskyLowRank():
+    """
+    Decomposition of U*U' + diag(d) using the Woodbury identity.
+
+    Solving and computing the log-determinant cost O(N*M^2), where M is
+    the rank of the low-rank part.
+    """
+
+    def __init__(self, K):
+        if K.d is None or np.any(K.d <= 0):
+            raise linalg.LinAlgError("Low-rank matrix must have positive "
+                                     "diagonal term to be invertible")
+        if K.U is not K.V and not np.allclose(K.U, K.V):
+            raise linalg.LinAlgError("Low-rank matrix is not symmetric")
+        self.U = K.U
+        self.d = K.d
+        # W = inv(diag(d)) * U
+        self.W = self.U / self.d[:,np.newaxis]
+        # A = I + U' * inv(diag(d)) * U
+        A = np.dot(self.U.T, self.W)
+        A[np.diag_indices_from(A)] += 1
+        self.A = linalg.cho_factor(A)
+
+    def solve(self, b):
+        if sparse.issparse(b):
+            b = b.toarray()
+        if np.ndim(b) == 1:
+            x = b / self.d
+        else:
+            x = b / self.d[:,np.newaxis]
+        return x - np.dot(self.W, linalg.cho_solve(self.A, np.dot(self.U.T, x)))
+
+    def logdet(self):
+        # Matrix determinant lemma
+        return (np.sum(np.log(self.d))
+                + 2*np.sum(np.log(np.diag(self.A[0]))))
+
+    def inv_diagonal(self):
+        return (1/self.d
+                - np.einsum('ij,ji->i',
+                            self.W,
+                            linalg.cho_solve(self.A, self.W.T)))
+
+    def trace_solve_gradient(self, dK):
+        if isinstance(dK, LowRankMatrix):
+            # trace(inv(K)*U*V') = sum(V .* (inv(K)*U))
+            t = np.sum(dK.V * self.solve(dK.U))
+            if dK.d is not None:
+                t += np.dot(self.inv_diagonal(), dK.d)
+            return t
+        elif (sparse.issparse(dK)
+              and sparse.triu(dK, k=1).nnz == 0
+              and sparse.tril(dK, k=-1).nnz == 0):
+            # Diagonal matrix
+            return np.dot(self.inv_diagonal(), dK.diagonal())
+        else:
+            return np.trace(self.solve(dK))
+
+
 def cholesky(K):
     if isinstance(K, np.ndarray):
         return CholeskyDense(K)
     elif sparse.issparse(K):
         return CholeskySparse(K)
+    elif isinstance(K, LowRankMatrix):
+        return CholeskyLowRank(K)
     else:
         raise Exception("Unsupported covariance matrix type")
     
@@ -416,10 +584,37 @@ def sum_to_dim(A, dim):
         A = np.sum(A, axis=axes)
     return A
 
-def sum_multiply(*args, axis=None, sumaxis=True, keepdims=False):
+def einsum_shape(*args):
+    """
+    Compute the shape of the result of np.einsum in the sublist format.
+
+    The arguments are given as for np.einsum: operands and their keys
+    alternately, and the keys of the output as the last argument.
+    """
+    args = list(args)
+    args[0:-1:2] = [np.shape(x) for x in args[0:-1:2]]
+    return einsum_shape_from_shapes(*args)
+
+def einsum_shape_from_shapes(*args):
+    """
+    Compute the shape of the result of np.einsum from the operand shapes.
+
+    The arguments are as for `einsum_shape` but the operands are replaced
+    by their shapes, thus the shape can be computed before the operands
+    exist.
+    """
+    sizes = dict()
+    for (shape, keys) in zip(args[0:-1:2], args[1:-1:2]):
+        for (key, d) in zip(keys, shape):
+            if d != 1 or key not in sizes:
+                sizes[key] = d
+    return tuple(sizes[key] for key in args[-1])
+
+def sum_multiply(*args, axis=None, sumaxis=True, keepdims=False, out=None):
 
     # Computes sum(arg[0]*arg[1]*arg[2]*..., axis=axes_to_sum) without
-    # explicitly computing the intermediate product
+    # explicitly computing the intermediate product.  If out is given, the
+    # result is written into it and it must have the shape of the result.
 
     if len(args) == 0:
         raise ValueError("You must give at least one input array")
@@ -467,8 +662,17 @@ def sum_multiply(*args, axis=None, sumaxis=True, keepdims=False):
     pairs.append(axes)
 
     # Compute the sum-product
+    if out is not None:
+        # Write the result into the given array (reshaping a contiguous array
+        # does not copy)
+        if not out.flags.c_contiguous:
+            raise ValueError("The output array must be C-contiguous")
+        y = np.reshape(out, einsum_shape(*pairs))
     try:
-        y = np.einsum(*pairs)
+        if out is not None:
+            np.einsum(*pairs, out=y)
+        else:
+            y = np.einsum(*pairs)
     except ValueError as err:
         if str(err) == ("If 'op_axes' or 'itershape' is not NULL in "
                         "theiterator constructor, 'oa_ndim' must be greater "
@@ -477,10 +681,16 @@ def sum_multiply(*args, axis=None, sumaxis=True, keepdims=False):
             # scalars, it raises an error. For scalars we can just use multiply
             # and forget about summing. Hopefully, in the future, einsum handles
             # scalars properly and this try-except becomes unnecessary.
-            y = functools.reduce(np.multiply, args)
+            if out is not None:
+                np.copyto(y, functools.reduce(np.multiply, args))
+            else:
+                y = functools.reduce(np.multiply, args)
         else:
             raise err
 
+    if out is not None:
+        return out
+
     # Restore summed axes as singleton axes
     if keepdims:
         d = 0
@@ -673,6 +883,34 @@ def repeat_to_shape(A, s):
                 A = np.repeat(A, s[i], axis=i)
     return A
 
+def broadcast_to_shape(A, s):
+    """
+    Broadcast an array to the given shape without copying the data.
+
+    Unlike `repeat_to_shape`, the result is a read-only view in which the
+    repeated axes have zero stride.  Thus, the result must not be modified
+    in-place.
+    """
+    A = np.asanyarray(A)
+    if np.shape(A) == tuple(s):
+        return A
+    if np.ndim(A) > len(s):
+        raise Exception("Can't repeat to a smaller shape")
+    return np.broadcast_to(A, s)
+
+def compact_broadcast(A):
+    """
+    Collapse the zero-stride axes of an array to unit length.
+
+    The result is a view which broadcasts to the original array.  This is
+    useful for finding the axes of a broadcast view that contain actual
+    data.
+    """
+    A = np.asanyarray(A)
+    index = tuple(slice(0, 1) if (stride == 0 and n > 1) else slice(None)
+                  for (stride, n) in zip(A.strides, np.shape(A)))
+    return A[index]
+
 #def spinv_chol(L):
     
 
@@ -786,15 +1024,11 @@ def m_chol(C):
     # Computes Cholesky decomposition for a collection of matrices.
     # The last two axes of C are considered as the matrix.
     C = np.atleast_2d(C)
-    U = np.empty(np.shape(C))
-    #print('m_chol', C)
-    for i in nested_iterator(np.shape(U)[:-2]):
-        try:
-            U[i] = linalg.cho_factor(C[i])[0]
-        except np.linalg.linalg.LinAlgError:
-            print(C[i])
-            raise Exception("Matrix not positive definite")
-    return U
+    try:
+        # Batched kernel for all the matrices at once
+        return jit.chol(C)
+    except np.linalg.linalg.LinAlgError:
+        raise Exception("Matrix not positive definite")
 
 
 def m_chol_solve(U, B, out=None):
@@ -808,6 +1042,15 @@ def m_chol_solve(U, B, out=None):
     l_u = len(sh_u)
     l_b = len(sh_b)
 
+    if sh_u == broadcasted_shape(sh_u, sh_b):
+        # Each vector has its own matrix (or B is broadcasted), thus
+        # use the batched kernel
+        X = jit.chol_solve(U, np.broadcast_to(B, sh_u + B.shape[-1:]))
+        if out is None:
+            return X
+        out[...] = X
+        return out
+
     # Check which axis are iterated over with B along with U
     ind_b = [Ellipsis] * l_b
     l_min = min(l_u, l_b)
@@ -853,14 +1096,7 @@ def m_chol_solve(U, B, out=None):
     
 
 def m_chol_inv(U):
-    # Allocate memory
-    V = np.tile(np.identity(np.shape(U)[-1]), np.shape(U)[:-2]+(1,1))
-    for i in nested_iterator(np.shape(U)[:-2]):
-        V[i] = linalg.cho_solve((U[i], False),
-                                V[i],
-                                overwrite_b=True) # This would need Fortran order
-        
-    return V
+    return jit.chol_inv(U)
     
 
 def m_chol_logdet(U):